@@ -0,0 +1,152 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# --- RECEIVABLES AGING ---
+# Outstanding per invoice / per (invoice, quote) line with ONE grouped payment sum,
+# then bucketed by days past due relative to an as-of date. Everything is column-wise,
+# so a million invoice lines is a few groupbys, not a million filters.
+
+BUCKET_EDGES = [-np.inf, 0, 30, 60, 90, np.inf]
+BUCKET_LABELS = ['Not Due', '1-30', '31-60', '61-90', '90+']
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def _num(s):
+    return pd.to_numeric(s, errors='coerce').fillna(0.0)
+
+
+def invoice_outstanding(df_i, df_p):
+    """One row per invoice (app12 model): Business, Date, Billed, Collected, Outstanding."""
+    inv = pd.DataFrame({
+        'Invoice_No': _str(df_i['Invoice_No']),
+        'Business': df_i['Business'],
+        'Date': pd.to_datetime(df_i['Date'], errors='coerce'),
+        'Billed': _num(df_i['Split_Amount']),
+    })
+    out = inv.groupby('Invoice_No', sort=False).agg(
+        Business=('Business', 'first'), Date=('Date', 'min'), Billed=('Billed', 'sum'))
+
+    paid = _num(df_p['Amount']).groupby(_str(df_p['Invoice_Ref'])).sum() if not df_p.empty else pd.Series(dtype=float)
+    out['Collected'] = paid.reindex(out.index).fillna(0.0).values
+    out['Outstanding'] = out['Billed'] - out['Collected']
+    return out.reset_index()
+
+
+def quote_outstanding(df_q, df_i, df_p):
+    """
+    One row per (invoice, quote) line with Project_Name attached.
+    Allocated payments (Quote_Ref set) go to their quote; unallocated ones are spread
+    pro-rata by billed share, so the lines of an invoice always add up to the invoice total.
+    """
+    lines = pd.DataFrame({
+        'Invoice_No': _str(df_i['Invoice_No']),
+        'Quote_Ref': _str(df_i['Quote_Ref']),
+        'Business': df_i['Business'],
+        'Date': pd.to_datetime(df_i['Date'], errors='coerce'),
+        'Billed': _num(df_i['Split_Amount']),
+    })
+    lines = lines.groupby(['Invoice_No', 'Quote_Ref'], sort=False).agg(
+        Business=('Business', 'first'), Date=('Date', 'min'), Billed=('Billed', 'sum')).reset_index()
+
+    if df_p.empty:
+        lines['Collected'] = 0.0
+    else:
+        p = pd.DataFrame({'Invoice_Ref': _str(df_p['Invoice_Ref']),
+                          'Quote_Ref': _str(df_p['Quote_Ref']) if 'Quote_Ref' in df_p.columns else "",
+                          'Amount': _num(df_p['Amount'])})
+        allocated = p['Quote_Ref'].str.len() > 0
+        direct = p[allocated].groupby(['Invoice_Ref', 'Quote_Ref'])['Amount'].sum().rename('_direct')
+        pooled = p[~allocated].groupby('Invoice_Ref')['Amount'].sum().rename('_pooled')
+
+        lines = lines.join(direct, on=['Invoice_No', 'Quote_Ref']).join(pooled, on='Invoice_No')
+        inv_billed = lines.groupby('Invoice_No')['Billed'].transform('sum')
+        share = (lines['Billed'] / inv_billed.where(inv_billed != 0)).fillna(0.0)
+        lines['Collected'] = lines['_direct'].fillna(0.0) + lines['_pooled'].fillna(0.0) * share
+        lines = lines.drop(columns=['_direct', '_pooled'])
+
+    lines['Outstanding'] = lines['Billed'] - lines['Collected']
+
+    names = df_q.drop_duplicates('Quote_ID')
+    names = pd.Series(names['Project_Name'].values, index=_str(names['Quote_ID']))
+    lines['Project_Name'] = lines['Quote_Ref'].map(names).fillna(lines['Quote_Ref'])
+    return lines
+
+
+def legacy_invoice_outstanding(df_inv, df_pay):
+    """Same as invoice_outstanding for the app.py layout (Total_Amount / Amount_Received)."""
+    if df_inv.empty:
+        return pd.DataFrame(columns=['Invoice_No', 'Business', 'Project_Name', 'Date', 'Billed', 'Collected', 'Outstanding'])
+
+    inv = pd.DataFrame({
+        'Invoice_No': _str(df_inv['Invoice_No']),
+        'Business': df_inv['Business_Unit'],
+        'Project_Name': df_inv['Project_Name'],
+        'Date': pd.to_datetime(df_inv['Date'], errors='coerce'),
+        'Billed': _num(df_inv['Total_Amount']),
+    })
+    out = inv.groupby('Invoice_No', sort=False).agg(
+        Business=('Business', 'first'), Project_Name=('Project_Name', 'first'),
+        Date=('Date', 'min'), Billed=('Billed', 'sum'))
+
+    if not df_pay.empty:
+        paid = _num(df_pay['Amount_Received']).groupby(_str(df_pay['Invoice_Ref'])).sum()
+    else:
+        paid = pd.Series(dtype=float)
+    out['Collected'] = paid.reindex(out.index).fillna(0.0).values
+    out['Outstanding'] = out['Billed'] - out['Collected']
+    return out.reset_index()
+
+
+def age_outstanding(df, as_of, terms_days=0, min_due=0.01):
+    """Keep open items (Outstanding > min_due) and add Days_Overdue + Bucket relative to `as_of`."""
+    open_items = df[df['Outstanding'] > min_due].copy()
+    as_of = pd.Timestamp(as_of).normalize()
+    due_date = pd.to_datetime(open_items['Date'], errors='coerce').dt.normalize() + pd.Timedelta(days=int(terms_days))
+    days = (as_of - due_date).dt.days
+    open_items['Days_Overdue'] = days.astype('Int64')
+    # Undated items have no due date; treat them as the oldest bucket rather than hiding them
+    open_items['Bucket'] = pd.cut(days.fillna(np.inf), bins=BUCKET_EDGES, labels=BUCKET_LABELS)
+    return open_items
+
+
+def aging_table(aged, by):
+    """Pivot aged items into one row per `by` key and one column per bucket (+ Total)."""
+    by = [by] if isinstance(by, str) else list(by)
+    if aged.empty:
+        return pd.DataFrame(columns=by + BUCKET_LABELS + ['Total'])
+    table = aged.pivot_table(index=by, columns='Bucket', values='Outstanding',
+                             aggfunc='sum', fill_value=0.0, observed=False)
+    table = table.reindex(columns=BUCKET_LABELS, fill_value=0.0)
+    table.columns = [str(c) for c in table.columns]
+    table['Total'] = table.sum(axis=1)
+    return table.sort_values('Total', ascending=False).reset_index()
+
+
+# --- STREAMLIT VIEW ---
+def render_aging(lines, by, key, as_of=None, money="{:,.0f}"):
+    """
+    As-of picker + bucket metrics + aging table + open items, for either app.
+    `lines`: invoice_outstanding / quote_outstanding / legacy_invoice_outstanding rows.
+    """
+    import streamlit as st  # only the apps render; the engine above stays importable without it
+
+    a1, a2 = st.columns(2)
+    as_of = a1.date_input("Aging as of", value=as_of or datetime.today(), key=f"{key}_asof")
+    terms = a2.number_input("Payment terms (days)", min_value=0, value=0, step=15, key=f"{key}_terms")
+
+    aged = age_outstanding(lines, as_of, terms)
+    if aged.empty:
+        st.success("🎉 Nothing outstanding.")
+        return
+
+    totals = aged.groupby('Bucket', observed=False)['Outstanding'].sum()
+    for col, label in zip(st.columns(len(BUCKET_LABELS)), BUCKET_LABELS):
+        col.metric(label if label == 'Not Due' else f"{label} days", money.format(totals.get(label, 0.0)))
+
+    st.dataframe(aging_table(aged, by), use_container_width=True, hide_index=True)
+    with st.expander(f"📋 Open items ({len(aged)})"):
+        st.dataframe(aged.sort_values('Days_Overdue', ascending=False), use_container_width=True, hide_index=True)
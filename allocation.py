@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+# --- PAYMENT ALLOCATION ENGINE ---
+# Splits a received amount across the quotation lines of an invoice.
+# Dues for every (invoice, quote) pair come from ONE grouped pass over the Payments sheet;
+# the policies below only ever look at the small per-invoice slice of that table.
+
+OLDEST_FIRST = 'Oldest First'
+PRO_RATA = 'Pro-Rata by Due'
+EXACT_MATCH = 'Exact Match'
+POLICIES = [OLDEST_FIRST, PRO_RATA, EXACT_MATCH]
+
+CENT = 0.005
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def quote_dues(df_i, df_p, df_q=None):
+    """
+    Billed / Paid / Due per (Invoice_No, Quote_Ref).
+    Paid only counts payment lines allocated to that quote (same rule as the Payments form).
+    Quote_Date (from df_q, else the invoice date) drives the oldest-first order.
+    """
+    lines = pd.DataFrame({
+        'Invoice_No': _str(df_i['Invoice_No']),
+        'Quote_Ref': _str(df_i['Quote_Ref']),
+        'Inv_Date': pd.to_datetime(df_i['Date'], errors='coerce'),
+        'Billed': pd.to_numeric(df_i['Split_Amount'], errors='coerce').fillna(0.0),
+    })
+    dues = lines.groupby(['Invoice_No', 'Quote_Ref']).agg(Billed=('Billed', 'sum'), Inv_Date=('Inv_Date', 'min'))
+
+    if not df_p.empty:
+        paid = pd.to_numeric(df_p['Amount'], errors='coerce').fillna(0.0).groupby(
+            [_str(df_p['Invoice_Ref']), _str(df_p['Quote_Ref'])]).sum()
+        paid.index.names = ['Invoice_No', 'Quote_Ref']
+        dues['Paid'] = paid.reindex(dues.index).fillna(0.0)
+    else:
+        dues['Paid'] = 0.0
+    dues['Due'] = (dues['Billed'] - dues['Paid']).clip(lower=0.0)
+    dues = dues.reset_index()
+
+    dues['Quote_Date'] = dues['Inv_Date']
+    if df_q is not None and not df_q.empty:
+        qd = df_q.drop_duplicates('Quote_ID')
+        q_dates = pd.Series(pd.to_datetime(qd['Date'], errors='coerce').values, index=_str(qd['Quote_ID']))
+        dues['Quote_Date'] = dues['Quote_Ref'].map(q_dates).fillna(dues['Inv_Date'])
+    return dues.drop(columns=['Inv_Date'])
+
+
+def _oldest_first(due, amount):
+    # Money fills each quote's due in turn: overlap of [0, amount) with the cumulative due intervals
+    upper = np.cumsum(due)
+    lower = upper - due
+    return np.clip(np.minimum(upper, amount) - lower, 0.0, None)
+
+
+def _pro_rata(due, billed, amount):
+    weights = due if due.sum() > CENT else billed
+    if weights.sum() <= CENT:
+        weights = np.ones_like(due)
+    return amount * weights / weights.sum()
+
+
+def propose_allocation(dues, amount, policy=OLDEST_FIRST):
+    """
+    Allocation for ONE payment over one invoice's rows of `quote_dues`.
+    Returns a Series Quote_Ref -> amount that always sums to `amount` (to the cent).
+    Anything above the total due (over-payment) is parked on the most recent quote.
+    """
+    if dues.empty:
+        return pd.Series(dtype=float)
+
+    dues = dues.sort_values(['Quote_Date', 'Quote_Ref'], na_position='last')
+    alloc = _split(dues['Due'].to_numpy(dtype=float), dues['Billed'].to_numpy(dtype=float), amount, policy)
+    return pd.Series(alloc, index=dues['Quote_Ref'].to_numpy())
+
+
+def _split(due, billed, amount, policy):
+    """propose_allocation on plain arrays already in allocation order."""
+    amount = float(amount)
+    if policy == PRO_RATA:
+        alloc = _pro_rata(due, billed, min(amount, due.sum()) if due.sum() > CENT else amount)
+    elif policy == EXACT_MATCH:
+        hits = np.flatnonzero(np.abs(due - amount) < CENT)
+        if len(hits):
+            # Payment equals one quote's due -> the oldest such quote takes all of it
+            alloc = np.zeros_like(due)
+            alloc[hits[0]] = amount
+        else:
+            # No single-quote match (covers "pays the whole invoice" too) -> oldest first
+            alloc = _oldest_first(due, amount)
+    else:
+        alloc = _oldest_first(due, amount)
+
+    excess = amount - alloc.sum()
+    if excess > CENT:
+        alloc[-1] += excess
+    # Cent rounding drift goes to the biggest line so the split always equals the receipt
+    alloc = np.round(alloc, 2)
+    alloc[np.argmax(alloc)] += round(amount - alloc.sum(), 2)
+    return alloc
+
+
+def payment_rows(parent_id, inv_no, allocation, p_date, proof="None", form_c="None", decl="None"):
+    """Per-quote payment lines exactly as the Payments form writes them (zero lines skipped)."""
+    rows = []
+    line_no = 0
+    for qref, amt in allocation.items():
+        if float(amt) <= 0:
+            continue
+        line_no += 1
+        rows.append({
+            'Payment_ID': f"{parent_id}-{line_no}",
+            'Parent_Payment_ID': parent_id,
+            'Invoice_Ref': str(inv_no),
+            'Quote_Ref': str(qref),
+            'Date': p_date,
+            'Amount': float(amt),
+            'Proof_File': proof,
+            'Form_C_File': form_c,
+            'Payment_Decl_File': decl
+        })
+    return rows
+
+
+def allocate_payments(payments, dues, policy=OLDEST_FIRST):
+    """
+    Bulk version: `payments` has Parent_Payment_ID, Invoice_Ref, Amount, Date (+ optional file columns).
+    Payments against the same invoice are applied in date order, each one seeing the dues left
+    by the previous. Returns a DataFrame of payment lines ready to concat onto df_p.
+    """
+    out = []
+    # each invoice's dues as arrays in allocation order; a payment is one _split() + an array update
+    dues = dues.sort_values(['Quote_Date', 'Quote_Ref'], na_position='last')
+    by_inv = dues.groupby('Invoice_No', sort=False).indices
+    refs = dues['Quote_Ref'].to_numpy()
+    billed_all, paid_all = dues['Billed'].to_numpy(dtype=float), dues['Paid'].to_numpy(dtype=float)
+
+    payments = payments.sort_values('Date', kind='stable')
+    cols = {c: payments[c].tolist() if c in payments.columns else ["None"] * len(payments)
+            for c in ('Parent_Payment_ID', 'Amount', 'Date', 'Proof_File', 'Form_C_File', 'Payment_Decl_File')}
+    inv_refs = payments['Invoice_Ref'].astype(str).to_numpy()
+    by_pay = payments.groupby(inv_refs, sort=False).indices
+    for inv_no in dict.fromkeys(inv_refs):  # invoices in order of their first payment
+        pos, rows = by_pay[inv_no], by_inv.get(inv_no)
+        if rows is None:
+            continue
+        billed, paid = billed_all[rows], paid_all[rows].copy()
+        for k in pos:
+            alloc = _split((billed - paid).clip(min=0.0), billed, cols['Amount'][k], policy)
+            out.extend(payment_rows(
+                cols['Parent_Payment_ID'][k], inv_no, dict(zip(refs[rows], alloc)), cols['Date'][k],
+                cols['Proof_File'][k], cols['Form_C_File'][k], cols['Payment_Decl_File'][k]))
+            paid += alloc
+
+    return pd.DataFrame(out, columns=['Payment_ID', 'Parent_Payment_ID', 'Invoice_Ref', 'Quote_Ref', 'Date', 'Amount',
+                                      'Proof_File', 'Form_C_File', 'Payment_Decl_File'])
@@ -0,0 +1,476 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from schema import MASTER_SHEETS, write_stamp
+from ledger_service import LedgerService
+from hierarchy import build_hierarchy
+from ledger import iter_ledger_rows, write_ledger_sheet, LEDGER_SHEET
+from rollups import business_rollup, quote_rollup
+from allocation import quote_dues, allocate_payments, payment_rows, POLICIES, CENT
+from dedup import normalize_invoice_no, find_invoice_nos, register_invoices
+from archive import archived_invoice_numbers
+from ids import new_id
+
+# --- HEADLESS LEDGER API ---
+# JSON over HTTP on localhost for scripts that post quotes / invoices / payments into app12.py's ledger
+# (Finance_Master_V5.xlsx) without driving the Streamlit forms:
+#   reads : served from the LedgerService view kept in memory; per-version indexes (by business, by
+#           invoice, hierarchy, rollups) are built once through view.derived() and shared by all requests
+#   writes: every POST is one request of quotes + invoices + payments, validated as a unit (all or
+#           nothing). One writer thread takes the requests waiting in the queue and applies them in
+#           arrival order in ONE commit (group commit), so a burst of 200 single payments costs one
+#           workbook write instead of 200. Validation is set lookups; payments left to a policy are
+#           allocated once per group (allocate_payments, date order per invoice). The commit holds the
+#           same locks as the apps' saves. The workbook keeps app12's Master_Ledger_View sheet: it is
+#           rebuilt, for the business it already shows, from the committed rows.
+# Rules are the forms' rules: invoices need a known quote and a new number (ledger, archive and app.py's
+# numbers in the dedup index), payments need a known invoice and are allocated per quote - explicitly
+# (Allocation) or by a policy of allocation.py. A Payment_ID that is already booked is refused, so a
+# retried POST never books a payment twice.
+#
+# python api.py [--port 8765]
+#   GET  /health                                version, row counts, writer stats
+#   GET  /quotes?business=   /invoices?business=&quote=   /payments?invoice=
+#   GET  /ledger?business=   /rollup   /quotes/rollup?business=   /dues?invoice=
+#   POST /quotes  /invoices  /payments  /batch  {"quotes": [...], "invoices": [...], "payments": [...]}
+
+FILE = 'Finance_Master_V5.xlsx'
+HOST = '127.0.0.1'  # no authentication: keep it on localhost
+PORT = 8765
+GROUP_MAX = 500  # requests folded into one commit
+
+
+class ApiError(Exception):
+    def __init__(self, errors, status=400):
+        super().__init__("; ".join(errors) if isinstance(errors, list) else errors)
+        self.errors = errors if isinstance(errors, list) else [errors]
+        self.status = status
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def _text(item, key, default=""):
+    value = item.get(key)
+    return default if value is None else str(value).strip() or default
+
+
+def _date(item, key, errors, where):
+    value = item.get(key)
+    if value in (None, ""):
+        return pd.Timestamp(datetime.today().date())
+    d = pd.to_datetime(value, errors='coerce')
+    if pd.isna(d):
+        errors.append(f"{where}: {key} {value!r} is not a date")
+    return d
+
+
+def _amount(item, key, errors, where, positive=False):
+    try:
+        value = float(item.get(key, 0.0) or 0.0)
+    except (TypeError, ValueError):
+        errors.append(f"{where}: {key} {item.get(key)!r} is not a number")
+        return 0.0
+    if value < 0 or (positive and value <= 0):
+        errors.append(f"{where}: {key} must be {'positive' if positive else 'zero or more'}")
+    return value
+
+
+def _items(body, key):
+    items = body.get(key) or []
+    items = [items] if isinstance(items, dict) else items
+    if not isinstance(items, list) or not all(isinstance(it, dict) for it in items):
+        raise ApiError(f"'{key}' must be an object or a list of objects")
+    return items
+
+
+# --- WRITES ---
+class Batch:
+    """
+    One group commit: the ledger it starts from, what validation needs to know about it, and the rows
+    of the requests accepted so far. Rows are concatenated and policy payments allocated once, in frames().
+    """
+
+    def __init__(self, frames):
+        self.base = frames
+        df_q, df_i, df_p = frames['Quotations'], frames['Invoices'], frames['Payments']
+        self.quote_biz = dict(zip(_str(df_q['Quote_ID']), _str(df_q['Business'])))
+        self.quote_ids = set(self.quote_biz) | set(_str(frames['Archived']['Quote_ID']))
+        self.booked = {normalize_invoice_no(n) for n in _str(df_i['Invoice_No'])}
+        self.booked |= {normalize_invoice_no(n) for n in archived_invoice_numbers(frames['Archived'])[0]}
+        self.inv_quotes = {}
+        for no, q in zip(_str(df_i['Invoice_No']), _str(df_i['Quote_Ref'])):
+            self.inv_quotes.setdefault(no, set()).add(q)
+        self.payment_ids = set(_str(df_p['Payment_ID'])) | set(_str(df_p['Parent_Payment_ID']))
+        self.rows = {'Quotations': [], 'Invoices': [], 'Payments': []}
+        self.auto = []  # (policy, payment) to allocate per quote
+        self.invoices = []  # booked invoice numbers for the dedup index
+
+    def accept(self, q_rows, i_rows, manual, auto, policy):
+        for r in q_rows:
+            self.quote_biz[r['Quote_ID']] = r['Business']
+            self.quote_ids.add(r['Quote_ID'])
+        for r in i_rows:
+            self.booked.add(normalize_invoice_no(r['Invoice_No']))
+            self.inv_quotes.setdefault(r['Invoice_No'], set()).add(r['Quote_Ref'])
+        self.payment_ids |= {r['Payment_ID'] for r in manual} | {r['Parent_Payment_ID'] for r in manual + auto}
+        self.rows['Quotations'] += q_rows
+        self.rows['Invoices'] += i_rows
+        self.rows['Payments'] += manual
+        self.auto += [(policy, p) for p in auto]
+        self.invoices += [{'invoice_no': r['Invoice_No'], 'business': r['Business']} for r in i_rows]
+
+    def frames(self):
+        out = dict(self.base)
+        for sheet, rows in self.rows.items():
+            if rows:
+                out[sheet] = pd.concat([out[sheet], pd.DataFrame(rows)], ignore_index=True)
+        for policy in dict.fromkeys(p for p, _ in self.auto):
+            # one allocation pass per policy, over the touched invoices only, in date order per invoice
+            pays = pd.DataFrame([p for pol, p in self.auto if pol == policy])
+            df_i, df_p = out['Invoices'], out['Payments']
+            sub_i = df_i[_str(df_i['Invoice_No']).isin(set(pays['Invoice_Ref']))]
+            sub_p = df_p[_str(df_p['Invoice_Ref']).isin(set(pays['Invoice_Ref']))]
+            sub_q = out['Quotations'][_str(out['Quotations']['Quote_ID']).isin(set(_str(sub_i['Quote_Ref'])))]
+            lines = allocate_payments(pays, quote_dues(sub_i, sub_p, sub_q), policy)
+            out['Payments'] = pd.concat([df_p, lines], ignore_index=True)
+        return out
+
+
+def _quote_rows(items, batch, errors):
+    rows, new_ids = [], set()
+    for k, it in enumerate(items):
+        where = f"quotes[{k}]"
+        qid, biz, name = _text(it, 'Quote_ID') or new_id('QT'), _text(it, 'Business'), _text(it, 'Project_Name')
+        if not biz or not name:
+            errors.append(f"{where}: Business and Project_Name are required")
+            continue
+        if qid in batch.quote_ids or qid in new_ids:
+            errors.append(f"{where}: Quote_ID {qid} already exists")
+            continue
+        new_ids.add(qid)
+        rows.append({'Quote_ID': qid, 'Date': _date(it, 'Date', errors, where), 'Business': biz,
+                     'Project_Name': name, 'Total_Value': _amount(it, 'Total_Value', errors, where),
+                     'Agreement_File': _text(it, 'Agreement_File', "None"), 'Status': _text(it, 'Status', "Open")})
+    return rows
+
+
+def _invoice_rows(items, batch, q_rows, errors):
+    new_quotes = {r['Quote_ID']: r['Business'] for r in q_rows}
+    rows, new_nos = [], {}
+    for k, it in enumerate(items):
+        where = f"invoices[{k}]"
+        no, qref = _text(it, 'Invoice_No'), _text(it, 'Quote_Ref')
+        biz = batch.quote_biz.get(qref) or new_quotes.get(qref)
+        if not no or biz is None:
+            errors.append(f"{where}: Invoice_No and a known Quote_Ref are required")
+            continue
+        key = normalize_invoice_no(no)
+        if _text(it, 'Business', biz) != biz:
+            errors.append(f"{where}: quote {qref} belongs to {biz}")
+        elif key in batch.booked:
+            errors.append(f"{where}: Invoice No '{no}' is already booked")
+        elif new_nos.setdefault(key, biz) != biz:  # lines of one invoice may split over quotes of one unit
+            errors.append(f"{where}: Invoice No '{no}' used for two businesses")
+        rows.append({'Invoice_No': no, 'Quote_Ref': qref, 'Date': _date(it, 'Date', errors, where), 'Business': biz,
+                     'Split_Amount': _amount(it, 'Split_Amount', errors, where, positive=True),
+                     'Description': _text(it, 'Description'), 'Invoice_File': _text(it, 'Invoice_File', "None"),
+                     'Declaration_File': _text(it, 'Declaration_File', "None")})
+    return rows
+
+
+def _payment_rows(items, batch, i_rows, errors):
+    """(explicitly allocated payment lines, payments left to the allocation policy)"""
+    new_invs = {}
+    for r in i_rows:
+        new_invs.setdefault(r['Invoice_No'], set()).add(r['Quote_Ref'])
+    manual, auto, new_ids = [], [], set()
+    for k, it in enumerate(items):
+        where = f"payments[{k}]"
+        inv, parent = _text(it, 'Invoice_Ref'), _text(it, 'Payment_ID') or new_id('PAY')
+        amount, p_date = _amount(it, 'Amount', errors, where, positive=True), _date(it, 'Date', errors, where)
+        quotes = batch.inv_quotes.get(inv) or new_invs.get(inv)
+        if quotes is None:
+            errors.append(f"{where}: unknown Invoice_Ref {inv!r}")
+            continue
+        if parent in batch.payment_ids or parent in new_ids:
+            errors.append(f"{where}: payment {parent} is already recorded")
+            continue
+        new_ids.add(parent)
+        files = [_text(it, c, "None") for c in ('Proof_File', 'Form_C_File', 'Payment_Decl_File')]
+        alloc = it.get('Allocation')
+        if alloc:
+            if not isinstance(alloc, dict) or not set(map(str, alloc)) <= quotes:
+                errors.append(f"{where}: Allocation must map quotes of invoice {inv} to amounts")
+                continue
+            alloc = {str(q): _amount(alloc, q, errors, where) for q in alloc}
+            if abs(sum(alloc.values()) - amount) > CENT:
+                errors.append(f"{where}: Allocation total {sum(alloc.values()):,.2f} != Amount {amount:,.2f}")
+                continue
+            manual += payment_rows(parent, inv, alloc, p_date, *files)
+        else:
+            auto.append({'Parent_Payment_ID': parent, 'Invoice_Ref': inv, 'Amount': amount, 'Date': p_date,
+                         'Proof_File': files[0], 'Form_C_File': files[1], 'Payment_Decl_File': files[2]})
+    return manual, auto
+
+
+def apply_request(batch, body):
+    """Validate one POST body and add it to `batch`. Raises ApiError, with nothing added, if any item is invalid."""
+    policy = body.get('policy') or POLICIES[0]
+    if policy not in POLICIES:
+        raise ApiError(f"policy must be one of {POLICIES}")
+    errors = []
+    q_rows = _quote_rows(_items(body, 'quotes'), batch, errors)
+    i_rows = _invoice_rows(_items(body, 'invoices'), batch, q_rows, errors)
+    manual, auto = _payment_rows(_items(body, 'payments'), batch, i_rows, errors)
+    if errors:
+        raise ApiError(errors)
+    batch.accept(q_rows, i_rows, manual, auto, policy)
+    return {'quotes': [r['Quote_ID'] for r in q_rows], 'invoices': list(dict.fromkeys(r['Invoice_No'] for r in i_rows)),
+            'payments': list(dict.fromkeys([r['Parent_Payment_ID'] for r in manual] + [p['Parent_Payment_ID'] for p in auto]))}
+
+
+def _sheet_business(path, df_q):
+    """Business of the Master_Ledger_View sheet app12 last wrote (from its first quote), or None."""
+    try:
+        head = pd.read_excel(path, sheet_name=LEDGER_SHEET, usecols=[0, 1], nrows=1)
+    except (OSError, ValueError, KeyError):
+        return None
+    if head.empty or head.iloc[0, 0] != 'QUOTE':
+        return None
+    hit = df_q.loc[_str(df_q['Quote_ID']) == str(head.iloc[0, 1]), 'Business']
+    return hit.iloc[0] if len(hit) else None
+
+
+class _NothingValid(Exception):
+    pass
+
+
+class Writer:
+    """The only writer of the API process: queued requests, applied in order, one commit per group."""
+
+    def __init__(self, service, group_max=GROUP_MAX):
+        self.service = service
+        self.group_max = group_max
+        self.stats = {'commits': 0, 'requests': 0, 'last_group': 0, 'last_commit_s': 0.0}
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name='ledger-writer', daemon=True).start()
+
+    def submit(self, body):
+        fut = Future()
+        self._queue.put((body, fut))
+        return fut.result()
+
+    def _run(self):
+        while True:
+            group = [self._queue.get()]
+            while len(group) < self.group_max:
+                try:
+                    group.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(group)
+            except Exception as e:  # the thread must survive anything
+                for _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _persist(self, frames, old):
+        # app12.py's workbook layout; the Master_Ledger_View sheet is rebuilt for the unit it already shows
+        biz = _sheet_business(self.service.path, old['Quotations'])
+        with pd.ExcelWriter(self.service.path, engine='openpyxl') as writer:
+            for name in MASTER_SHEETS:
+                frames[name].to_excel(writer, sheet_name=name, index=False)
+            write_stamp(writer, 'master')
+            if biz:
+                rows = iter_ledger_rows(biz, frames['Quotations'], frames['Invoices'], frames['Payments'])
+                write_ledger_sheet(writer, pd.DataFrame(list(rows)))
+
+    def _commit(self, group):
+        results, batch = [None] * len(group), None
+
+        def update(current):
+            nonlocal batch
+            batch = Batch(current)
+            for k, (body, _) in enumerate(group):
+                try:
+                    results[k] = apply_request(batch, body)
+                except ApiError as e:
+                    results[k] = e
+            if not any(isinstance(r, dict) for r in results):
+                raise _NothingValid()
+            return batch.frames()
+
+        t0 = time.perf_counter()
+        try:
+            view = self.service.commit(update, self._persist)
+        except _NothingValid:
+            view = None
+        self.stats.update(commits=self.stats['commits'] + (view is not None), last_group=len(group),
+                          requests=self.stats['requests'] + len(group), last_commit_s=time.perf_counter() - t0)
+        if view is not None and batch.invoices:
+            register_invoices('app12', batch.invoices, data_version=self.service.fingerprint())
+        for (_, fut), res in zip(group, results):
+            if isinstance(res, Exception):
+                fut.set_exception(res)
+            else:
+                fut.set_result({**res, 'version': view.version})
+
+
+# --- READS ---
+def _index(view, sheet, col):
+    """{value: row positions} of one column, built once per ledger version."""
+    return view.derived(('index', sheet, col), lambda f: pd.Series(_str(f[sheet][col]).to_numpy()).groupby(
+        _str(f[sheet][col]).to_numpy()).indices)
+
+
+def _select(view, sheet, **filters):
+    rows = None
+    for col, value in filters.items():
+        if value is not None:
+            hit = _index(view, sheet, col).get(value, np.array([], dtype=int))
+            rows = hit if rows is None else np.intersect1d(rows, hit)
+    df = view[sheet]
+    return df if rows is None else df.iloc[np.sort(rows)]
+
+
+def _tree(view):
+    return view.derived('hierarchy', lambda f: build_hierarchy(f['Quotations'], f['Invoices'], f['Payments']))
+
+
+def _rollup(view, kind):
+    build = business_rollup if kind == 'business' else quote_rollup
+    return view.derived(('rollup', kind), lambda f: build(f['Quotations'], f['Invoices'], f['Payments']))
+
+
+class LedgerApi:
+    def __init__(self, path=FILE, group_max=GROUP_MAX):
+        self.service = LedgerService(path, 'master')
+        self.writer = Writer(self.service, group_max)
+
+    def get(self, route, args):
+        view = self.service.view()
+        arg = lambda k: args.get(k, [None])[0]
+        if route == '/health':
+            return {'version': view.version, 'rows': {s: len(view[s]) for s in MASTER_SHEETS}, 'writer': self.writer.stats}
+        if route == '/quotes':
+            return _select(view, 'Quotations', Business=arg('business'))
+        if route == '/invoices':
+            return _select(view, 'Invoices', Business=arg('business'), Quote_Ref=arg('quote'))
+        if route == '/payments':
+            return _select(view, 'Payments', Invoice_Ref=arg('invoice'))
+        if route == '/ledger':
+            if not arg('business'):
+                raise ApiError("business is required")
+            return pd.DataFrame(list(iter_ledger_rows(arg('business'), view['Quotations'], view['Invoices'],
+                                                      view['Payments'], tree=_tree(view))))
+        if route == '/rollup':
+            return _rollup(view, 'business')
+        if route == '/quotes/rollup':
+            roll = _rollup(view, 'quote')
+            return roll if arg('business') is None else roll[roll['Business'] == arg('business')]
+        if route == '/dues':
+            if not arg('invoice'):
+                raise ApiError("invoice is required")
+            return quote_dues(_select(view, 'Invoices', Invoice_No=arg('invoice')),
+                              _select(view, 'Payments', Invoice_Ref=arg('invoice')), view['Quotations'])
+        raise ApiError(f"no such endpoint: {route}", status=404)
+
+    def post(self, route, body):
+        sheet = {'/quotes': 'quotes', '/invoices': 'invoices', '/payments': 'payments'}.get(route)
+        if sheet is not None:
+            # [items], one item, or {"<sheet>": [...], "policy": ...}
+            body = body if isinstance(body, dict) and sheet in body else {sheet: body}
+        elif route != '/batch':
+            raise ApiError(f"no such endpoint: {route}", status=404)
+        if not isinstance(body, dict):
+            raise ApiError("body must be a JSON object or list")
+        if not any(_items(body, k) for k in ('quotes', 'invoices', 'payments')):
+            raise ApiError("nothing to post: give quotes, invoices and/or payments")
+        if not body.get('allow_duplicates'):
+            # app.py's invoice numbers live only in the dedup index; app12's are checked against the ledger
+            nos = [it.get('Invoice_No') for it in _items(body, 'invoices')]
+            hits = [f"Invoice No '{m['invoice_no']}' already booked ({m['business']}, {m['app']})"
+                    for ms in find_invoice_nos([str(n) for n in nos if n]).values() for m in ms if m['app'] != 'app12']
+            if hits:
+                raise ApiError(hits, status=409)
+        return self.writer.submit(body)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # many scripts connecting at once during a slow commit
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive: scripts reuse one connection
+    api = None
+
+    def _send(self, status, payload):
+        if isinstance(payload, pd.DataFrame):
+            data = payload.to_json(orient='records', date_format='iso').encode('utf-8')
+        else:
+            data = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, call):
+        try:
+            self._send(200, call())
+        except ApiError as e:
+            self._send(e.status, {'errors': e.errors})
+        except Exception as e:
+            self._send(500, {'errors': [f"{type(e).__name__}: {e}"]})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self._handle(lambda: self.api.get(url.path.rstrip('/') or '/', parse_qs(url.query)))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        def call():
+            try:
+                body = json.loads(raw or b'{}')
+            except ValueError as e:
+                raise ApiError(f"invalid JSON: {e}")
+            return self.api.post(url.path.rstrip('/'), body)
+        self._handle(call)
+
+    def log_message(self, fmt, *args):
+        pass  # one line per request would cost more than the request
+
+
+def serve(path=FILE, host=HOST, port=PORT, group_max=GROUP_MAX):
+    """Start the API; returns the server (serve_forever() it, or run it in a thread)."""
+    handler = type('LedgerHandler', (Handler,), {'api': LedgerApi(path, group_max)})
+    return Server((host, port), handler)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Headless JSON API over the app12.py ledger (localhost)")
+    ap.add_argument('--file', default=FILE)
+    ap.add_argument('--host', default=HOST)
+    ap.add_argument('--port', type=int, default=PORT)
+    ap.add_argument('--group-max', type=int, default=GROUP_MAX, help="max requests per commit")
+    args = ap.parse_args()
+    server = serve(args.file, args.host, args.port, args.group_max)
+    print(f"Ledger API on http://{args.host}:{args.port} ({args.file})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
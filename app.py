@@ -5,94 +5,59 @@ import plotly.graph_objects as go
 from datetime import datetime
 import os
 import time
-import pdfplumber
-import re
+from urllib.parse import quote_plus
+from schema import LEGACY_SHEETS
+from ledger_service import LedgerService, append_rows
+from rollups import legacy_business_rollup
+from aging import legacy_invoice_outstanding, render_aging
+from forecast import legacy_forecast_cash_in
+from ids import new_id
+from parser_pool import run_parser, ParserError
+from vault_index import index_in_background, sync_vault_in_background, search, file_records, link_hits
+from vault_watcher import record_stored
+from dedup import describe_matches, register_invoices, sync_invoice_numbers
+from temporal import sync_history, timeline, as_of
+from reconcile import (read_statement, match_statement, posted_line_ids, parent_payment_id,
+                       STATUS_MATCHED, STATUS_AMBIGUOUS, STATUS_UNMATCHED, STATUS_POSTED)
 
 # --- 1. CONFIGURATION ---
 st.set_page_config(page_title="Glafit Empire Finance", layout="wide", page_icon="🏢")
 
 FILE = 'Finance_Ledger.xlsx'
 VAULT_FOLDER = 'Master_Vault'
+INV_COLS = LEGACY_SHEETS['Invoices']
+PAY_COLS = LEGACY_SHEETS['Payments']
 
 if not os.path.exists(VAULT_FOLDER):
     os.makedirs(VAULT_FOLDER)
 
-# --- 2. EMBEDDED PARSER (No need for ingest.py) ---
-def parse_invoice(file_path):
-    """
-    Reads a PDF and extracts Invoice No, Date, Amount, and Project.
-    Embedded directly here to avoid ImportErrors.
-    """
-    try:
-        with pdfplumber.open(file_path) as pdf:
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-        
-        # Simple Regex Logic (Adjust as needed)
-        # 1. Invoice Number (Looks for INV-...)
-        inv_match = re.search(r'(INV-\d{4}-\d{3}|INV-\w+-\d+)', text)
-        invoice_no = inv_match.group(0) if inv_match else f"INV-{int(time.time())}"
-        
-        # 2. Amount (Looks for $ or numbers with decimals)
-        amt_match = re.search(r'\$\s?([\d,]+\.\d{2})', text)
-        if amt_match:
-            amount = float(amt_match.group(1).replace(',', ''))
-        else:
-            # Fallback: look for largest number
-            nums = re.findall(r'([\d,]+\.\d{2})', text)
-            amount = float(max(nums).replace(',', '')) if nums else 0.0
-            
-        # 3. Date
-        date_match = re.search(r'(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})', text)
-        inv_date = pd.to_datetime(date_match.group(0)) if date_match else datetime.today()
-
-        # 4. Project Name (Heuristic)
-        project = "General Project"
-        lines = text.split('\n')
-        for line in lines[:10]: # Check first 10 lines
-            if "Project:" in line:
-                project = line.replace("Project:", "").strip()
-                break
-                
-        return invoice_no, inv_date, amount, project
-
-    except Exception as e:
-        return "MANUAL_CHECK", datetime.today(), 0.0, "Manual Entry"
+# --- 2. PARSER (ingest.py, run through parser_pool) ---
 
 # --- 3. DATA HELPER FUNCTIONS ---
 
-def ensure_columns_exist(df, required_cols):
-    for col in required_cols:
-        if col not in df.columns:
-            df[col] = "" 
-    return df
+@st.cache_resource
+def ledger_service():
+    # one shared, schema-normalized copy of the ledger for all sessions (ledger_service.py)
+    return LedgerService(FILE, 'legacy')
+
+def with_payment_dates(df_pay):
+    return df_pay.assign(Date=df_pay['Payment_Date'])
 
 def get_data():
     try:
-        df_inv = pd.read_excel(FILE, sheet_name='Invoices')
-        df_pay = pd.read_excel(FILE, sheet_name='Payments')
-        
-        df_inv = ensure_columns_exist(df_inv, ['Project_Name', 'Business_Unit', 'Client', 'Invoice_No', 'Total_Amount', 'Date', 'Entry_Date', 'PDF_File'])
-        df_pay = ensure_columns_exist(df_pay, ['Invoice_Ref', 'Amount_Received', 'Payment_Date', 'Entry_Date', 'Proof_File'])
-        
-        if not df_pay.empty:
-            df_pay['Date'] = pd.to_datetime(df_pay['Payment_Date'], errors='coerce')
-            df_pay['Entry_Date'] = pd.to_datetime(df_pay['Entry_Date'], errors='coerce')
-        else:
-            df_pay['Date'] = pd.to_datetime([])
-
-        if not df_inv.empty:
-            df_inv['Date'] = pd.to_datetime(df_inv['Date'], errors='coerce')
-            df_inv['Entry_Date'] = pd.to_datetime(df_inv['Entry_Date'], errors='coerce')
-
-        df_inv['Invoice_No'] = df_inv['Invoice_No'].astype(str)
-        df_inv['Business_Unit'] = df_inv['Business_Unit'].astype(str)
-        
-        return df_inv, df_pay
+        view = ledger_service().view()
+        return view['Invoices'], with_payment_dates(view['Payments'])
     except Exception as e:
         return pd.DataFrame(), pd.DataFrame()
 
+def append_to_ledger(sheet, df_new):
+    """Serialized append: rows go after the LATEST version (not this session's), then unit ledgers re-sync."""
+    def persist(new, old):
+        with pd.ExcelWriter(FILE, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
+            df_new.to_excel(writer, sheet_name=sheet, index=False, header=False, startrow=len(old[sheet])+1)
+        sync_ledger_to_excel(new['Invoices'], with_payment_dates(new['Payments']))
+    return ledger_service().commit(append_rows(sheet, df_new), persist)
+
 def sync_ledger_to_excel(df_inv, df_pay):
     """
     Creates a SEPARATE Ledger Sheet for EACH Business Unit.
@@ -194,6 +159,11 @@ def sync_ledger_to_excel(df_inv, df_pay):
                     for cell in row: cell.fill = fill
 
 df_inv, df_pay = get_data()
+# Duplicate index is shared with app12; it only re-syncs when invoice numbers changed outside the app
+sync_invoice_numbers('app', ledger_service().fingerprint(), df_inv.get('Invoice_No', []), df_inv.get('Business_Unit', []))
+# Change log for the as-of view (temporal.py): records what changed since the last workbook version
+if not df_inv.empty:
+    sync_history('app', ledger_service().fingerprint(), ledger_service().view())
 
 # --- 3. SIDEBAR ---
 st.sidebar.title("🏢 Business Units")
@@ -211,8 +181,13 @@ def get_all_businesses():
     combined = sorted(list(set(folder_biz + excel_biz)))
     return combined if combined else ["Main Business"]
 
+PORTFOLIO = "🌐 Group Portfolio"
 existing_businesses = get_all_businesses()
-business_selection = st.sidebar.selectbox("Select Dashboard:", existing_businesses + ["+ Add New Business"])
+dashboard_opts = existing_businesses + [PORTFOLIO, "+ Add New Business"]
+# ?biz=<unit> comes from the portfolio drill-down links
+biz_param = st.query_params.get("biz")
+business_selection = st.sidebar.selectbox("Select Dashboard:", dashboard_opts,
+                                          index=dashboard_opts.index(biz_param) if biz_param in dashboard_opts else 0)
 current_business = business_selection
 
 if business_selection == "+ Add New Business":
@@ -241,17 +216,130 @@ end_date = c2.date_input("To", max_date)
 start_date = pd.to_datetime(start_date)
 end_date = pd.to_datetime(end_date)
 
+# --- AS-OF (AUDIT) VIEW ---
+def ledger_timeline():
+    # current rows + superseded versions with their validity, built once per ledger version for all sessions
+    return ledger_service().view().derived('timeline', lambda f: timeline('app', f))
+
+with st.sidebar.expander("🕰️ As of (audit view)"):
+    as_of_on = st.checkbox("Show the ledger as it was", key='asof_on')
+    asof_tx = st.date_input("Transactions up to", datetime.today(), key='asof_tx')
+    asof_known = st.date_input("As known on", datetime.today(), key='asof_known')
+    st.caption("Knowledge date = when a row was entered or last edited. Forms keep working on today's ledger.")
+
+# view_* feed the dashboards and the ledger; df_inv / df_pay stay the live ledger for the forms
+view_inv, view_pay, view_version = df_inv, df_pay, ledger_service().fingerprint()
+if as_of_on and not df_inv.empty:
+    past = as_of(ledger_timeline(), asof_tx, asof_known)
+    view_inv, view_pay = past['Invoices'], with_payment_dates(past['Payments'])
+    view_version = (view_version, str(asof_tx), str(asof_known))
+
+# --- DOCUMENT SEARCH (shared full-text index over Master_Vault) ---
+@st.cache_resource
+def start_vault_sync():
+    return sync_vault_in_background(VAULT_FOLDER)
+
+start_vault_sync()
+st.sidebar.divider()
+vault_q = st.sidebar.text_input("🔎 Search documents", placeholder="serial no., site, PO, invoice no...")
+if vault_q:
+    hits = search(vault_q, limit=30)
+    if hits.empty:
+        st.sidebar.caption("No documents found.")
+    else:
+        inv_biz = df_inv.drop_duplicates('Invoice_No').set_index('Invoice_No')['Business_Unit'] if not df_inv.empty else pd.Series(dtype=str)
+        pays = df_pay.assign(Business_Unit=df_pay['Invoice_Ref'].astype(str).map(inv_biz)) if not df_pay.empty else df_pay
+        hits = link_hits(hits, file_records([
+            ("Invoice", df_inv, 'Invoice_No', 'Business_Unit', ['PDF_File']),
+            ("Payment on", pays, 'Invoice_Ref', 'Business_Unit', ['Proof_File']),
+        ]))
+        hits['Open'] = "?biz=" + hits['Business'].astype(str).map(quote_plus)
+        st.sidebar.dataframe(hits, column_order=['File', 'Records', 'Open', 'Snippet'],
+                             column_config={"Open": st.column_config.LinkColumn("Unit", display_text="Open ↗")},
+                             hide_index=True, use_container_width=True)
+
+@st.cache_data(show_spinner=False)
+def cached_forecast(data_version, business, as_of, _df_inv, _df_pay):
+    return legacy_forecast_cash_in(_df_inv, _df_pay, business=business, as_of=as_of)
+
+def show_forecast(df_inv, df_pay, business, key):
+    fc = cached_forecast(view_version, business, datetime.today().strftime('%Y-%m-%d'), df_inv, df_pay)
+    f1, f2, f3 = st.columns(3)
+    f1.metric("Next 3 months (P50)", f"${fc['Cum_P50'].iloc[2]:,.2f}")
+    f2.metric("12 months (P50)", f"${fc['Cum_P50'].iloc[-1]:,.2f}")
+    f3.metric("12 months (P10 – P90)", f"${fc['Cum_P10'].iloc[-1]:,.0f} – ${fc['Cum_P90'].iloc[-1]:,.0f}")
+    fig_fc = px.line(fc, x='Month', y=['P10', 'P50', 'P90'], markers=True,
+                     color_discrete_map={'P10': '#EF553B', 'P50': '#636EFA', 'P90': '#00CC96'})
+    fig_fc.update_layout(hovermode="x unified", template="plotly_white", yaxis_title="Expected Collections ($)", legend_title_text="")
+    st.plotly_chart(fig_fc, use_container_width=True, key=key)
+
+@st.cache_data(show_spinner=False)
+def cached_portfolio(data_version, start, end, _df_inv, _df_pay):
+    # data_version = workbook fingerprint -> recomputed only after the next write
+    in_range = _df_inv[(_df_inv['Date'] >= start) & (_df_inv['Date'] <= end)]
+    return legacy_business_rollup(in_range, _df_pay)
+
+if business_selection == PORTFOLIO:
+    st.title("🌐 Group Portfolio (All Business Units)")
+    if as_of_on:
+        st.info(f"🕰️ Audit view: transactions up to {asof_tx:%d %b %Y}, as known on {asof_known:%d %b %Y}")
+    roll = cached_portfolio(view_version, start_date, end_date, view_inv, view_pay) if not view_inv.empty else legacy_business_rollup(view_inv, view_pay)
+
+    k1, k2, k3, k4 = st.columns(4)
+    g_billed = float(roll['Billed'].sum()); g_paid = float(roll['Collected'].sum())
+    k1.metric("Total Billed", f"${g_billed:,.2f}")
+    k2.metric("Total Collected", f"${g_paid:,.2f}")
+    k3.metric("Outstanding Due", f"${g_billed - g_paid:,.2f}", delta="Balance", delta_color="inverse")
+    k4.metric("Collection Rate", f"{(g_paid / g_billed * 100) if g_billed > 0 else 0:.1f}%")
+    st.divider()
+
+    if roll.empty:
+        st.info("Start adding invoices and payments to see the analytics graphs!")
+    else:
+        comp = roll.assign(Outstanding=roll['Outstanding'].clip(lower=0)).melt(
+            id_vars='Business', value_vars=['Collected', 'Outstanding'], var_name='Status', value_name='Amount')
+        fig_port = px.bar(comp, x='Business', y='Amount', color='Status', barmode='stack',
+                          color_discrete_map={'Collected': '#00CC96', 'Outstanding': '#EF553B'})
+        fig_port.update_layout(template="plotly_white", yaxis_title="Amount ($)")
+        st.plotly_chart(fig_port, use_container_width=True)
+
+        roll['Open'] = "?biz=" + roll['Business'].astype(str).map(quote_plus)
+        st.dataframe(
+            roll,
+            column_order=['Business', 'Open', 'Invoices', 'Billed', 'Collected', 'Outstanding', 'Collection_Rate'],
+            column_config={
+                "Open": st.column_config.LinkColumn("Drill Down", display_text="Open ↗"),
+                "Billed": st.column_config.NumberColumn(format="$%.2f"),
+                "Collected": st.column_config.NumberColumn(format="$%.2f"),
+                "Outstanding": st.column_config.NumberColumn(format="$%.2f"),
+                "Collection_Rate": st.column_config.ProgressColumn("Collected %", format="%.1f%%", min_value=0, max_value=100),
+            },
+            use_container_width=True, hide_index=True
+        )
+
+        st.subheader("⏳ Receivables Aging by Business Unit")
+        render_aging(legacy_invoice_outstanding(view_inv, view_pay), 'Business', key='port_aging',
+                     as_of=asof_tx if as_of_on else None, money="${:,.2f}")
+        st.subheader("🔮 Cash-In Forecast (P10 / P50 / P90)")
+        show_forecast(view_inv, view_pay, None, key='port_fc')
+    st.stop()
+
 # --- 4. DATA LOGIC (VIEW GENERATOR) ---
-if business_selection == "+ Add New Business" and current_business not in existing_businesses:
-    filtered_inv = pd.DataFrame(columns=df_inv.columns)
-else:
-    filtered_inv = df_inv[df_inv['Business_Unit'] == current_business].copy()
+def unit_frames(df_inv, df_pay):
+    if business_selection == "+ Add New Business" and current_business not in existing_businesses:
+        unit_inv = pd.DataFrame(columns=df_inv.columns)
+    else:
+        unit_inv = df_inv[df_inv['Business_Unit'] == current_business].copy()
 
-if not df_pay.empty and not filtered_inv.empty:
-    valid_inv_numbers = filtered_inv['Invoice_No'].unique()
-    filtered_pay = df_pay[df_pay['Invoice_Ref'].isin(valid_inv_numbers)].copy()
-else:
-    filtered_pay = pd.DataFrame(columns=df_pay.columns)
+    if not df_pay.empty and not unit_inv.empty:
+        valid_inv_numbers = unit_inv['Invoice_No'].unique()
+        unit_pay = df_pay[df_pay['Invoice_Ref'].isin(valid_inv_numbers)].copy()
+    else:
+        unit_pay = pd.DataFrame(columns=df_pay.columns)
+    return unit_inv, unit_pay
+
+filtered_inv, filtered_pay = unit_frames(view_inv, view_pay)
+live_inv, live_pay = unit_frames(df_inv, df_pay) if as_of_on else (filtered_inv, filtered_pay)
 
 ledger_rows = []
 cumulative_balance = 0.0
@@ -319,9 +407,12 @@ if not df_view.empty:
         'Credit': df_view[df_view['Type'] == 'Payment']['Credit'].sum(),
         'Balance': cumulative_balance, 'Link_Path': None, 'Type': 'GrandTotal'
     }
+    df_view['Date'] = pd.to_datetime(df_view['Date'])  # the None of the total row must not turn it into text
 
 # --- 5. DASHBOARD UI (ENHANCED) ---
 st.title(f"📊 Dashboard: {current_business}")
+if as_of_on:
+    st.info(f"🕰️ Audit view: transactions up to {asof_tx:%d %b %Y}, as known on {asof_known:%d %b %Y}. Recording payments still uses today's ledger.")
 
 if not df_view.empty:
     metrics_df = df_view[df_view['Type'].isin(['Invoice', 'Payment'])].copy()
@@ -414,6 +505,15 @@ if not metrics_df.empty:
 else:
     st.info("Start adding invoices and payments to see the analytics graphs!")
 
+st.subheader("⏳ Receivables Aging")
+render_aging(legacy_invoice_outstanding(filtered_inv, filtered_pay), 'Project_Name', key='biz_aging',
+             as_of=asof_tx if as_of_on else None, money="${:,.2f}")
+
+st.subheader("🔮 Cash-In Forecast (P10 / P50 / P90)")
+show_forecast(view_inv, view_pay, current_business, key='biz_fc')
+
+st.divider()
+
 # --- 6. ACTION TABS ---
 tab1, tab2, tab3 = st.tabs(["📝 Add Invoice", "💵 Record Payment", "📄 Master Ledger"])
 
@@ -422,6 +522,7 @@ with tab1:
     uploaded_file = st.file_uploader("Drag & Drop PDF Invoice", type=['pdf'])
     
     def_inv, def_date, def_amt, def_proj = "", datetime.today(), 0.0, ""
+    inv_fp = None
     
     if uploaded_file:
         biz_folder = os.path.join(VAULT_FOLDER, current_business)
@@ -430,19 +531,39 @@ with tab1:
         temp_path = os.path.join(biz_folder, uploaded_file.name)
         with open(temp_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
+        record_stored(temp_path, VAULT_FOLDER)  # app12's vault watcher must not pick up our own uploads
         
         st.success(f"File saved to: {current_business}/{uploaded_file.name}")
         
-        with st.spinner("🤖 AI reading invoice..."):
-            parsed_inv, parsed_date, parsed_amt, parsed_proj = parse_invoice(temp_path)
-            def_inv = parsed_inv if parsed_inv != "MANUAL_CHECK" else ""
-            def_amt = parsed_amt
-            def_proj = parsed_proj
-            if parsed_date: def_date = parsed_date 
-            
-            existing_inv_nums = df_inv['Invoice_No'].astype(str).str.strip().tolist()
-            if str(def_inv).strip() in existing_inv_nums:
-                st.warning(f"⚠️ Warning: Invoice '{def_inv}' already exists.")
+        # Parse once per upload in an isolated worker (timeout + memory cap), not on every rerun
+        upload_key = (uploaded_file.name, uploaded_file.size)
+        if st.session_state.get('parsed_upload', (None,))[0] != upload_key:
+            # Cancel reruns the script at the next heartbeat (killing the worker); the rerun finds the flag set
+            st.button("✖ Cancel reading", key='inv_cancel_read')
+            beat = st.empty()
+            with st.spinner("🤖 AI reading invoice..."):
+                try:
+                    parsed, fp, text = run_parser('parse_and_fingerprint', temp_path, {'parser': 'parse_invoice'},
+                                                  should_cancel=lambda: st.session_state.get('inv_cancel_read'),
+                                                  heartbeat=lambda s: beat.caption(f"⏳ {s:.0f}s"))
+                except ParserError as e:
+                    st.warning(f"⏱️ Could not read the PDF automatically ({e}). Please enter the details manually.")
+                    parsed, fp, text = ("MANUAL_CHECK", datetime.today(), 0.0, "Manual Entry"), None, None
+            beat.empty()
+            index_in_background(temp_path, VAULT_FOLDER, text)  # the parse already extracted the text
+            st.session_state.parsed_upload = (upload_key, parsed, fp)
+        _, (parsed_inv, parsed_date, parsed_amt, parsed_proj), inv_fp = st.session_state.parsed_upload
+
+        def_inv = parsed_inv if parsed_inv != "MANUAL_CHECK" else ""
+        def_amt = parsed_amt
+        def_proj = parsed_proj
+        if parsed_date: def_date = parsed_date 
+
+        blocking, near = describe_matches(def_inv, inv_fp)
+        for msg in blocking:
+            st.warning(f"⚠️ Warning: {msg}")
+        for msg in near:
+            st.warning(f"🔁 Possible duplicate: {msg}")
 
     with st.form("new_invoice"):
         c1, c2 = st.columns(2)
@@ -452,10 +573,18 @@ with tab1:
         new_amt = c3.number_input("Total Amount ($)", min_value=0.0, value=float(def_amt))
         new_proj = c4.text_input("Project Name", value=def_proj)
         
+        allow_dups = st.checkbox("Post anyway if the number matches another invoice", key='inv_allow_dups')
+        
         if st.form_submit_button("💾 Save Invoice"):
             current_invoices = df_inv['Invoice_No'].astype(str).str.strip().tolist()
+            # Normalized number across both apps ('INV-012' = 'inv 12'): confirm, only an exact repeat here is a hard stop
+            similar = describe_matches(str(new_inv).strip(), None)[0]
             if str(new_inv).strip() in current_invoices:
                 st.error(f"❌ STOP: Invoice '{new_inv}' already exists!")
+            elif similar and not allow_dups:
+                for msg in similar:
+                    st.warning(f"⚠️ Warning: {msg}")
+                st.error("❌ Tick 'Post anyway' to save an invoice number that matches another one.")
             elif new_inv and new_amt > 0:
                 new_row = {
                     'Invoice_No': new_inv, 'Date': new_date, 'Client': 'Manual Client',
@@ -466,16 +595,14 @@ with tab1:
                 }
                 
                 df_new = pd.DataFrame([new_row])
-                correct_cols = ['Invoice_No', 'Date', 'Entry_Date', 'Client', 'Project_Name', 'Total_Amount', 'PDF_File', 'Business_Unit']
-                for c in correct_cols:
+                for c in INV_COLS:
                      if c not in df_new.columns: df_new[c] = ""
-                df_new = df_new[correct_cols]
-                
-                with pd.ExcelWriter(FILE, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-                    df_new.to_excel(writer, sheet_name='Invoices', index=False, header=False, startrow=len(df_inv)+1)
+                df_new = df_new[INV_COLS]
                 
-                df_inv_new, df_pay_new = get_data()
-                sync_ledger_to_excel(df_inv_new, df_pay_new)
+                append_to_ledger('Invoices', df_new)
+                register_invoices('app', [{'invoice_no': new_inv, 'business': current_business,
+                                           'file': uploaded_file.name if uploaded_file else "Manual_Entry",
+                                           'fingerprint': inv_fp}], data_version=ledger_service().fingerprint())
                 st.success("Invoice Saved & Excel Ledger Synced!"); time.sleep(1); st.rerun()
             else: 
                 st.error("Missing Info!")
@@ -483,17 +610,10 @@ with tab1:
 with tab2:
     st.subheader("Record Payment")
     
-    unpaid_map = {} 
-    if not filtered_inv.empty:
-        for idx, row in filtered_inv.iterrows():
-            inv_no = str(row['Invoice_No'])
-            try: total = float(row['Total_Amount'])
-            except: total = 0.0
-            if not filtered_pay.empty:
-                paid = filtered_pay[filtered_pay['Invoice_Ref'] == inv_no]['Amount_Received'].sum()
-            else: paid = 0.0
-            remaining = total - paid
-            if remaining > 0.01: unpaid_map[inv_no] = remaining
+    # One grouped payment sum instead of a filter per invoice
+    open_invs = legacy_invoice_outstanding(live_inv, live_pay)
+    open_invs = open_invs[open_invs['Outstanding'] > 0.01]
+    unpaid_map = dict(zip(open_invs['Invoice_No'], open_invs['Outstanding']))
     
     unpaid_list = list(unpaid_map.keys())
 
@@ -515,30 +635,94 @@ with tab2:
                     if not os.path.exists(pay_folder): os.makedirs(pay_folder)
                     save_path = os.path.join(pay_folder, pay_file.name)
                     with open(save_path, "wb") as f: f.write(pay_file.getbuffer())
+                    record_stored(save_path, VAULT_FOLDER)
+                    index_in_background(save_path, VAULT_FOLDER)
                     proof_filename = pay_file.name
                 
                 new_pay = {
-                    'Payment_ID': f"PAY-{datetime.now().strftime('%H%M%S')}",
+                    'Payment_ID': new_id('PAY'),
                     'Invoice_Ref': p_inv, 'Amount_Received': p_amt, 'Method': 'Manual',
                     'Proof_File': proof_filename, 'Payment_Date': p_date,
                     'Entry_Date': datetime.now()
                 }
 
                 df_new_pay = pd.DataFrame([new_pay])
-                correct_pay_cols = ['Payment_ID', 'Invoice_Ref', 'Amount_Received', 'Method', 'Proof_File', 'Payment_Date', 'Entry_Date']
-                for c in correct_pay_cols:
+                for c in PAY_COLS:
                      if c not in df_new_pay.columns: df_new_pay[c] = ""
-                df_new_pay = df_new_pay[correct_pay_cols]
+                df_new_pay = df_new_pay[PAY_COLS]
                 
-                with pd.ExcelWriter(FILE, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-                    df_new_pay.to_excel(writer, sheet_name='Payments', index=False, header=False, startrow=len(df_pay)+1)
-                
-                df_inv_new, df_pay_new = get_data()
-                sync_ledger_to_excel(df_inv_new, df_pay_new)
+                append_to_ledger('Payments', df_new_pay)
                 st.success("Payment Recorded & Excel Ledger Synced!"); time.sleep(1); st.rerun()
     else:
         st.info("All invoices are fully paid! 🎉")
 
+    st.divider()
+    st.subheader("🏦 Bulk Bank Reconciliation")
+    st_file = st.file_uploader("Upload Bank Statement (CSV / OFX)", type=['csv', 'ofx', 'qfx'], key='bank_stmt')
+
+    if st_file:
+        try:
+            stmt = read_statement(st_file)
+        except Exception as e:
+            stmt = None
+            st.error(f"Could not read statement: {e}")
+
+        if stmt is not None:
+            r1, r2 = st.columns(2)
+            date_tol = r1.number_input("Date tolerance (days before invoice)", min_value=0, value=3)
+            max_delay = r2.number_input("Max days after invoice", min_value=1, value=365)
+
+            # Statement lines are matched against open invoices of ALL business units
+            open_invs = legacy_invoice_outstanding(df_inv, df_pay)
+            posted = posted_line_ids(df_pay['Payment_ID']) if not df_pay.empty else set()
+            matches = match_statement(stmt, open_invs, posted, date_tol_days=date_tol, max_delay_days=max_delay)
+
+            counts = matches['Status'].value_counts()
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Matched", int(counts.get(STATUS_MATCHED, 0)))
+            m2.metric("Needs Review", int(counts.get(STATUS_AMBIGUOUS, 0)))
+            m3.metric("Unmatched", int(counts.get(STATUS_UNMATCHED, 0)))
+            m4.metric("Already Posted", int(counts.get(STATUS_POSTED, 0)))
+
+            edited = st.data_editor(
+                matches,
+                column_order=['Confirm', 'Status', 'Date', 'Amount', 'Description', 'Invoice_No', 'Business', 'Due',
+                              'Match_Type', 'Candidates', 'Note'],
+                column_config={
+                    "Confirm": st.column_config.CheckboxColumn("Post?"),
+                    "Invoice_No": st.column_config.SelectboxColumn(
+                        "Invoice", options=sorted(open_invs['Invoice_No'].astype(str).unique().tolist())),
+                    "Amount": st.column_config.NumberColumn(format="$%.2f"),
+                    "Due": st.column_config.NumberColumn(format="$%.2f"),
+                },
+                disabled=['Status', 'Date', 'Amount', 'Description', 'Business', 'Due', 'Match_Type', 'Candidates', 'Note'],
+                hide_index=True, use_container_width=True, height=400, key='rec_editor'
+            )
+
+            to_post = edited[edited['Confirm'] & edited['Invoice_No'].notna() & (edited['Status'] != STATUS_POSTED)]
+            if st.button(f"Post {len(to_post)} Confirmed Payment(s)", disabled=to_post.empty):
+                inv_biz = pd.Series(df_inv['Business_Unit'].values, index=df_inv['Invoice_No'].astype(str)).groupby(level=0).first()
+                for biz in to_post['Invoice_No'].astype(str).map(inv_biz).dropna().unique():
+                    pay_folder = os.path.join(VAULT_FOLDER, biz, "Payments")
+                    if not os.path.exists(pay_folder): os.makedirs(pay_folder)
+                    with open(os.path.join(pay_folder, st_file.name), "wb") as f: f.write(st_file.getbuffer())
+                    record_stored(os.path.join(pay_folder, st_file.name), VAULT_FOLDER)
+                    index_in_background(os.path.join(pay_folder, st_file.name), VAULT_FOLDER)
+
+                df_new_pay = pd.DataFrame({
+                    'Payment_ID': to_post['Line_ID'].map(parent_payment_id),
+                    'Invoice_Ref': to_post['Invoice_No'].astype(str),
+                    'Amount_Received': to_post['Amount'],
+                    'Method': 'Bank Import',
+                    'Proof_File': st_file.name,
+                    'Payment_Date': to_post['Date'],
+                    'Entry_Date': datetime.now()
+                })[PAY_COLS]
+
+                # ONE append for the whole batch instead of a write per payment
+                append_to_ledger('Payments', df_new_pay)
+                st.success(f"{len(df_new_pay)} Payments Recorded & Excel Ledger Synced!"); time.sleep(1); st.rerun()
+
 with tab3:
     st.subheader("Detailed Ledger (Grouped by Invoice)")
     if not df_view.empty:
@@ -1,242 +1,69 @@
 import streamlit as st
 import pandas as pd
 import os
+import io
+import filecmp
 import time
 import base64
 import plotly.express as px
+import plotly.io as pio
 from datetime import datetime
-from openpyxl.styles import PatternFill, Font
+from urllib.parse import quote_plus
+from schema import MASTER_SHEETS, write_stamp, migrate_legacy_workbook
+from ledger_service import LedgerService, LedgerConflict, replace_frames
+from rollups import business_rollup, quote_rollup
+from compliance import compliance_lines, compliance_summary, matrix_table, missing, DOCS, MISSING_FILTERS
+from charts import project_composition, composition_figure, page_count, FILTERS, PAGE_SIZE
+from aging import quote_outstanding, invoice_outstanding, render_aging
+from allocation import quote_dues, propose_allocation, payment_rows, allocate_payments, POLICIES
+from dedup import describe_matches, register_invoices, sync_invoice_numbers, normalize_invoice_no
+from parser_pool import run_parser, run_parsers, ParserError
+from vault_index import (index_in_background, sync_vault, sync_vault_in_background, search, file_records, link_hits,
+                         same_content)
+from vault_watcher import VaultWatcher, pending_drafts, resolve_drafts, record_stored
+from integrity import update_integrity, summarize
+from forecast import forecast_cash_in
+from ledger import iter_ledger_rows, iter_all_ledgers, write_ledger_sheet
+from hierarchy import build_hierarchy
+from archive import (settled_quotes, archive_settled, restore_quotes, search_archive, archived_invoice_numbers,
+                     archived_files)
+from export import export_ledger, FORMATS
+from ids import new_id, new_ids
+from reconcile import (read_statement, match_statement, posted_line_ids, parent_payment_id,
+                       STATUS_MATCHED, STATUS_AMBIGUOUS, STATUS_UNMATCHED, STATUS_POSTED)
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="Glafit Empire Finance V5", layout="wide", page_icon="🏢")
 FILE = 'Finance_Master_V5.xlsx'
+LEGACY_FILE = 'Finance_Ledger.xlsx'  # app.py workbook, importable once via schema.py
 VAULT = 'Master_Vault'
-
-import pdfplumber
-import os
-import re
-from datetime import datetime
-import dateparser
-
-def clean_text(text):
-    if not text: return ""
-    text = text.replace('：', ':').replace('\xa0', ' ')
-    # Merge hyphenated words across lines (e.g., "Con-\ntract" -> "Contract")
-    text = re.sub(r'(\w+)-\n(\w+)', r'\1\2', text)
-    return text
-
-def find_amount_in_text(text):
-    """Finds the largest number that looks like currency"""
-    # Supports JPY format 10,025,000 and USD 10,000.00
-    pattern = r"(?:[A-Z]{3}|[\$£€¥])?\s?([\d,]+\.?\d{0,2})"
-    matches = re.findall(pattern, text)
-    valid_amts = []
-    for m in matches:
-        try:
-            val = float(re.sub(r'[^\d.]', '', m))
-            if val > 0: valid_amts.append(val)
-        except: pass
-    return max(valid_amts) if valid_amts else 0.0
-
-def find_amount_in_block(text_block):
-    """(Alias for compatibility) Finds amount in a specific block"""
-    return find_amount_in_text(text_block)
-
-def extract_dynamic_date(text, default=None):
-    # Matches 2025/12/05, 05-Dec-2025, 12th Jan 2025 etc.
-    regex = r'(?:Date|Dated|On)?\s*[:.]?\s*(\d{4}[./-]\d{1,2}[./-]\d{1,2}|\d{1,2}[./-]\d{1,2}[./-]\d{2,4})'
-    match = re.search(regex, text, re.IGNORECASE)
-    if match:
-        try:
-            dt = dateparser.parse(match.group(1))
-            if dt: return dt.date()
-        except: pass
-    return default or datetime.now().date()
-
-def parse_multi_sow_agreement(pdf_path):
-    """
-    ROBUST PARSER: Scans for multiple 'Scope of Work' sections.
-    """
-    extracted_sows = []
-    global_date = datetime.now().date()
-    
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            full_text = "\n".join([p.extract_text() for p in pdf.pages if p.extract_text()])
-            text = clean_text(full_text)
-            
-            # 1. Find Global Document Date
-            global_date = extract_dynamic_date(text[:1000])
-
-            # 2. ROBUST REGEX for SOW
-            # Matches: "Scope of Work (SOW):" OR "Scope of Work:" OR "SOW" followed by newline
-            # (?:\s*\(SOW\))?  --> Optional (SOW)
-            # \s*[:\n]         --> Matches a Colon OR a New Line (The fix!)
-            sow_pattern = re.compile(r"(?:Scope of Work|SOW)(?:\s*\(SOW\))?\s*[:\n]", re.IGNORECASE)
-            
-            matches = list(sow_pattern.finditer(text))
-            
-            if not matches:
-                # Fallback: Treat whole doc as one SOW
-                amt = find_amount_in_text(text)
-                return [{'name': 'General Agreement', 'amount': amt, 'date': global_date}]
-
-            # 3. Iterate matches
-            for i, match in enumerate(matches):
-                start_idx = match.start()
-                end_idx = match.end()
-                
-                # A. Find Name (Look backwards)
-                preceding_text = text[max(0, start_idx-200):start_idx]
-                lines = [l.strip() for l in preceding_text.split('\n') if l.strip()]
-                
-                # The line immediately before "Scope of Work" is usually the Title
-                sow_name = lines[-1] if lines else f"Project Section {i+1}"
-                # Clean bullet points "1. Project..." -> "Project..."
-                sow_name = re.sub(r'^[\d.\-\)]+\s*', '', sow_name) 
-
-                # B. Find Content (Look forwards until next match)
-                next_start = matches[i+1].start() if i+1 < len(matches) else len(text)
-                block_text = text[end_idx:next_start]
-                
-                # C. Extract Data
-                amount = find_amount_in_text(block_text)
-                section_date = extract_dynamic_date(block_text, default=global_date)
-                
-                extracted_sows.append({
-                    'name': sow_name,
-                    'amount': amount,
-                    'date': section_date
-                })
-                
-    except Exception as e:
-        print(f"Error parsing SOW: {e}")
-        return []
-
-    return extracted_sows
-
-def parse_invoice_v2(pdf_path):
-    """Advanced Invoice Parser with Table Support"""
-    inv_data = {
-        'no': "DRAFT", 
-        'date': datetime.now().date(), 
-        'total': 0.0,
-        'items': [] 
-    }
-    
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            first_page_text = clean_text(pdf.pages[0].extract_text())
-            
-            # Header Info
-            no_match = re.search(r"(?:Invoice\s*No\.?|No\.?)\s*[:.]?\s*([A-Z0-9\-\/]{5,})", first_page_text, re.IGNORECASE)
-            if no_match: inv_data['no'] = no_match.group(1).strip()
-            
-            inv_data['date'] = extract_dynamic_date(first_page_text)
-            inv_data['total'] = find_amount_in_text(first_page_text)
-
-            # Table Scan
-            for page in pdf.pages:
-                tables = page.extract_tables()
-                for table in tables:
-                    for row in table:
-                        cleaned_row = [clean_text(str(cell)) if cell else "" for cell in row]
-                        
-                        # Find Description & Amount columns
-                        desc_candidates = [c for c in cleaned_row if len(c) > 5 and not re.match(r'^[\d,.]+$', c)]
-                        amt_candidates = [c for c in cleaned_row if re.search(r'[\d,]+\.?\d*', c)]
-                        
-                        if desc_candidates and amt_candidates:
-                            desc = desc_candidates[0].replace('\n', ' ')
-                            if "Description" in desc or "Item" in desc: continue
-                            
-                            try:
-                                amt_txt = amt_candidates[-1]
-                                amt = float(re.sub(r'[^\d.]', '', amt_txt))
-                                if amt > 0:
-                                    inv_data['items'].append({'desc': desc, 'amount': amt})
-                            except: pass
-
-    except Exception as e:
-        print(f"Error parsing PDF: {e}")
-
-    if not inv_data['items']:
-        inv_data['items'].append({'desc': 'General Services', 'amount': inv_data['total']})
-        
-    return inv_data
-
-def parse_payment(pdf_path):
-    """Simple Payment Parser"""
-    inv_ref = None
-    amt = 0.0
-    p_date = datetime.now().date()
-    
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            text = clean_text(pdf.pages[0].extract_text() or "")
-            amt = find_amount_in_text(text)
-            p_date = extract_dynamic_date(text)
-            
-            match = re.search(r"(INV-[A-Z0-9\-]+)", text)
-            if match: inv_ref = match.group(1).strip()
-    except: pass
-    
-    return inv_ref, amt, p_date
+EXPORTS = 'Exports'
+DOWNLOAD_MAX_MB = 200  # bigger exports stay on disk only
+PARSE_WORKERS = 2  # concurrent parser processes per session
 
 if not os.path.exists(VAULT):
     os.makedirs(VAULT)
 
 # --- DATABASE SCHEMA ---
-COLS_QT = ['Quote_ID', 'Date', 'Business', 'Project_Name', 'Total_Value', 'Agreement_File', 'Status']
-COLS_INV = ['Invoice_No', 'Quote_Ref', 'Date', 'Business', 'Split_Amount', 'Description', 'Invoice_File', 'Declaration_File']
-# ✅ NEW: Quote_Ref added so payments can be allocated per quotation (important when one invoice maps to multiple quotes)
-COLS_PAY = ['Payment_ID', 'Parent_Payment_ID', 'Invoice_Ref', 'Quote_Ref', 'Date', 'Amount', 'Proof_File', 'Form_C_File', 'Payment_Decl_File']
+# ✅ columns + types live in schema.py (versioned); Payments.Quote_Ref allocates payments per quotation
+COLS_QT = MASTER_SHEETS['Quotations']
+COLS_INV = MASTER_SHEETS['Invoices']
+COLS_PAY = MASTER_SHEETS['Payments']
 
 
 # --- HELPER FUNCTIONS ---
+@st.cache_resource
+def ledger_service():
+    # ✅ one copy of the ledger per server process, shared by every session (ledger_service.py)
+    return LedgerService(FILE, 'master')
+
+
 def load_db():
     try:
-        df_q = pd.read_excel(FILE, sheet_name='Quotations')
-        df_i = pd.read_excel(FILE, sheet_name='Invoices')
-        df_p = pd.read_excel(FILE, sheet_name='Payments')
-
-        # Ensure Columns Exist
-        for c in COLS_QT:
-            if c not in df_q.columns:
-                df_q[c] = ""
-        for c in COLS_INV:
-            if c not in df_i.columns:
-                df_i[c] = ""
-        for c in COLS_PAY:
-            if c not in df_p.columns:
-                df_p[c] = ""
-
-        # Force Numeric Types
-        df_q['Total_Value'] = pd.to_numeric(df_q['Total_Value'], errors='coerce').fillna(0.0)
-        df_i['Split_Amount'] = pd.to_numeric(df_i['Split_Amount'], errors='coerce').fillna(0.0)
-        df_p['Amount'] = pd.to_numeric(df_p['Amount'], errors='coerce').fillna(0.0)
-
-        # Force String Types
-        df_q['Quote_ID'] = df_q['Quote_ID'].astype(str)
-        df_i['Invoice_No'] = df_i['Invoice_No'].astype(str)
-        df_i['Quote_Ref'] = df_i['Quote_Ref'].astype(str)
-        df_p['Invoice_Ref'] = df_p['Invoice_Ref'].astype(str)
-        df_p['Quote_Ref'] = df_p['Quote_Ref'].fillna("").astype(str)
-        df_p['Payment_ID'] = df_p['Payment_ID'].astype(str)
-        df_p['Parent_Payment_ID'] = df_p['Parent_Payment_ID'].fillna("").astype(str)
-
-        # Force File Paths
-        for col in ['Agreement_File']:
-            if col in df_q.columns:
-                df_q[col] = df_q[col].fillna("None").astype(str)
-        for col in ['Invoice_File', 'Declaration_File']:
-            if col in df_i.columns:
-                df_i[col] = df_i[col].fillna("None").astype(str)
-        for col in ['Proof_File', 'Form_C_File', 'Payment_Decl_File']:
-            if col in df_p.columns:
-                df_p[col] = df_p[col].fillna("None").astype(str)
-
-        return df_q, df_i, df_p
+        # ✅ no file read per session: latest shared version, schema-normalized (schema.py)
+        view = ledger_service().view()
+        st.session_state['ledger_version'] = view.version
+        return view['Quotations'], view['Invoices'], view['Payments']
 
     except Exception:
         return (
@@ -246,14 +73,25 @@ def load_db():
         )
 
 
-def safe_copy(file_obj, folder_path, file_name):
+def load_archived():
+    # ✅ one summary row per quote in the cold archive (archive.py); not part of the working set
+    try:
+        return ledger_service().view()['Archived']
+    except Exception:
+        return pd.DataFrame(columns=MASTER_SHEETS['Archived'])
+
+
+def safe_copy(file_obj, folder_path, file_name, text=None):
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
     if not file_obj:
         return "None"
     final_path = os.path.join(folder_path, file_name)
+    vault_watcher().claim(final_path)  # ✅ stored through the app, not a dropped file
     with open(final_path, "wb") as f:
         f.write(file_obj.getbuffer())
+    record_stored(final_path, VAULT)  # ✅ a draft dropped at this very path is now on record
+    index_in_background(final_path, VAULT, text)  # ✅ full-text search picks it up, with the parser's text if there is one
     return file_name
 
 
@@ -277,6 +115,53 @@ def display_pdf(file_obj_or_path):
         pass
 
 
+def manual_invoice_meta(file_name, reason):
+    """Placeholder when a PDF could not be parsed: one editable line, filled in by hand."""
+    return {'no': os.path.splitext(file_name)[0], 'date': datetime.now().date(), 'total': 0.0,
+            'items': [{'desc': 'General Services', 'amount': 0.0}], 'fingerprint': None, 'error': str(reason)}
+
+
+def parse_invoices_isolated(files, on_progress=None, should_cancel=None, heartbeat=None, max_workers=PARSE_WORKERS):
+    """Parse + fingerprint uploads in the supervised parser pool; yields (file name, meta) as each one ends."""
+    jobs = {f.name: ('parse_and_fingerprint', f.getvalue()) for f in files}
+    for fname, result, error in run_parsers(jobs, max_workers=max_workers, on_progress=on_progress,
+                                            should_cancel=should_cancel, heartbeat=heartbeat):
+        if error:
+            yield fname, manual_invoice_meta(fname, error)
+        else:
+            meta, fp, text = result
+            meta['fingerprint'], meta['text'] = fp, text
+            yield fname, meta
+
+
+INV_GRID_FIXED = ['File', 'Line', 'Detected']  # read-only columns of the allocation grid
+
+
+def build_invoice_grid(metas, smart_opts, decl_names, edits=None):
+    """
+    One editable row per detected line item across every parsed invoice.
+    `edits`: {(file, line): {column: value}} made in the grid so far, laid over the proposals.
+    """
+    rows = []
+    for fname, meta in metas.items():
+        stem = os.path.splitext(fname)[0].lower()
+        decl = next((d for d in decl_names if str(meta['no']).lower() in d.lower() or stem in d.lower()), "None")
+        # proposed ids are drawn once per parsed file, so reruns keep the grid (and its edits) stable
+        quote_ids = meta.setdefault('new_quote_ids', new_ids('QT', len(meta['items'])))
+        for idx, item in enumerate(meta['items']):
+            rows.append({
+                'File': fname, 'Invoice_No': str(meta['no']), 'Line': idx + 1,
+                'Description': item['desc'], 'Detected': float(item['amount']),
+                'Action': "Existing Quote", 'Quote': smart_opts[0] if smart_opts else None,
+                'New_Quote_ID': quote_ids[idx], 'New_Project': item['desc'][:30], 'New_Value': float(item['amount']),
+                'Allocate': float(item['amount']),
+                'Declaration': decl,
+            })
+            rows[-1].update((edits or {}).get((fname, idx + 1), {}))
+    return pd.DataFrame(rows, columns=['File', 'Invoice_No', 'Line', 'Description', 'Detected', 'Action', 'Quote',
+                                       'New_Quote_ID', 'New_Project', 'New_Value', 'Allocate', 'Declaration'])
+
+
 def _payments_for_invoice_quote(df_p, inv_no: str, quote_id: str):
     """
     If payments are allocated (Quote_Ref present), use it.
@@ -288,171 +173,439 @@ def _payments_for_invoice_quote(df_p, inv_no: str, quote_id: str):
     return df
 
 
-def generate_ledger_view(curr_biz, df_q, df_i, df_p):
-    rows = []
+def ledger_tree(df_q, df_i, df_p):
+    # ✅ the published version's hierarchy is built once and shared by all sessions
+    view = ledger_service().view()
+    if view.version == st.session_state.get('ledger_version') and len(view['Payments']) == len(df_p):
+        return view.derived('hierarchy', lambda f: build_hierarchy(f['Quotations'], f['Invoices'], f['Payments']))
+    return build_hierarchy(df_q, df_i, df_p)
 
-    qs = df_q[df_q['Business'] == curr_biz].copy()
-    invs = df_i[df_i['Business'] == curr_biz].copy()
-    pays = df_p.copy()
 
-    grand_billed = 0.0
-    grand_collected = 0.0
+def generate_ledger_view(curr_biz, df_q, df_i, df_p, tree=None):
+    # rows come from the streaming builder (ledger.py), also used by the chunked exports
+    return pd.DataFrame(list(iter_ledger_rows(curr_biz, df_q, df_i, df_p, tree=tree)))
 
-    for _, q in qs.iterrows():
-        qid = str(q['Quote_ID'])
-        q_val = float(q['Total_Value'])
 
-        q_invs = invs[invs['Quote_Ref'] == qid]
-        q_billed = float(q_invs['Split_Amount'].sum())
+def save_db(df_q, df_i, df_p, curr_biz=None):
+    # ✅ serialized commit through the shared service; a change made on an outdated view is refused
+    frames = {'Quotations': df_q, 'Invoices': df_i, 'Payments': df_p}
+    try:
+        view = ledger_service().commit(replace_frames(frames), lambda new, old: write_workbook(new, curr_biz),
+                                       base_version=st.session_state.get('ledger_version'))
+    except LedgerConflict:
+        st.error("⚠️ Another user saved the ledger first. Reloaded the latest data, please redo your change.")
+        st.stop()
+    st.session_state['ledger_version'] = view.version
 
-        # ✅ Quote header Remaining Quoted Balance = Total Quote - Total Billed
-        q_unbilled = q_val - q_billed
 
-        # ✅ Collected against this Quote (works even if invoice spans multiple quotes)
-        q_collected = 0.0
-        for inv_no in q_invs['Invoice_No'].astype(str).unique().tolist():
-            q_collected += float(_payments_for_invoice_quote(pays, inv_no, qid)['Amount'].sum())
+def write_workbook(frames, curr_biz=None):
+    df_q, df_i, df_p = frames['Quotations'], frames['Invoices'], frames['Payments']
+    with pd.ExcelWriter(FILE, engine='openpyxl') as writer:
+        df_q.to_excel(writer, sheet_name='Quotations', index=False)
+        df_i.to_excel(writer, sheet_name='Invoices', index=False)
+        df_p.to_excel(writer, sheet_name='Payments', index=False)
+        frames['Archived'].to_excel(writer, sheet_name='Archived', index=False)
+        write_stamp(writer, 'master')
 
-        # 1) QUOTE HEADER
-        rows.append({
-            'Type': 'QUOTE', 'Ref': qid, 'Date': q['Date'],
-            'Description': f"📂 PROJECT: {q['Project_Name']}",
-            'Debit': q_val,                 # Contract Value
-            'Credit': q_collected,          # Cash In (Allocated to this Quote)
-            'Balance': q_unbilled,          # Remaining to bill
-            'Status': "⏳" if q_unbilled > 1.0 else "✅"
-        })
+        if curr_biz:
+            write_ledger_sheet(writer, generate_ledger_view(curr_biz, df_q, df_i, df_p))
 
-        # 2) INVOICE LOOP (per quote)
-        for _, i in q_invs.iterrows():
-            inv_no = str(i['Invoice_No'])
-            inv_amt = float(i['Split_Amount'])
 
-            rows.append({
-                'Type': 'INVOICE', 'Ref': inv_no, 'Date': i['Date'],
-                'Description': f"  ↳ 🧾 Inv: {i['Description']}",
-                'Debit': inv_amt, 'Credit': 0, 'Balance': 0, 'Status': ''
-            })
+@st.cache_data(show_spinner=False)
+def cached_business_rollup(data_version, _df_q, _df_i, _df_p):
+    # data_version = workbook fingerprint -> cache lives until the next save_db
+    return business_rollup(_df_q, _df_i, _df_p)
 
-            # 3) PAYMENT LOOP (allocated by quote+invoice)
-            my_pays = _payments_for_invoice_quote(pays, inv_no, qid)
-            inv_collected = 0.0
-
-            for _, p in my_pays.iterrows():
-                p_amt = float(p['Amount'])
-                inv_collected += p_amt
-
-                icons = []
-                if str(p.get('Proof_File', "None")) != "None":
-                    icons.append("🏦")
-                if str(p.get('Form_C_File', "None")) != "None":
-                    icons.append("📄")
-                if str(p.get('Payment_Decl_File', "None")) != "None":
-                    icons.append("📝")
-
-                rows.append({
-                    'Type': 'PAYMENT', 'Ref': str(p['Payment_ID']), 'Date': p['Date'],
-                    'Description': f"    ↳ 💰 Payment Received {' '.join(icons)}",
-                    'Debit': 0, 'Credit': p_amt, 'Balance': 0, 'Status': ''
-                })
 
-            # ✅ Invoice status line with % covered directly under invoice (strict)
-            inv_bal = inv_amt - inv_collected
-            pct = (inv_collected / inv_amt * 100.0) if inv_amt > 0 else 0.0
-            status_icon = "✅" if inv_bal < 1.0 else "🔴"
+@st.cache_data(show_spinner=False)
+def cached_quote_rollup(data_version, _df_q, _df_i, _df_p):
+    return quote_rollup(_df_q, _df_i, _df_p)
 
-            rows.append({
-                'Type': 'SUB_SUM', 'Ref': '', 'Date': '',
-                'Description': f"    👉 Status: {pct:.1f}% Cleared (Due: {inv_bal:,.0f})",
-                'Debit': 0, 'Credit': 0, 'Balance': inv_bal, 'Status': status_icon
-            })
 
-        # 4) QUOTE SUMMARY ROW: show Unbilled vs Unpaid
-        q_unpaid = q_billed - q_collected
-        rows.append({
-            'Type': 'SUMMARY', 'Ref': 'TOTAL', 'Date': '',
-            'Description': f"📊 PROJECT TOTALS | Unbilled: {q_unbilled:,.0f} | Unpaid: {q_unpaid:,.0f} | Billed: {q_billed:,.0f}",
-            'Debit': q_billed, 'Credit': q_collected, 'Balance': q_unpaid,
-            'Status': "✅" if q_unpaid < 1.0 else "🔴"
-        })
-        rows.append({'Type': 'SPACE'})
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_composition_json(data_version, business, show, page, _df_q, _df_i, _df_p):
+    # figure JSON per (version, business, filter, page): reruns only deserialize it
+    comp = project_composition(cached_quote_rollup(data_version, _df_q, _df_i, _df_p), business, show)
+    return composition_figure(comp.iloc[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]).to_json()
 
-        grand_billed += q_billed
-        grand_collected += q_collected
 
-    # GRAND TOTAL
-    grand_outstanding = grand_billed - grand_collected
-    g_pct = (grand_collected / grand_billed * 100.0) if grand_billed > 0 else 0.0
-    g_status = "🟢" if grand_outstanding < 1.0 else "🔴"
+def render_compliance(lines, qs):
+    """Document badges, missing-documents filter, per-project summary and the line matrix."""
+    summary = compliance_summary(lines, qs)
+    b = st.columns(len(DOCS) + 2)
+    b[0].metric("Payment Lines", f"{len(lines):,}")
+    b[1].metric("Fully Documented", f"{int(summary['Complete'].sum()):,}")
+    for col, doc in zip(b[2:], DOCS):
+        col.metric(f"Missing {doc}", f"{int(summary[f'No {doc}'].sum()):,}")
 
-    rows.append({
-        'Type': 'GRAND', 'Ref': 'ALL', 'Date': datetime.today(),
-        'Description': f"BUSINESS GRAND TOTAL ({g_pct:.1f}% Collected)",
-        'Debit': grand_billed, 'Credit': grand_collected, 'Balance': grand_outstanding, 'Status': g_status
-    })
+    show = st.selectbox("Filter", list(MISSING_FILTERS), key='comp_filter')
+    shown = missing(lines, show)
+    if show != 'All lines':
+        summary = summary[summary['Quote_ID'].isin(shown['Quote_ID'].unique())]
+    st.dataframe(summary.drop(columns='Business'), hide_index=True, use_container_width=True,
+                 column_config={'Complete %': st.column_config.ProgressColumn(min_value=0, max_value=100, format="%.1f%%")})
+    if shown.empty:
+        st.success("✅ No payment lines match this filter.")
+    else:
+        st.dataframe(matrix_table(shown), hide_index=True, use_container_width=True,
+                     column_config={'Amount': st.column_config.NumberColumn(format="%.2f")})
+
+
+def render_composition(df_q, df_i, df_p, business, key):
+    """Per-project lifecycle donuts: one small-multiples figure per page, filterable."""
+    data_version = ledger_service().fingerprint()
+    f1, f2 = st.columns([2, 1])
+    show = f1.selectbox("Show", list(FILTERS), key=f"{key}_show", label_visibility="collapsed")
+    comp = project_composition(cached_quote_rollup(data_version, df_q, df_i, df_p), business, show)
+    if comp.empty:
+        st.info("No projects to show.")
+        return
+    pages = page_count(comp)
+    page = f2.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page",
+                           label_visibility="collapsed") - 1 if pages > 1 else 0
+    fig = pio.from_json(cached_composition_json(data_version, business, show, page, df_q, df_i, df_p))
+    st.plotly_chart(fig, use_container_width=True, key=f"{key}_fig")
+    if pages > 1:
+        st.caption(f"Page {page + 1} of {pages} · {len(comp)} projects, largest first")
+
+
+@st.cache_data(show_spinner=False)
+def cached_quote_outstanding(data_version, _df_q, _df_i, _df_p):
+    return quote_outstanding(_df_q, _df_i, _df_p)
+
+
+@st.cache_data(show_spinner=False)
+def cached_forecast(data_version, business, as_of, include_unbilled, _df_q, _df_i, _df_p):
+    return forecast_cash_in(_df_q, _df_i, _df_p, business=business, as_of=as_of, include_unbilled=include_unbilled)
+
+
+def render_forecast(df_q, df_i, df_p, business, key):
+    """P10/P50/P90 cash-in by month from the Monte Carlo forecast."""
+    f1, f2 = st.columns(2)
+    include_unbilled = f1.checkbox("Include unbilled scope", value=True, key=f"{key}_unbilled")
+    view = f2.radio("View", ["Monthly", "Cumulative"], horizontal=True, key=f"{key}_view")
+    fc = cached_forecast(ledger_service().fingerprint(), business, datetime.today().strftime('%Y-%m-%d'), include_unbilled,
+                         df_q, df_i, df_p)
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Next 3 months (P50)", f"{fc['Cum_P50'].iloc[2]:,.0f}")
+    m2.metric("12 months (P50)", f"{fc['Cum_P50'].iloc[-1]:,.0f}")
+    m3.metric("12 months (P10 – P90)", f"{fc['Cum_P10'].iloc[-1]:,.0f} – {fc['Cum_P90'].iloc[-1]:,.0f}")
+
+    cols = ['P10', 'P50', 'P90'] if view == "Monthly" else ['Cum_P10', 'Cum_P50', 'Cum_P90']
+    fig = px.line(fc, x='Month', y=cols, markers=True,
+                  color_discrete_map=dict(zip(cols, ['#EF553B', '#636EFA', '#00CC96'])))
+    fig.update_layout(height=320, margin=dict(l=10, r=10, t=10, b=10), template="plotly_white",
+                      hovermode="x unified", yaxis_title="Cash in", legend_title_text="")
+    st.plotly_chart(fig, use_container_width=True)
+
+
+def render_portfolio(df_q, df_i, df_p):
+    st.title("🌐 Group Portfolio (All Business Units)")
+    roll = cached_business_rollup(ledger_service().fingerprint(), df_q, df_i, df_p)
+
+    if roll.empty:
+        st.info("No data available.")
+        return
+
+    g_billed = float(roll['Billed'].sum())
+    g_collected = float(roll['Collected'].sum())
+    g_outstanding = float(roll['Outstanding'].sum())
 
-    return pd.DataFrame(rows)
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Total Project Value", f"{roll['Project_Value'].sum():,.0f}")
+    c2.metric("Invoiced (Billed)", f"{g_billed:,.0f}")
+    c3.metric("Collected", f"{g_collected:,.0f}")
+    c4.metric("Outstanding", f"{g_outstanding:,.0f}", delta=float(-g_outstanding), delta_color="inverse")
 
+    st.divider()
+    st.write("#### 🧱 Lifecycle Composition by Business Unit")
+    comp = roll.melt(id_vars='Business', value_vars=['Collected', 'Outstanding', 'Unbilled'],
+                     var_name='Category', value_name='Value')
+    fig = px.bar(comp, x='Business', y='Value', color='Category', barmode='stack',
+                 color_discrete_map={'Collected': '#00CC96', 'Outstanding': '#EF553B', 'Unbilled': '#AB63FA'})
+    fig.update_layout(height=350, margin=dict(l=10, r=10, t=10, b=10), template="plotly_white")
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.write("#### 🔎 Units (click to drill down)")
+    table = roll.copy()
+    table['Open'] = "?biz=" + table['Business'].astype(str).map(quote_plus)
+    st.dataframe(
+        table,
+        column_order=['Business', 'Open', 'Quotes', 'Invoices', 'Project_Value', 'Billed', 'Collected',
+                      'Outstanding', 'Unbilled', 'Collection_Rate'],
+        column_config={
+            "Open": st.column_config.LinkColumn("Drill Down", display_text="Open ↗"),
+            "Project_Value": st.column_config.NumberColumn(format="%.0f"),
+            "Billed": st.column_config.NumberColumn(format="%.0f"),
+            "Collected": st.column_config.NumberColumn(format="%.0f"),
+            "Outstanding": st.column_config.NumberColumn(format="%.0f"),
+            "Unbilled": st.column_config.NumberColumn(format="%.0f"),
+            "Collection_Rate": st.column_config.ProgressColumn("Collected %", format="%.1f%%", min_value=0, max_value=100),
+        },
+        use_container_width=True, hide_index=True
+    )
 
-def save_db(df_q, df_i, df_p, curr_biz=None):
-    with pd.ExcelWriter(FILE, engine='openpyxl') as writer:
-        df_q.to_excel(writer, sheet_name='Quotations', index=False)
-        df_i.to_excel(writer, sheet_name='Invoices', index=False)
-        df_p.to_excel(writer, sheet_name='Payments', index=False)
+    st.divider()
+    st.write("#### ⏳ Receivables Aging by Business Unit")
+    render_aging(cached_quote_outstanding(ledger_service().fingerprint(), df_q, df_i, df_p), 'Business', key='port_aging')
+
+    st.divider()
+    st.write("#### 🔮 Cash-In Forecast (P10 / P50 / P90)")
+    render_forecast(df_q, df_i, df_p, None, key='port_fc')
+
+    st.divider()
+    st.write("#### 🩺 Ledger Integrity (all units)")
+    render_integrity(ledger_issues(df_q, df_i, df_p))
+
+
+@st.cache_resource
+def start_vault_sync():
+    # once per server process: pick up files that reached the vault outside safe_copy
+    return sync_vault_in_background(VAULT)
 
-        if curr_biz:
-            ledger_df = generate_ledger_view(curr_biz, df_q, df_i, df_p)
-            ledger_df.to_excel(writer, sheet_name='Master_Ledger_View', index=False)
-
-            ws = writer.book['Master_Ledger_View']
-            fill_q = PatternFill(start_color="E3F2FD", end_color="E3F2FD", fill_type="solid")
-            fill_inv = PatternFill(start_color="FFF9C4", end_color="FFF9C4", fill_type="solid")
-            fill_pay = PatternFill(start_color="E8F5E9", end_color="E8F5E9", fill_type="solid")
-            fill_sum = PatternFill(start_color="F5F5F5", end_color="F5F5F5", fill_type="solid")
-            fill_grand = PatternFill(start_color="212121", end_color="212121", fill_type="solid")
-            font_grand = Font(color="FFFFFF", bold=True)
-            red_font = Font(color="FF0000", bold=True)
-            green_font = Font(color="008000", bold=True)
-
-            for row in ws.iter_rows(min_row=2):
-                rtype = row[0].value
-                status = row[7].value
-
-                if rtype == 'QUOTE':
-                    for cell in row:
-                        cell.fill = fill_q
-                        cell.font = Font(bold=True)
-                elif rtype == 'INVOICE':
-                    for cell in row:
-                        cell.fill = fill_inv
-                elif rtype == 'PAYMENT':
-                    for cell in row:
-                        cell.fill = fill_pay
-                elif rtype == 'SUMMARY':
-                    for cell in row:
-                        cell.fill = fill_sum
-                        cell.font = Font(bold=True)
-                elif rtype == 'GRAND':
-                    for cell in row:
-                        cell.fill = fill_grand
-                        cell.font = font_grand
-
-                if status == '🔴':
-                    row[7].font = red_font
-                elif status == '✅' or status == '🟢':
-                    row[7].font = green_font
+
+@st.cache_resource
+def vault_watcher():
+    # once per server process: PDFs dropped into the vault become drafts in the inbox
+    return VaultWatcher(VAULT).start()
+
+
+def store_draft_file(rel_path, folder):
+    """Copy an approved draft's dropped file into the ledger folder app12 reads it from; returns the stored name."""
+    src = os.path.join(VAULT, rel_path)
+    if not os.path.isfile(src):
+        return "None"
+    name = os.path.basename(src)
+    stem, ext = os.path.splitext(name)
+    k = 2
+    while os.path.exists(os.path.join(folder, name)):
+        if filecmp.cmp(src, os.path.join(folder, name), shallow=False):
+            return name  # already there (dropped straight into its folder, or stored before)
+        name, k = f"{stem} ({k}){ext}", k + 1  # scan.pdf / slip.pdf: keep the other document
+    with open(src, "rb") as f:
+        return safe_copy(io.BytesIO(f.read()), folder, name)
+
+
+def _batch_repeats(drafts, notes, what):
+    # two drafts with one Ref in the same batch would book the same Quote_ID / Invoice_No twice
+    refs = drafts['Ref'].astype(str).str.strip()
+    clash = refs.ne("") & refs.duplicated(keep=False)
+    if clash.any():
+        notes.append(f"{int(clash.sum())} {what} share a Ref with another draft in this batch")
+    return drafts[~clash]
+
+
+def approve_drafts(rows, df_q, df_i, df_p, business):
+    """
+    Approved inbox rows -> new quotes, then invoices, then payments. Returns frames + approved ids + notes.
+    Each file is copied into the folder its record is read from (<quote>/Agreements, <quote>/Invoices,
+    Payments/<invoice>), under the final Quote_ID / Invoice_Ref.
+    """
+    done, notes = [], []
+    quotes = _batch_repeats(rows[rows['Kind'] == 'quote'], notes, "quote draft(s)")
+    if not quotes.empty:
+        taken = set(df_q['Quote_ID'].astype(str))
+        q_ids = [r if r and r not in taken else new_id('QT') for r in quotes['Ref'].astype(str).str.strip()]
+        new_q = pd.DataFrame({
+            'Quote_ID': q_ids,
+            'Date': pd.to_datetime(quotes['Date'], errors='coerce'), 'Business': business,
+            'Project_Name': quotes['Description'], 'Total_Value': quotes['Amount'].astype(float),
+            'Agreement_File': [store_draft_file(p, os.path.join(VAULT, business, q, "Agreements"))
+                               for p, q in zip(quotes['Path'], q_ids)],
+            'Status': 'Open',
+        })
+        df_q = pd.concat([df_q, new_q], ignore_index=True)
+        done += quotes['id'].tolist()
+
+    invoices = _batch_repeats(rows[rows['Kind'] == 'invoice'], notes, "invoice draft(s)")
+    biz_quotes = set(df_q.loc[df_q['Business'] == business, 'Quote_ID'].astype(str))
+    biz_invs = set(df_i.loc[df_i['Business'] == business, 'Invoice_No'].astype(str))
+    ok = invoices['Quote'].astype(str).isin(biz_quotes) & ~invoices['Ref'].astype(str).isin(biz_invs)
+    if (~ok).any():
+        notes.append(f"{int((~ok).sum())} invoice(s) need an existing quote and a new invoice number")
+    invoices = invoices[ok]
+    if not invoices.empty:
+        new_i = pd.DataFrame({
+            'Invoice_No': invoices['Ref'].astype(str), 'Quote_Ref': invoices['Quote'].astype(str),
+            'Date': pd.to_datetime(invoices['Date'], errors='coerce'), 'Business': business,
+            'Split_Amount': invoices['Amount'].astype(float), 'Description': invoices['Description'],
+            'Invoice_File': [store_draft_file(p, os.path.join(VAULT, business, str(q), "Invoices"))
+                             for p, q in zip(invoices['Path'], invoices['Quote'])],
+            'Declaration_File': "None",
+        })
+        df_i = pd.concat([df_i, new_i], ignore_index=True)
+        done += invoices['id'].tolist()
+
+    payments = rows[rows['Kind'] == 'payment']
+    biz_invs = set(df_i.loc[df_i['Business'] == business, 'Invoice_No'].astype(str))
+    ok = payments['Ref'].astype(str).isin(biz_invs) & (payments['Amount'] > 0)
+    if (~ok).any():
+        notes.append(f"{int((~ok).sum())} payment(s) need an existing invoice number and an amount")
+    payments = payments[ok]
+    if not payments.empty:
+        proofs = [store_draft_file(p, os.path.join(VAULT, business, "Payments", str(inv)))
+                  for p, inv in zip(payments['Path'], payments['Ref'])]
+        batch = pd.DataFrame({
+            'Parent_Payment_ID': [new_id('PAY') for _ in range(len(payments))],
+            'Invoice_Ref': payments['Ref'].astype(str).values, 'Amount': payments['Amount'].astype(float).values,
+            'Date': pd.to_datetime(payments['Date'], errors='coerce').values, 'Proof_File': proofs,
+        })
+        df_p = pd.concat([df_p, allocate_payments(batch, quote_dues(df_i, df_p, df_q), POLICIES[0])], ignore_index=True)
+        done += payments['id'].tolist()
+    return df_q, df_i, df_p, done, notes
+
+
+def render_inbox(df_q, df_i, df_p, business):
+    """Drafts from dropped vault files: review, fix, approve or dismiss in one batch."""
+    drafts = pending_drafts(business)
+    if drafts.empty:
+        return
+    # uploaded through the forms in the meantime -> the same bytes sit elsewhere under a ledger file name
+    # (names alone say nothing: scan.pdf / slip.pdf turn up in many folders)
+    stored = set(pd.concat([df_q['Agreement_File'], df_i['Invoice_File'], df_p['Proof_File']]).astype(str))
+    twins = same_content(drafts['path'], VAULT)
+    dup = drafts['path'].map(lambda p: any(os.path.basename(t) in stored for t in twins.get(p, [])))
+    if dup.any():
+        resolve_drafts(drafts.loc[dup, 'id'], 'duplicate')
+        drafts = drafts[~dup]
+    if drafts.empty:
+        return
+
+    with st.expander(f"📥 Vault Inbox: {len(drafts)} new document(s) ({vault_watcher().mode})", expanded=True):
+        grid = pd.DataFrame({
+            'Approve': drafts['error'] == "", 'id': drafts['id'], 'Path': drafts['path'], 'Kind': drafts['kind'],
+            'File': drafts['path'].map(os.path.basename), 'Ref': drafts['ref'],
+            'Quote': drafts['folder_ref'].where(drafts['kind'] == 'invoice', ""),
+            'Date': drafts['date'], 'Amount': drafts['amount'], 'Description': drafts['description'],
+            'Note': drafts['error'],
+        })
+        quote_opts = [""] + df_q.loc[df_q['Business'] == business, 'Quote_ID'].astype(str).tolist()
+        edited = st.data_editor(
+            grid, hide_index=True, use_container_width=True, key='inbox_grid',
+            disabled=['id', 'Path', 'Kind', 'File', 'Note'],
+            column_order=[c for c in grid.columns if c not in ('id', 'Path')],
+            column_config={
+                'Quote': st.column_config.SelectboxColumn(options=quote_opts, help="Quote of an invoice"),
+                'Ref': st.column_config.TextColumn(help="Quote ID / Invoice No / paid Invoice No"),
+                'Amount': st.column_config.NumberColumn(format="%.2f"),
+            })
+        picked = edited[edited['Approve']]
+        c1, c2 = st.columns(2)
+        if c1.button(f"✅ Approve {len(picked)} selected", key='inbox_approve', disabled=picked.empty):
+            df_q, df_i, df_p, done, notes = approve_drafts(picked, df_q, df_i, df_p, business)
+            for note in notes:
+                st.warning(f"⚠️ {note}: left in the inbox.")
+            if done:
+                save_db(df_q, df_i, df_p, business)
+                resolve_drafts(done, 'approved')
+                st.success(f"✅ {len(done)} draft(s) added to the ledger")
+                time.sleep(1)
+                st.rerun()
+        if c2.button(f"🗑️ Dismiss {len(picked)} selected", key='inbox_dismiss', disabled=picked.empty):
+            resolve_drafts(picked['id'], 'dismissed')
+            st.rerun()
+
+
+@st.cache_data
+def cached_file_records(data_version, _df_q, _df_i, _df_p, _df_a):
+    inv_biz = _df_i.drop_duplicates('Invoice_No').set_index('Invoice_No')['Business']
+    pays = _df_p.assign(Business=_df_p['Invoice_Ref'].map(inv_biz))
+    return file_records([
+        ("Quote", _df_q, 'Quote_ID', 'Business', ['Agreement_File']),
+        ("Invoice", _df_i, 'Invoice_No', 'Business', ['Invoice_File', 'Declaration_File']),
+        ("Payment", pays, 'Payment_ID', 'Business', ['Proof_File', 'Form_C_File', 'Payment_Decl_File']),
+        ("🗄️ Archived", archived_files(_df_a), 'Quote_ID', 'Business', ['File']),
+    ])
+
+
+def render_vault_search(df_q, df_i, df_p):
+    st.sidebar.divider()
+    query = st.sidebar.text_input("🔎 Search documents", placeholder="serial no., site, PO, invoice no...", key='vault_q')
+    if not query:
+        return
+    hits = search(query, limit=30)
+    if hits.empty:
+        st.sidebar.caption("No documents found.")
+    else:
+        hits = link_hits(hits, cached_file_records(ledger_service().fingerprint(), df_q, df_i, df_p,
+                                                  load_archived()))
+        hits['Open'] = "?biz=" + hits['Business'].astype(str).map(quote_plus)
+        st.sidebar.caption(f"{len(hits)} document(s)")
+        st.sidebar.dataframe(
+            hits, column_order=['File', 'Records', 'Open', 'Snippet'],
+            column_config={"Open": st.column_config.LinkColumn("Unit", display_text="Open ↗")},
+            hide_index=True, use_container_width=True
+        )
+    if st.sidebar.button("🔄 Re-index vault", key='vault_reindex'):
+        with st.spinner("Indexing vault..."):
+            added, removed = sync_vault(VAULT)
+        st.sidebar.success(f"✅ {added} indexed, {removed} removed")
+
+
+@st.cache_resource
+def integrity_state():
+    # shared by all sessions: last checked workbook version + its issues
+    return {}
+
+
+def ledger_issues(df_q, df_i, df_p):
+    # full check on first run, afterwards only the keys touched since the last version
+    return update_integrity(integrity_state(), ledger_service().fingerprint(), df_q, df_i, df_p)
+
+
+def render_integrity(issues, curr_biz=None):
+    """Warnings panel: counts per check, the offending rows and a CSV report."""
+    if curr_biz is not None:
+        issues = issues[issues['Business'] == curr_biz]
+    if issues.empty:
+        st.success("✅ No integrity issues.")
+        return
+    errors = int((issues['Severity'] == 'error').sum())
+    st.warning(f"⚠️ {len(issues)} issue(s), {errors} error(s)")
+    summary = summarize(issues)
+    st.dataframe(summary[summary['Issues'] > 0], use_container_width=True, hide_index=True,
+                 column_config={"Amount": st.column_config.NumberColumn(format="%.2f")})
+    with st.expander(f"📋 Issue details ({len(issues)})"):
+        st.dataframe(issues, use_container_width=True, hide_index=True)
+    st.download_button("📥 Download integrity report (CSV)", issues.to_csv(index=False).encode('utf-8'),
+                       file_name=f"integrity_{curr_biz or 'all'}_{datetime.now():%Y%m%d}.csv", mime="text/csv",
+                       key=f"integrity_dl_{curr_biz or 'all'}")
 
 
 # --- APP START ---
+start_vault_sync()
+vault_watcher()
+# ✅ first run next to an old app.py ledger: one-time import into the Quotations/Invoices/Payments model
+if not os.path.exists(FILE) and ledger_service().shards() is None and os.path.exists(LEGACY_FILE):
+    if st.sidebar.button(f"📦 Import {LEGACY_FILE}", key='legacy_import'):
+        counts = migrate_legacy_workbook(LEGACY_FILE, FILE)
+        st.sidebar.success("✅ Imported " + ", ".join(f"{c} {n.lower()}" for n, c in counts.items()))
 df_q, df_i, df_p = load_db()
+# ✅ duplicate index only re-syncs if invoice numbers were changed outside the app (archived numbers stay taken)
+arc_nos, arc_biz = archived_invoice_numbers(load_archived())
+sync_invoice_numbers('app12', ledger_service().fingerprint(), df_i['Invoice_No'].tolist() + arc_nos,
+                     df_i['Business'].tolist() + arc_biz)
+
+PORTFOLIO = "🌐 Group Portfolio"
 
 st.sidebar.title("🏢 Glafit Finance")
 all_biz = list(set(df_q['Business'].unique().tolist() + ["Glafit_Main"]))
-curr_biz = st.sidebar.selectbox("Select Business Unit", all_biz + ["+ New Business"])
+biz_opts = all_biz + [PORTFOLIO, "+ New Business"]
+# ?biz=<unit> comes from the portfolio drill-down links
+biz_param = st.query_params.get("biz")
+curr_biz = st.sidebar.selectbox("Select Business Unit", biz_opts,
+                                index=biz_opts.index(biz_param) if biz_param in biz_opts else 0)
 if curr_biz == "+ New Business":
     curr_biz = st.sidebar.text_input("New Business Name", "New_Unit_Name")
+render_vault_search(df_q, df_i, df_p)
+
+if curr_biz == PORTFOLIO:
+    render_portfolio(df_q, df_i, df_p)
+    st.stop()
 
 st.title(f"🚀 Operations: {curr_biz}")
+render_inbox(df_q, df_i, df_p, curr_biz)
 tab0, tab1, tab2, tab3, tab4 = st.tabs(["📈 Dashboard", "1️⃣ Quotations", "2️⃣ Invoices", "3️⃣ Payments", "📊 Master Ledger"])
 
 
@@ -461,12 +614,12 @@ with tab0:
     st.write("### 📊 Executive Overview")
 
     qs = df_q[df_q['Business'] == curr_biz]
-    invs = df_i[df_i['Business'] == curr_biz]
-    pays = df_p[df_p['Invoice_Ref'].isin(invs['Invoice_No'].astype(str))]
 
-    total_quote = float(qs['Total_Value'].sum())
-    total_billed = float(invs['Split_Amount'].sum())
-    total_collected = float(pays['Amount'].sum())
+    # ✅ O(1) subtotals of the business node (same allocation rule as the Master Ledger)
+    totals = ledger_tree(df_q, df_i, df_p).business_totals(curr_biz)
+    total_quote = totals['value']
+    total_billed = totals['billed']
+    total_collected = totals['collected']
 
     # ✅ Lifecycle composition (no overlap)
     val_collected = total_collected
@@ -497,30 +650,23 @@ with tab0:
 
     with c_pie2:
         st.write("#### 🏗️ Per-Project Composition (Lifecycle)")
-        if not qs.empty:
-            cols = st.columns(2)
-            for idx, (_, q) in enumerate(qs.iterrows()):
-                with cols[idx % 2]:
-                    qid = str(q['Quote_ID'])
-                    q_val = float(q['Total_Value'])
-
-                    q_invs = invs[invs['Quote_Ref'].astype(str) == qid]
-                    q_billed = float(q_invs['Split_Amount'].sum())
-
-                    # payments allocated to this quote across its invoices
-                    q_coll = 0.0
-                    for inv_no in q_invs['Invoice_No'].astype(str).unique().tolist():
-                        q_coll += float(_payments_for_invoice_quote(df_p, inv_no, qid)['Amount'].sum())
-
-                    p_coll = q_coll
-                    p_out = max(0.0, q_billed - q_coll)
-                    p_unbill = max(0.0, q_val - q_billed)
-
-                    # ✅ FIX: never overwrite df_p
-                    df_pie = pd.DataFrame({'Type': ['Collected', 'Outstanding', 'Unbilled'], 'Val': [p_coll, p_out, p_unbill]})
-                    fig_p = px.pie(df_pie, values='Val', names='Type', hole=0.4, title=f"<b>{q['Project_Name']}</b>")
-                    fig_p.update_layout(showlegend=False, height=200, margin=dict(l=10, r=10, t=30, b=10))
-                    st.plotly_chart(fig_p, use_container_width=True)
+        render_composition(df_q, df_i, df_p, curr_biz, key='biz_comp')
+
+    st.divider()
+
+    st.write("### ⏳ Receivables Aging (per Project)")
+    biz_lines = cached_quote_outstanding(ledger_service().fingerprint(), df_q, df_i, df_p)
+    render_aging(biz_lines[biz_lines['Business'] == curr_biz], 'Project_Name', key='biz_aging')
+
+    st.divider()
+
+    st.write("### 🔮 Cash-In Forecast (P10 / P50 / P90)")
+    render_forecast(df_q, df_i, df_p, curr_biz, key='biz_fc')
+
+    st.divider()
+
+    st.write("### 🩺 Ledger Integrity")
+    render_integrity(ledger_issues(df_q, df_i, df_p), curr_biz)
 
     st.divider()
 
@@ -528,32 +674,10 @@ with tab0:
     if qs.empty:
         st.info("No active projects.")
     else:
-        for _, q in qs.iterrows():
-            qid = str(q['Quote_ID'])
-            q_invs = invs[invs['Quote_Ref'].astype(str) == qid]
-            q_inv_ids = q_invs['Invoice_No'].astype(str).unique().tolist()
-
-            q_pays = df_p[df_p['Invoice_Ref'].isin(q_inv_ids)].copy()
-            # if allocated, show only this quote
-            if q_pays['Quote_Ref'].astype(str).str.len().sum() > 0:
-                q_pays = q_pays[q_pays['Quote_Ref'].astype(str) == qid]
-
-            with st.expander(f"📂 {q['Project_Name']} (ID: {qid}) - {len(q_pays)} Payment Lines"):
-                if not q_pays.empty:
-                    data = []
-                    for _, row in q_pays.iterrows():
-                        data.append({
-                            'Invoice': row['Invoice_Ref'],
-                            'Quote': row.get('Quote_Ref', ''),
-                            'Payment ID': row['Payment_ID'],
-                            'Amount': f"{row['Amount']:,.2f}",
-                            'Bank Slip': "✅" if str(row['Proof_File']) != "None" else "❌",
-                            'Form C': "✅" if str(row['Form_C_File']) != "None" else "❌",
-                            'Declaration': "✅" if str(row['Payment_Decl_File']) != "None" else "❌"
-                        })
-                    st.table(pd.DataFrame(data))
-                else:
-                    st.write("No payments yet.")
+        # Doc_Mask per payment line is computed once per ledger version, shared by all sessions
+        lines = ledger_service().view().derived(
+            'compliance', lambda f: compliance_lines(f['Quotations'], f['Invoices'], f['Payments']))
+        render_compliance(lines[lines['Business'] == curr_biz], qs)
 
 
 # --- TAB 1: QUOTATIONS ---
@@ -570,16 +694,34 @@ with tab1:
     if 'detected_sows' not in st.session_state:
         st.session_state.detected_sows = []
 
-    if q_file and not st.session_state.detected_sows:
-        with st.spinner("🤖 Scanning for 'Scope of Work' (SOW)..."):
-            with open("temp_agree.pdf", "wb") as f:
-                f.write(q_file.getbuffer())
-            results = parse_multi_sow_agreement("temp_agree.pdf")
-            if results:
-                st.session_state.detected_sows = results
-                st.success(f"✅ Found {len(results)} SOWs!")
-            else:
-                st.warning("No SOWs found. Use Manual Entry.")
+    # scan each agreement once; a failed, timed-out or cancelled scan is not retried on every rerun
+    if q_file and not st.session_state.detected_sows and st.session_state.get('sow_scanned') != q_file.name:
+        st.button("✖ Cancel scan", key='sow_cancel_scan')
+        bar = st.progress(0.0, text="🤖 Scanning for 'Scope of Work' (SOW)...")
+        scan = {'frac': 0.0, 'msg': "Scanning for 'Scope of Work' (SOW)..."}
+
+        def show_scan(frac=None, msg=None, elapsed=None):
+            # also called on every heartbeat: a Cancel click interrupts the script here
+            scan.update({k: v for k, v in (('frac', frac), ('msg', msg)) if v is not None})
+            tick = f" ({elapsed:.0f}s)" if elapsed is not None else ""
+            bar.progress(min(scan['frac'], 1.0), text=f"🤖 {scan['msg']}{tick}")
+
+        try:
+            results, st.session_state.sow_text = run_parser(
+                'parse_with_text', q_file.getvalue(), {'parser': 'parse_multi_sow_agreement'},
+                on_progress=lambda _, frac, msg: show_scan(frac, msg),
+                should_cancel=lambda: st.session_state.get('sow_cancel_scan'),
+                heartbeat=lambda s: show_scan(elapsed=s))
+        except ParserError as e:
+            results, st.session_state.sow_text = None, None
+            st.warning(f"⏱️ Could not scan the agreement ({e}). Use Manual Entry.")
+        st.session_state.sow_scanned = q_file.name
+        bar.empty()
+        if results:
+            st.session_state.detected_sows = results
+            st.success(f"✅ Found {len(results)} SOWs!")
+        elif results == []:
+            st.warning("No SOWs found. Use Manual Entry.")
 
     if st.session_state.detected_sows:
         with st.form("sow_form"):
@@ -587,7 +729,7 @@ with tab1:
             final_qs = []
             for idx, item in enumerate(st.session_state.detected_sows):
                 c1, c2, c3 = st.columns([2, 1, 1])
-                def_id = f"QT-{datetime.now().strftime('%y%m')}-{idx+1}"
+                def_id = item.setdefault('id', new_id('QT'))
                 n = c1.text_input(f"Project Name #{idx+1}", value=item['name'])
                 v = c2.number_input(f"Value #{idx+1}", value=float(item['amount']))
                 i = c3.text_input(f"ID #{idx+1}", value=def_id)
@@ -596,7 +738,7 @@ with tab1:
             if st.form_submit_button("💾 Save Detected Quotations"):
                 for q in final_qs:
                     base = os.path.join(VAULT, curr_biz, q['id'], "Agreements")
-                    fname = safe_copy(q_file, base, q_file.name)
+                    fname = safe_copy(q_file, base, q_file.name, st.session_state.get('sow_text'))
                     new_row = {
                         'Quote_ID': q['id'], 'Date': q['date'], 'Business': curr_biz,
                         'Project_Name': q['name'], 'Total_Value': q['val'],
@@ -613,14 +755,15 @@ with tab1:
     with st.expander("➕ Add Manual Quotation"):
         with st.form("man_q"):
             c1, c2 = st.columns(2)
-            mid = c1.text_input("Quote ID")
+            mid = c1.text_input("Quote ID", placeholder="blank = auto-generate")
             mname = c2.text_input("Project Name")
             c3, c4 = st.columns(2)
             mval = c3.number_input("Value", min_value=0.0)
             mfile = c4.file_uploader("Agreement PDF (Optional)", type=['pdf'])
 
             if st.form_submit_button("Save Manual Quote"):
-                if mid and mname:
+                mid = mid.strip() or new_id('QT')
+                if mname:
                     fname = safe_copy(mfile, os.path.join(VAULT, curr_biz, mid, "Agreements"), mfile.name) if mfile else "None"
                     new_row = {
                         'Quote_ID': mid, 'Date': datetime.today(), 'Business': curr_biz,
@@ -639,128 +782,179 @@ with tab2:
     st.write("### 🧾 Invoice Processing")
 
     col_up, col_view = st.columns([1, 1])
-    i_file = col_up.file_uploader("Upload Invoice PDF", type=['pdf'], key='inv_up')
-    i_decl_file = col_up.file_uploader("Upload Declaration/Mushak PDF", type=['pdf'], key='inv_dec')
+    i_files = col_up.file_uploader("Upload Invoice PDF(s)", type=['pdf'], key='inv_up', accept_multiple_files=True)
+    i_decl_files = col_up.file_uploader("Upload Declaration/Mushak PDF(s)", type=['pdf'], key='inv_dec', accept_multiple_files=True)
+    files_by_name = {f.name: f for f in i_files}
+    decl_by_name = {f.name: f for f in i_decl_files}
 
-    if i_file:
+    if i_files:
         with col_view:
             with st.expander("📄 Invoice Preview", expanded=True):
-                display_pdf(i_file)
-
-    if 'map_items' not in st.session_state:
-        st.session_state.map_items = []
-
-    if i_file and not st.session_state.map_items:
-        with st.spinner("🔍 Analyzing Table Structure..."):
-            with open("temp_inv.pdf", "wb") as f:
-                f.write(i_file.getbuffer())
-            data = parse_invoice_v2("temp_inv.pdf")
-            st.session_state.inv_meta = data
-            st.session_state.map_items = []
-            for idx, item in enumerate(data['items']):
-                st.session_state.map_items.append({
-                    'id': idx,
-                    'desc': item['desc'],
-                    'amt': float(item['amount']),
-                    'action': 'Existing Quote',
-                    'target': '',
-                    'alloc_amt': float(item['amount'])  # ✅ adjustable
-                })
-
-    if st.session_state.map_items:
-        meta = st.session_state.inv_meta
-        st.info(f"**Invoice:** {meta['no']} | **PDF Total:** {meta['total']:,.2f}")
-
-        raw_opts = df_q[df_q['Business'] == curr_biz]
-        smart_opts = raw_opts.apply(lambda x: f"{x['Quote_ID']} | {x['Project_Name']}", axis=1).tolist()
-
+                prev_name = st.selectbox("Preview", list(files_by_name), key='inv_prev') if len(i_files) > 1 else i_files[0].name
+                display_pdf(files_by_name[prev_name])
+
+    if 'inv_batch' not in st.session_state:
+        st.session_state.inv_batch = {}  # file name -> parsed invoice meta
+    st.session_state.setdefault('inv_edits', {})  # (file, line) -> grid edits, kept while files come and go
+
+    # drop files the user removed from the uploader, parse only the new ones
+    st.session_state.inv_batch = {k: v for k, v in st.session_state.inv_batch.items() if k in files_by_name}
+    st.session_state.inv_edits = {k: v for k, v in st.session_state.inv_edits.items() if k[0] in files_by_name}
+    pending = [f for f in i_files if f.name not in st.session_state.inv_batch]
+
+    raw_opts = df_q[df_q['Business'] == curr_biz]
+    smart_opts = raw_opts.apply(lambda x: f"{x['Quote_ID']} | {x['Project_Name']}", axis=1).tolist()
+
+    if pending:
+        # clicking Cancel reruns the script, which kills the running workers; on that rerun the flag is
+        # set and the pool hands every file still pending back for manual entry
+        st.button("✖ Cancel parsing", key='inv_cancel_parse')
+        grid_slot = st.empty()
+        progress = st.progress(0.0, text=f"🔍 Analyzing {len(pending)} invoice(s)...")
+        partial = {}
+
+        last = {'text': f"🔍 Analyzing {len(pending)} invoice(s)..."}
+
+        def show_progress(fname, frac, msg):
+            partial[fname] = frac
+            last['text'] = f"🔍 {fname}: {msg}"
+            progress.progress(min(sum(partial.values()) / len(pending), 1.0), text=last['text'])
+
+        def heartbeat(elapsed):
+            # touches the bar every poll so a Cancel click interrupts the script even while a parse hangs
+            progress.progress(min(sum(partial.values()) / len(pending), 1.0), text=f"{last['text']} ({elapsed:.0f}s)")
+
+        for fname, meta in parse_invoices_isolated(pending, on_progress=show_progress, heartbeat=heartbeat,
+                                                   should_cancel=lambda: st.session_state.get('inv_cancel_parse')):
+            st.session_state.inv_batch[fname] = meta
+            partial[fname] = 1.0
+            show_progress(fname, 1.0, "done" if 'error' not in meta else meta['error'])
+            # results show up in the grid as soon as each parse lands
+            grid_slot.dataframe(build_invoice_grid(st.session_state.inv_batch, smart_opts, list(decl_by_name)),
+                                use_container_width=True, hide_index=True)
+        progress.empty()
+        grid_slot.empty()
+
+    if st.session_state.inv_batch:
+        metas = st.session_state.inv_batch
+        for n, m in metas.items():
+            if 'error' in m:
+                st.warning(f"⏱️ {n}: could not be read automatically ({m['error']}) — enter its number and lines by hand.")
+        st.info(" | ".join(f"**{m['no']}** ({n}): {m['total']:,.2f}" for n, m in metas.items()))
         st.write("👇 **Map Line Items to Quotations (with adjustable allocation amount)**")
-        final_rows = []
-        valid_form = True
-
-        for item in st.session_state.map_items:
-            c1, c2, c3, c4 = st.columns([2.2, 1.2, 2.3, 1.3])
-
-            c1.write(f"**{item['desc'][:55]}...**")
-            c1.caption(f"Detected amount: {item['amt']:,.2f}")
-
-            act = c2.radio("Action", ["Existing Quote", "New Quote", "Ignore"], key=f"a_{item['id']}")
-            target_id = ""
-            new_q_data = None
-
-            # ✅ NEW: adjustable allocation amount (even for existing quote)
-            alloc_amt = c4.number_input(
-                "Allocate",
-                min_value=0.0,
-                value=float(item.get('alloc_amt', item['amt'])),
-                step=1.0,
-                key=f"alloc_{item['id']}",
-                help="How much of this invoice line will be posted against the selected quotation."
-            )
-
-            if act == "Existing Quote":
-                sel_str = c3.selectbox("Select Quote", smart_opts, key=f"s_{item['id']}")
-                if sel_str:
-                    target_id = sel_str.split(' | ')[0]
-
-            elif act == "New Quote":
-                new_id = c3.text_input("New ID", value=f"QT-{meta['no']}-{item['id']}", key=f"ni_{item['id']}")
-                new_nm = c3.text_input("New Project Name", value=item['desc'][:30], key=f"nn_{item['id']}")
-                new_val = c3.number_input("New Quote Value", value=float(item['amt']), key=f"nv_{item['id']}")
-                if new_id and new_nm:
-                    new_q_data = {'id': new_id, 'name': new_nm, 'val': new_val}
-                    target_id = new_id
-                else:
-                    valid_form = False
-
-            # Basic validation: cannot allocate more than detected amount (soft rule)
-            if alloc_amt > float(item['amt']) + 0.0001:
-                valid_form = False
-                st.warning(f"⚠️ Line #{item['id']+1}: allocation cannot exceed detected amount.")
 
-            final_rows.append({'meta': item, 'target': target_id, 'new_q': new_q_data, 'action': act, 'alloc_amt': float(alloc_amt)})
+        # the editor keeps its edits by row position: when the files change, start it over from the saved edits
+        if st.session_state.get('inv_grid_files') != list(metas):
+            st.session_state.pop('inv_grid', None)
+            st.session_state.inv_grid_files = list(metas)
+        grid = build_invoice_grid(metas, smart_opts, list(decl_by_name), st.session_state.inv_edits)
+        edited = st.data_editor(
+            grid,
+            column_config={
+                "File": st.column_config.TextColumn(disabled=True),
+                "Line": st.column_config.NumberColumn(disabled=True),
+                "Detected": st.column_config.NumberColumn(format="%.2f", disabled=True),
+                "Action": st.column_config.SelectboxColumn(options=["Existing Quote", "New Quote", "Ignore"], required=True),
+                "Quote": st.column_config.SelectboxColumn("Existing Quote", options=smart_opts),
+                "New_Quote_ID": st.column_config.TextColumn("New ID"),
+                "New_Project": st.column_config.TextColumn("New Project Name"),
+                "New_Value": st.column_config.NumberColumn("New Quote Value", min_value=0.0),
+                "Allocate": st.column_config.NumberColumn(min_value=0.0, format="%.2f",
+                                                          help="How much of this invoice line will be posted against the selected quotation."),
+                "Declaration": st.column_config.SelectboxColumn(options=["None"] + list(decl_by_name)),
+            },
+            hide_index=True, use_container_width=True, key='inv_grid'
+        )
+        st.session_state.inv_edits = {
+            (r['File'], r['Line']): {c: r[c] for c in edited.columns if c not in INV_GRID_FIXED}
+            for r in edited.to_dict('records')}
+
+        active = edited[edited['Action'] != "Ignore"]
+        problems = []
+        if (active['Allocate'] > active['Detected'] + 0.0001).any():
+            problems.append("allocation cannot exceed detected amount")
+        if (active['Action'].eq("Existing Quote") & active['Quote'].isna()).any():
+            problems.append("pick a quotation for every 'Existing Quote' line")
+        if (active['Action'].eq("New Quote") & (active['New_Quote_ID'].fillna("").str.strip().eq("") |
+                                                 active['New_Project'].fillna("").str.strip().eq(""))).any():
+            problems.append("'New Quote' lines need an ID and a project name")
+        for msg in problems:
+            st.warning(f"⚠️ {msg}")
+
+        # Duplicate check: indexed lookups per invoice (all businesses, both apps) + within this batch
+        dup_block, dup_warn = [], []
+        seen_no, seen_doc = {}, {}
+        for fname, no in active[['File', 'Invoice_No']].drop_duplicates().itertuples(index=False):
+            fp = metas[fname].get('fingerprint')
+            blocking, warnings = describe_matches(no, fp)
+            dup_block += [f"{fname}: {m}" for m in blocking]
+            dup_warn += [f"{fname}: {m}" for m in warnings]
+            key = normalize_invoice_no(no)
+            if key in seen_no and seen_no[key] != fname:
+                dup_block.append(f"{fname}: Invoice No '{no}' also used by {seen_no[key]} in this batch")
+            seen_no.setdefault(key, fname)
+            if fp and fp['content_hash'] in seen_doc and seen_doc[fp['content_hash']] != fname:
+                dup_block.append(f"{fname}: same document as {seen_doc[fp['content_hash']]}")
+            if fp:
+                seen_doc.setdefault(fp['content_hash'], fname)
+        for msg in dup_block:
+            st.error(f"🛑 Duplicate — {msg}")
+        for msg in dup_warn:
+            st.warning(f"🔁 Possible duplicate — {msg}")
+        allow_dups = st.checkbox("Post anyway (I checked the duplicates above)", key='inv_allow_dups') if dup_block else False
 
         st.divider()
-        if st.button("💾 Process Invoice"):
-            if not i_file:
-                st.error("⚠️ Invoice PDF missing!")
-            elif not valid_form:
+        if st.button(f"💾 Process {len(metas)} Invoice(s) ({len(active)} line(s))"):
+            if problems:
                 st.error("⚠️ Fix mapping/allocation issues.")
+            elif dup_block and not allow_dups:
+                st.error("🛑 Duplicate invoice(s) in this batch — fix the numbers or confirm 'Post anyway'.")
             else:
-                fname_inv = safe_copy(i_file, os.path.join(VAULT, curr_biz, "Invoices"), i_file.name)
-                fname_dec = safe_copy(i_decl_file, os.path.join(VAULT, curr_biz, "Invoices"), i_decl_file.name) if i_decl_file else "None"
-
-                count = 0
-                for r in final_rows:
-                    if r['action'] == "Ignore":
-                        continue
-
-                    if r['new_q']:
-                        d = r['new_q']
-                        os.makedirs(os.path.join(VAULT, curr_biz, d['id'], "Invoices"), exist_ok=True)
-                        q_row = {
-                            'Quote_ID': d['id'], 'Date': meta['date'], 'Business': curr_biz,
-                            'Project_Name': d['name'], 'Total_Value': d['val'], 'Status': 'Auto',
+                inv_folder = os.path.join(VAULT, curr_biz, "Invoices")
+                stored = {n: safe_copy(files_by_name[n], inv_folder, n, metas[n].get('text')) for n in active['File'].unique()}
+                stored_decl = {n: safe_copy(decl_by_name[n], inv_folder, n)
+                               for n in active['Declaration'].dropna().unique() if n in decl_by_name}
+
+                q_rows, inv_rows = [], []
+                for _, r in active.iterrows():
+                    meta = metas[r['File']]
+                    if r['Action'] == "New Quote":
+                        target = str(r['New_Quote_ID']).strip()
+                        os.makedirs(os.path.join(VAULT, curr_biz, target, "Invoices"), exist_ok=True)
+                        q_rows.append({
+                            'Quote_ID': target, 'Date': meta['date'], 'Business': curr_biz,
+                            'Project_Name': r['New_Project'], 'Total_Value': float(r['New_Value']), 'Status': 'Auto',
                             'Agreement_File': "None"
-                        }
-                        df_q = pd.concat([df_q, pd.DataFrame([q_row])], ignore_index=True)
+                        })
+                    else:
+                        target = str(r['Quote']).split(' | ')[0]
 
-                    inv_row = {
-                        'Invoice_No': str(meta['no']),
-                        'Quote_Ref': str(r['target']),
+                    inv_rows.append({
+                        'Invoice_No': str(r['Invoice_No']),
+                        'Quote_Ref': target,
                         'Date': meta['date'],
                         'Business': curr_biz,
-                        'Split_Amount': float(r['alloc_amt']),  # ✅ allocated amount saved
-                        'Description': r['meta']['desc'],
-                        'Invoice_File': fname_inv,
-                        'Declaration_File': fname_dec
-                    }
-                    df_i = pd.concat([df_i, pd.DataFrame([inv_row])], ignore_index=True)
-                    count += 1
-
+                        'Split_Amount': float(r['Allocate']),  # ✅ allocated amount saved
+                        'Description': r['Description'],
+                        'Invoice_File': stored[r['File']],
+                        'Declaration_File': stored_decl.get(r['Declaration'], "None")
+                    })
+
+                # ✅ whole batch -> one concat per sheet and ONE save_db
+                if q_rows:
+                    df_q = pd.concat([df_q, pd.DataFrame(q_rows)], ignore_index=True)
+                df_i = pd.concat([df_i, pd.DataFrame(inv_rows)], ignore_index=True)
                 save_db(df_q, df_i, df_p, curr_biz)
-                st.success(f"✅ Saved {count} allocated invoice line(s)!")
-                st.session_state.map_items = []
+                booked = active[['File', 'Invoice_No']].drop_duplicates()
+                register_invoices('app12', [
+                    {'invoice_no': no, 'business': curr_biz, 'file': stored[fname],
+                     'fingerprint': metas[fname].get('fingerprint')}
+                    for fname, no in booked.itertuples(index=False)
+                ], data_version=ledger_service().fingerprint())
+                st.success(f"✅ Saved {len(inv_rows)} allocated invoice line(s) from {len(stored)} invoice(s)!")
+                st.session_state.inv_batch = {}
+                st.session_state.inv_edits = {}
+                st.session_state.pop('inv_grid', None)
                 time.sleep(1)
                 st.rerun()
 
@@ -796,25 +990,22 @@ with tab3:
             due_val = float(inv_totals[sel_inv_no]) - float(pay_totals.get(sel_inv_no, 0.0))
             due_val = max(0.0, due_val)
 
-            # ✅ Determine the quote lines under this invoice (invoice may map to multiple quotations)
-            inv_lines = curr_invs[curr_invs['Invoice_No'].astype(str) == str(sel_inv_no)].copy()
-            inv_lines['Quote_Ref'] = inv_lines['Quote_Ref'].astype(str)
-
-            # For each quote inside this invoice, compute due = billed - paid(allocated)
-            quote_due_rows = []
-            for qref, grp in inv_lines.groupby('Quote_Ref'):
-                billed_q = float(grp['Split_Amount'].sum())
-                paid_q = float(df_p[(df_p['Invoice_Ref'].astype(str) == str(sel_inv_no)) & (df_p['Quote_Ref'].astype(str) == str(qref))]['Amount'].sum())
-                due_q = max(0.0, billed_q - paid_q)
-                quote_due_rows.append({'Quote_Ref': qref, 'Billed': billed_q, 'Paid': paid_q, 'Due': due_q})
-
-            quote_due_df = pd.DataFrame(quote_due_rows).sort_values('Quote_Ref')
+            # ✅ Per-quote dues for every invoice of this business in ONE grouped pass, then slice
+            biz_dues = quote_dues(curr_invs, df_p, df_q)
+            quote_due_df = biz_dues[biz_dues['Invoice_No'] == str(sel_inv_no)].sort_values('Quote_Ref')
             multi_quote = len(quote_due_df) > 1
 
+            # Amount + policy sit outside the form so the proposed split follows them live
+            c1, c2 = st.columns(2)
+            p_amt = c1.number_input("Amount Received (partial allowed)", min_value=0.0, value=float(due_val), step=1.0,
+                                    key=f"p_amt_{sel_inv_no}")
+            policy = c2.selectbox("Allocation Policy", POLICIES, disabled=not multi_quote,
+                                  help="Oldest First fills the oldest quotation first; Pro-Rata splits by due; "
+                                       "Exact Match picks the quotation whose due equals the amount.")
+            proposal = propose_allocation(quote_due_df, p_amt, policy)
+
             with st.form("pay_form"):
-                c1, c2 = st.columns(2)
-                p_amt = c1.number_input("Amount Received (partial allowed)", min_value=0.0, value=float(due_val), step=1.0)
-                p_date = c2.date_input("Date", value=datetime.today())
+                p_date = st.date_input("Date", value=datetime.today())
 
                 st.write("📎 **Attachments (At least one required)**")
                 c_f1, c_f2, c_f3 = st.columns(3)
@@ -833,30 +1024,25 @@ with tab3:
                 if quote_due_df.empty:
                     st.warning("No invoice lines found to allocate. (Unexpected)")
                 else:
-                    st.dataframe(quote_due_df, use_container_width=True, height=180)
+                    st.dataframe(quote_due_df[['Quote_Ref', 'Billed', 'Paid', 'Due']].assign(Proposed=quote_due_df['Quote_Ref'].map(proposal)),
+                                 use_container_width=True, height=180, hide_index=True)
 
                     if multi_quote:
-                        st.caption("This invoice is linked to multiple quotations. Allocate the received amount across quotations below.")
+                        st.caption(f"This invoice is linked to multiple quotations. Proposed split uses **{policy}** (you can still change).")
                     else:
                         st.caption("This invoice is linked to a single quotation. Allocation will be auto-filled (you can still change).")
 
                     for _, r in quote_due_df.iterrows():
                         qref = str(r['Quote_Ref'])
-                        default_alloc = min(float(r['Due']), float(p_amt)) if not multi_quote else 0.0
                         alloc_inputs[qref] = st.number_input(
                             f"Allocate to Quote {qref}",
                             min_value=0.0,
-                            value=float(default_alloc),
+                            value=float(proposal.get(qref, 0.0)),
                             step=1.0,
-                            key=f"alloc_pay_{sel_inv_no}_{qref}"
+                            # keyed on policy + amount so a new proposal replaces stale inputs
+                            key=f"alloc_pay_{sel_inv_no}_{qref}_{policy}_{p_amt}"
                         )
 
-                    # If single quote and user didn't change, push full payment
-                    if not multi_quote and quote_due_df.shape[0] == 1:
-                        only_q = str(quote_due_df.iloc[0]['Quote_Ref'])
-                        # make it easier: show hint
-                        st.caption(f"Tip: set allocation for {only_q} to exactly {p_amt:,.0f} to match received amount.")
-
                 if st.form_submit_button("💾 Record Payment"):
                     if not (f_proof or f_formc or f_decl):
                         st.error("⚠️ You must upload at least one attachment.")
@@ -875,26 +1061,11 @@ with tab3:
                             n_formc = safe_copy(f_formc, save_path, f_formc.name) if f_formc else "None"
                             n_decl = safe_copy(f_decl, save_path, f_decl.name) if f_decl else "None"
 
-                            parent_id = f"PAY-{int(time.time())}"
-                            line_no = 0
+                            parent_id = new_id('PAY')
 
                             # ✅ Create one payment row per quote allocation (this enables perfect tracking)
-                            for qref, amt in alloc_inputs.items():
-                                if float(amt) <= 0:
-                                    continue
-                                line_no += 1
-                                new_row = {
-                                    'Payment_ID': f"{parent_id}-{line_no}",
-                                    'Parent_Payment_ID': parent_id,
-                                    'Invoice_Ref': str(sel_inv_no),
-                                    'Quote_Ref': str(qref),
-                                    'Date': p_date,
-                                    'Amount': float(amt),
-                                    'Proof_File': n_proof,
-                                    'Form_C_File': n_formc,
-                                    'Payment_Decl_File': n_decl
-                                }
-                                df_p = pd.concat([df_p, pd.DataFrame([new_row])], ignore_index=True)
+                            new_rows = payment_rows(parent_id, sel_inv_no, alloc_inputs, p_date, n_proof, n_formc, n_decl)
+                            df_p = pd.concat([df_p, pd.DataFrame(new_rows)], ignore_index=True)
 
                             save_db(df_q, df_i, df_p, curr_biz)
                             st.success("✅ Payment Recorded with allocation!")
@@ -967,19 +1138,98 @@ with tab3:
 
                     if file_path != "None" and file_path != "nan":
                         full_p = os.path.join(base_path, file_path)
-                        display_pdf(full_p)
+                        if not os.path.exists(full_p):
+                            # bulk bank imports keep one statement per business, not per invoice
+                            full_p = os.path.join(VAULT, curr_biz, "Payments", "Statements", file_path)
+                        if full_p.lower().endswith('.pdf'):
+                            display_pdf(full_p)
+                        else:
+                            st.info(f"🏦 Imported from bank statement `{file_path}`")
                     else:
                         st.info("No file attached.")
 
+    st.divider()
+    st.subheader("3. Bulk Bank Reconciliation")
+    st_file = st.file_uploader("Upload Bank Statement (CSV / OFX)", type=['csv', 'ofx', 'qfx'], key='bank_stmt')
+
+    if st_file:
+        try:
+            stmt = read_statement(st_file)
+        except Exception as e:
+            stmt = None
+            st.error(f"⚠️ Could not read statement: {e}")
+
+        if stmt is not None:
+            r1, r2, r3 = st.columns(3)
+            date_tol = r1.number_input("Date tolerance (days before invoice)", min_value=0, value=3)
+            max_delay = r2.number_input("Max days after invoice", min_value=1, value=365)
+            rec_policy = r3.selectbox("Allocation Policy", POLICIES, key='rec_policy')
+
+            # statement lines are matched against open invoices of ALL business units
+            open_invs = invoice_outstanding(df_i, df_p)
+            matches = match_statement(stmt, open_invs, posted_line_ids(df_p['Parent_Payment_ID']),
+                                      date_tol_days=date_tol, max_delay_days=max_delay)
+
+            counts = matches['Status'].value_counts()
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("✅ Matched", int(counts.get(STATUS_MATCHED, 0)))
+            m2.metric("⚠️ Needs Review", int(counts.get(STATUS_AMBIGUOUS, 0)))
+            m3.metric("❓ Unmatched", int(counts.get(STATUS_UNMATCHED, 0)))
+            m4.metric("🔁 Already Posted", int(counts.get(STATUS_POSTED, 0)))
+
+            edited = st.data_editor(
+                matches,
+                column_order=['Confirm', 'Status', 'Date', 'Amount', 'Description', 'Invoice_No', 'Business', 'Due',
+                              'Match_Type', 'Candidates', 'Note'],
+                column_config={
+                    "Confirm": st.column_config.CheckboxColumn("Post?"),
+                    "Invoice_No": st.column_config.SelectboxColumn(
+                        "Invoice", options=sorted(open_invs['Invoice_No'].astype(str).unique().tolist())),
+                    "Amount": st.column_config.NumberColumn(format="%.2f"),
+                    "Due": st.column_config.NumberColumn(format="%.2f"),
+                },
+                disabled=['Status', 'Date', 'Amount', 'Description', 'Business', 'Due', 'Match_Type', 'Candidates', 'Note'],
+                hide_index=True, use_container_width=True, height=400, key='rec_editor'
+            )
+
+            to_post = edited[edited['Confirm'] & edited['Invoice_No'].notna() & (edited['Status'] != STATUS_POSTED)]
+            if st.button(f"💾 Post {len(to_post)} Confirmed Payment(s)", disabled=to_post.empty):
+                # one statement copy per business touched, then ONE save for the whole batch
+                inv_biz = pd.Series(df_i['Business'].values, index=df_i['Invoice_No'].astype(str)).groupby(level=0).first()
+                for biz in to_post['Invoice_No'].astype(str).map(inv_biz).dropna().unique():
+                    safe_copy(st_file, os.path.join(VAULT, biz, "Payments", "Statements"), st_file.name)
+
+                batch = pd.DataFrame({
+                    'Parent_Payment_ID': to_post['Line_ID'].map(parent_payment_id),
+                    'Invoice_Ref': to_post['Invoice_No'].astype(str),
+                    'Amount': to_post['Amount'],
+                    'Date': to_post['Date'],
+                    'Proof_File': st_file.name,
+                })
+                new_lines = allocate_payments(batch, quote_dues(df_i, df_p, df_q), rec_policy)
+                df_p = pd.concat([df_p, new_lines], ignore_index=True)
+                save_db(df_q, df_i, df_p, curr_biz)
+                st.success(f"✅ Posted {len(to_post)} payment(s) as {len(new_lines)} allocation line(s)!")
+                time.sleep(1)
+                st.rerun()
+
 
 # --- TAB 4: MASTER LEDGER ---
 with tab4:
     st.write("### 📊 Financial Master Ledger")
     if st.button("🔄 Refresh & Export"):
         save_db(df_q, df_i, df_p, curr_biz)
-        st.success(f"✅ Exported to {FILE}")
-
-    view_df = generate_ledger_view(curr_biz, df_q, df_i, df_p)
+        store = ledger_service().shards()
+        st.success(f"✅ Exported to {FILE if store is None else store.root}")
+
+    tree = ledger_tree(df_q, df_i, df_p)
+    view_df = generate_ledger_view(curr_biz, df_q, df_i, df_p, tree=tree)
+    df_a = load_archived()
+    unit_arch = df_a[df_a['Business'] == curr_biz]
+    if len(unit_arch):
+        st.caption(f"🗄️ {len(unit_arch)} settled quote(s) are in the cold archive (billed "
+                   f"{unit_arch['Billed'].sum():,.0f}, collected {unit_arch['Collected'].sum():,.0f}) "
+                   "and not listed below.")
 
     def style_df(row):
         bg = ''
@@ -1003,3 +1253,53 @@ with tab4:
 
     st.dataframe(view_df.style.apply(style_df, axis=1), height=800, use_container_width=True)
 
+    with st.expander("📤 Stream export (CSV / Parquet / JSONL)"):
+        e1, e2 = st.columns(2)
+        scope = e1.radio("Scope", [f"This unit ({curr_biz})", "All units"], key='exp_scope')
+        fmt = e2.selectbox("Format", list(FORMATS), key='exp_fmt')
+        if st.button("📤 Export", key='exp_run'):
+            os.makedirs(EXPORTS, exist_ok=True)
+            all_units = scope == "All units"
+            name = f"ledger_{'all' if all_units else curr_biz}_{datetime.now():%Y%m%d_%H%M%S}{FORMATS[fmt]}"
+            out_path = os.path.join(EXPORTS, name)
+            rows = iter_all_ledgers(df_q, df_i, df_p, None if all_units else [curr_biz], tree=tree)
+            status = st.empty()
+            n = export_ledger(rows, out_path, fmt, progress=lambda k: status.caption(f"{k:,} rows written..."))
+            st.session_state.last_export = out_path
+            status.success(f"✅ {n:,} rows -> {out_path}")
+
+        last = st.session_state.get('last_export')
+        if last and os.path.exists(last):
+            size_mb = os.path.getsize(last) / 1e6
+            if size_mb <= DOWNLOAD_MAX_MB:
+                with open(last, 'rb') as f:
+                    st.download_button(f"📥 Download {os.path.basename(last)} ({size_mb:,.1f} MB)", f,
+                                       file_name=os.path.basename(last), key='exp_dl')
+            else:
+                st.info(f"{os.path.basename(last)} is {size_mb:,.0f} MB - pick it up from the {EXPORTS} folder.")
+
+    with st.expander("🗄️ Cold archive (settled quotes)"):
+        # fully billed + paid quotes leave the working set with their invoices and payments (archive.py)
+        settled = settled_quotes(df_q, df_i, df_p, curr_biz)
+        a1, a2 = st.columns([3, 1])
+        a1.caption(f"{len(settled)} quote(s) of {curr_biz} are fully billed and paid.")
+        if a2.button(f"🗄️ Archive {len(settled)}", key='arc_run', disabled=not settled):
+            _, n = archive_settled(ledger_service(), lambda new, old: write_workbook(new, curr_biz), settled)
+            st.success(f"✅ {n} quote(s) moved to the archive")
+            time.sleep(1)
+            st.rerun()
+
+        c1, c2 = st.columns([3, 1])
+        arc_q = c1.text_input("🔎 Search archive", placeholder="quote, project, invoice no., payment, file...",
+                              key='arc_q')
+        everywhere = c2.checkbox("All units", key='arc_all')
+        hits = search_archive(df_a if everywhere else unit_arch, arc_q)
+        st.dataframe(hits, column_order=['Quote_ID', 'Business', 'Project_Name', 'Date', 'Total_Value', 'Billed',
+                                         'Collected', 'Invoices', 'Payments', 'Files', 'Archived_At'],
+                     hide_index=True, use_container_width=True)
+        back = st.multiselect("Restore to the working set", hits['Quote_ID'].tolist(), key='arc_pick')
+        if st.button("♻️ Restore", key='arc_restore', disabled=not back):
+            _, n = restore_quotes(ledger_service(), lambda new, old: write_workbook(new, curr_biz), back)
+            st.success(f"✅ {n} quote(s) restored")
+            time.sleep(1)
+            st.rerun()
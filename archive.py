@@ -0,0 +1,228 @@
+import os
+import shutil
+from datetime import datetime
+import pandas as pd
+from ids import new_id
+from rollups import quote_rollup
+from snapshot import _arrow_safe
+
+try:
+    import pyarrow  # noqa: F401  (pandas' parquet engine)
+    COLD_EXT = '.parquet'
+except ImportError:  # pragma: no cover - gzip pickles keep the archive working without pyarrow
+    COLD_EXT = '.pkl.gz'
+
+# --- COLD ARCHIVE ---
+# Fully settled quotes (nothing unbilled, nothing unpaid) leave the hot ledger:
+#   cold : <workbook>_archive/<batch>/Quotations|Invoices|Payments.parquet (zstd), the rows exactly as
+#          they were, vault file references included
+#   hot  : one row per archived quote in the master "Archived" sheet (totals, invoice / payment numbers,
+#          files, batch). Search reads that sheet; restore() goes back to the batch for the rows.
+# A quote only moves together with all of its invoices: an invoice split over several quotes goes once
+# every one of them is settled, and its unallocated payments go with it. The PDFs stay in Master_Vault
+# (the document index keeps finding them); only ledger rows move. Both directions are commits through
+# the ledger service, so they are serialized with every other save.
+
+COLD_SHEETS = ('Quotations', 'Invoices', 'Payments')
+SETTLED_TOLERANCE = 1.0  # same threshold as the ✅ of the ledger view
+_FILE_COLS = {'Quotations': ['Agreement_File'], 'Invoices': ['Invoice_File', 'Declaration_File'],
+              'Payments': ['Proof_File', 'Form_C_File', 'Payment_Decl_File']}
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def archive_root(path):
+    return f"{os.path.splitext(path)[0]}_archive"
+
+
+def _cold_file(path, batch, sheet):
+    return os.path.join(archive_root(path), batch, sheet + COLD_EXT)
+
+
+def read_batch(path, batch):
+    """Cold rows of one archive batch ({sheet: DataFrame})."""
+    out = {}
+    for sheet in COLD_SHEETS:
+        f = _cold_file(path, batch, sheet)
+        out[sheet] = pd.read_parquet(f) if COLD_EXT == '.parquet' else pd.read_pickle(f)
+    return out
+
+
+def _write_batch(path, batch, frames):
+    folder = os.path.join(archive_root(path), batch)
+    os.makedirs(folder, exist_ok=True)
+    for sheet in COLD_SHEETS:
+        f, df = _cold_file(path, batch, sheet), frames[sheet].reset_index(drop=True)
+        tmp = f + ".tmp"
+        if COLD_EXT == '.parquet':
+            _arrow_safe(df).to_parquet(tmp, compression='zstd')
+        else:
+            df.to_pickle(tmp, compression='gzip')
+        os.replace(tmp, f)
+
+
+def drop_batch(path, batch):
+    shutil.rmtree(os.path.join(archive_root(path), batch), ignore_errors=True)
+
+
+def settled_quotes(df_q, df_i, df_p, business=None):
+    """Quote_IDs that can be archived: billed, fully paid, nothing left to bill, invoices not shared with open quotes."""
+    roll = quote_rollup(df_q, df_i, df_p)
+    roll['ok'] = ((roll['Billed'] > 0) & (roll['Unbilled'].abs() < SETTLED_TOLERANCE)
+                  & (roll['Unpaid'].abs() < SETTLED_TOLERANCE))
+    ok = roll.groupby('Quote_ID')['ok'].all()
+    if business is not None:
+        ok = ok[ok.index.isin(roll.loc[roll['Business'] == business, 'Quote_ID'])]
+    ids = set(ok[ok].index)
+    lines = pd.DataFrame({'inv': _str(df_i['Invoice_No']), 'q': _str(df_i['Quote_Ref'])})
+    while ids:
+        open_invs = lines.loc[~lines['q'].isin(ids), 'inv']
+        shared = set(lines.loc[lines['inv'].isin(open_invs) & lines['q'].isin(ids), 'q'])
+        if not shared:
+            break
+        ids -= shared
+    return sorted(ids)
+
+
+def _split(frames, quote_ids):
+    """(rows that move, rows that stay) of the three ledger sheets for `quote_ids`."""
+    q, i, p = frames['Quotations'], frames['Invoices'], frames['Payments']
+    q_move = _str(q['Quote_ID']).isin(quote_ids)
+    i_move = _str(i['Quote_Ref']).isin(quote_ids)
+    invs = set(_str(i.loc[i_move, 'Invoice_No']))
+    p_ref = _str(p['Quote_Ref'])
+    p_move = _str(p['Invoice_Ref']).isin(invs) & ((p_ref == "") | p_ref.isin(quote_ids))
+    masks = {'Quotations': q_move, 'Invoices': i_move, 'Payments': p_move}
+    return ({s: frames[s][m] for s, m in masks.items()}, {s: frames[s][~m] for s, m in masks.items()})
+
+
+def _summaries(cold, batch, archived_at):
+    roll = quote_rollup(cold['Quotations'], cold['Invoices'], cold['Payments'])
+    inv, pay = cold['Invoices'], cold['Payments']
+    inv_q = dict(zip(_str(inv['Invoice_No']), _str(inv['Quote_Ref'])))
+    pay_q = _str(pay['Quote_Ref']).where(_str(pay['Quote_Ref']) != "", _str(pay['Invoice_Ref']).map(inv_q))
+
+    def joined(df, by, col):
+        return _str(df[col]).groupby(by.to_numpy()).agg(lambda s: ", ".join(dict.fromkeys(v for v in s if v)))
+
+    files = []
+    for sheet, cols in _FILE_COLS.items():
+        df = cold[sheet]
+        by = pay_q if sheet == 'Payments' else _str(df['Quote_ID' if sheet == 'Quotations' else 'Quote_Ref'])
+        for c in cols:
+            files.append(pd.DataFrame({'q': by.to_numpy(), 'f': _str(df[c]).to_numpy()}))
+    files = pd.concat(files, ignore_index=True)
+    files = files[~files['f'].isin(["", "None", "nan", "Manual_Entry"])]
+    files = files.groupby('q')['f'].agg(lambda s: ", ".join(dict.fromkeys(s)))
+
+    ids = roll['Quote_ID']
+    return pd.DataFrame({
+        'Quote_ID': ids, 'Date': roll['Date'], 'Business': roll['Business'], 'Project_Name': roll['Project_Name'],
+        'Total_Value': roll['Value'], 'Billed': roll['Billed'], 'Collected': roll['Collected'],
+        'Invoices': ids.map(joined(inv, _str(inv['Quote_Ref']), 'Invoice_No')).fillna(""),
+        'Payments': ids.map(joined(pay, pay_q, 'Payment_ID')).fillna(""),
+        'Files': ids.map(files).fillna(""),
+        'Archive_Batch': batch, 'Archived_At': archived_at,
+    }).drop_duplicates('Quote_ID')
+
+
+def archive_update(path, quote_ids, done):
+    """
+    commit() update that moves the still-settled `quote_ids` (all settled ones when None) to a new cold
+    batch and leaves their summary rows in Archived. The batch id and count land in `done`.
+    """
+    def update(current):
+        settled = settled_quotes(current['Quotations'], current['Invoices'], current['Payments'])
+        ids = set(settled) if quote_ids is None else set(quote_ids) & set(settled)
+        if not ids:
+            done.update(batch=None, quotes=0)
+            return current
+        cold, hot = _split(current, ids)
+        batch = new_id('ARC')
+        _write_batch(path, batch, cold)  # before the hot rows go: a failed write leaves the ledger as it was
+        done.update(batch=batch, quotes=len(ids))
+        summary = _summaries(cold, batch, datetime.now().isoformat(timespec='seconds'))
+        return {**current, **hot, 'Archived': pd.concat([current['Archived'], summary], ignore_index=True)}
+    return update
+
+
+def archive_settled(service, persist, quote_ids=None):
+    """Archive settled quotes through `service`. Returns (new view, number of quotes archived)."""
+    done = {}
+    try:
+        view = service.commit(archive_update(service.path, quote_ids, done), persist)
+    except Exception:
+        if done.get('batch'):
+            drop_batch(service.path, done['batch'])
+        raise
+    return view, done.get('quotes', 0)
+
+
+def _restore_set(cold, quote_ids):
+    """Requested quotes plus the ones sharing an invoice with them: they were archived as a unit."""
+    lines = pd.DataFrame({'inv': _str(cold['Invoices']['Invoice_No']), 'q': _str(cold['Invoices']['Quote_Ref'])})
+    ids = set(quote_ids)
+    while True:
+        more = set(lines.loc[lines['inv'].isin(lines.loc[lines['q'].isin(ids), 'inv']), 'q']) - ids
+        if not more:
+            return ids
+        ids |= more
+
+
+def restore_quotes(service, persist, quote_ids):
+    """Bring archived quotes (and their invoices / payments) back into the hot ledger. Returns (view, quotes)."""
+    archived = service.view()['Archived']
+    batches = archived.loc[_str(archived['Quote_ID']).isin(quote_ids), 'Archive_Batch'].unique()
+    back, rest = {}, {}
+    for batch in batches:
+        cold = read_batch(service.path, batch)
+        ids = _restore_set(cold, set(quote_ids) & set(_str(cold['Quotations']['Quote_ID'])))
+        back[batch], rest[batch] = _split(cold, ids)
+    restored = {s: pd.concat([b[s] for b in back.values()], ignore_index=True) for s in COLD_SHEETS} if back else {}
+    ids = set(_str(restored['Quotations']['Quote_ID'])) if back else set()
+
+    def update(current):
+        if not ids:
+            return current
+        out = dict(current)
+        for s, key in (('Quotations', 'Quote_ID'), ('Invoices', 'Quote_Ref'), ('Payments', 'Payment_ID')):
+            # rows that are somehow hot already (restored twice at once) are not added again
+            hot = set(_str(current['Quotations']['Quote_ID'] if s != 'Payments' else current[s]['Payment_ID']))
+            rows = restored[s][~_str(restored[s][key]).isin(hot)]
+            out[s] = pd.concat([current[s], rows], ignore_index=True)
+        out['Archived'] = current['Archived'][~_str(current['Archived']['Quote_ID']).isin(ids)]
+        return out
+
+    view = service.commit(update, persist)
+    # cold copies go only after the hot ledger has them back
+    for batch, remaining in rest.items():
+        if len(remaining['Quotations']):
+            _write_batch(service.path, batch, remaining)
+        else:
+            drop_batch(service.path, batch)
+    return view, len(ids)
+
+
+def search_archive(df_a, query):
+    """Archived summary rows matching `query` in ids, project, invoice / payment numbers or file names."""
+    if not query:
+        return df_a
+    text = (_str(df_a['Quote_ID']) + " " + _str(df_a['Project_Name']) + " " + _str(df_a['Invoices']) + " "
+            + _str(df_a['Payments']) + " " + _str(df_a['Files']))
+    return df_a[text.str.contains(query, case=False, regex=False)]
+
+
+def archived_invoice_numbers(df_a):
+    """(invoice numbers, businesses) of archived quotes, for the duplicate check."""
+    nos = _str(df_a['Invoices']).str.split(", ")
+    long = pd.DataFrame({'no': nos, 'biz': df_a['Business']}).explode('no')
+    long = long[long['no'].fillna("") != ""]
+    return long['no'].tolist(), long['biz'].tolist()
+
+
+def archived_files(df_a):
+    """One row per (archived quote, vault file), for linking document search hits."""
+    long = df_a.assign(File=_str(df_a['Files']).str.split(", ")).explode('File')
+    return long[long['File'].fillna("") != ""][['Quote_ID', 'Business', 'File']]
@@ -0,0 +1,61 @@
+import math
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# --- PROJECT COMPOSITION CHARTS ---
+# Per-project lifecycle donuts (Collected / Outstanding / Unbilled) as ONE small-multiples figure
+# per page, built from rollups.quote_rollup() instead of a px.pie + payment scans per quote.
+# Pure functions: the app caches the figure JSON per data version + business + filter + page.
+
+PARTS = ['Collected', 'Outstanding', 'Unbilled']
+COLORS = dict(zip(PARTS, px.colors.qualitative.Plotly))
+GRID_COLS = 3
+PAGE_SIZE = 24
+ROW_HEIGHT = 190
+FILTERS = {
+    'All projects': None,
+    'With outstanding': lambda c: c['Outstanding'] > 0.01,
+    'With unbilled scope': lambda c: c['Unbilled'] > 0.01,
+    'Fully collected': lambda c: (c['Outstanding'] <= 0.01) & (c['Unbilled'] <= 0.01),
+}
+
+
+def project_composition(rollup, business=None, show='All projects'):
+    """Quote rollup rows -> one row per project with the three lifecycle slices, biggest first."""
+    q = rollup if business is None else rollup[rollup['Business'] == business]
+    comp = pd.DataFrame({
+        'Quote_ID': q['Quote_ID'],
+        'Project_Name': q['Project_Name'].fillna("").astype(str),
+        'Value': q['Value'],
+        'Collected': q['Collected'],
+        'Outstanding': (q['Billed'] - q['Collected']).clip(lower=0.0),
+        'Unbilled': (q['Value'] - q['Billed']).clip(lower=0.0),
+    })
+    keep = FILTERS.get(show)
+    if keep is not None:
+        comp = comp[keep(comp)]
+    return comp.sort_values('Value', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def page_count(comp, page_size=PAGE_SIZE):
+    return max(1, math.ceil(len(comp) / page_size))
+
+
+def composition_figure(comp, cols=GRID_COLS, title_len=28):
+    """Donut grid for the projects in `comp` (one page), one shared legend."""
+    rows = max(1, math.ceil(len(comp) / cols))
+    titles = [f"<b>{n[:title_len]}</b>" for n in comp['Project_Name']]
+    fig = make_subplots(rows=rows, cols=cols, specs=[[{'type': 'domain'}] * cols] * rows,
+                        subplot_titles=titles or None)
+    marker = dict(colors=[COLORS[p] for p in PARTS])
+    for k, r in enumerate(comp.itertuples(index=False)):
+        fig.add_trace(go.Pie(labels=PARTS, values=[r.Collected, r.Outstanding, r.Unbilled], name=r.Project_Name,
+                             hole=0.4, sort=False, marker=marker, textinfo='percent', showlegend=(k == 0),
+                             hovertemplate="%{label}: %{value:,.0f} (%{percent})<extra>%{fullData.name}</extra>"),
+                      row=k // cols + 1, col=k % cols + 1)
+    fig.update_annotations(font_size=11)
+    fig.update_layout(height=ROW_HEIGHT * rows + 60, margin=dict(l=10, r=10, t=60, b=10),
+                      legend=dict(orientation='h', y=1.02, yanchor='bottom', x=0))
+    return fig
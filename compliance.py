@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+# --- DOCUMENT COMPLIANCE ---
+# Every payment line gets a 3-bit completeness mask (Doc_Mask) computed once per ledger version:
+#   1 = Bank Slip (Proof_File)   2 = Form C (Form_C_File)   4 = Declaration (Payment_Decl_File)
+# The Compliance Matrix, its count badges and the missing-documents filter are then plain
+# bit tests and one groupby over that column instead of a filter + iterrows per quote.
+
+DOCS = {'Bank Slip': ('Proof_File', 1), 'Form C': ('Form_C_File', 2), 'Declaration': ('Payment_Decl_File', 4)}
+COMPLETE = 7
+MISSING_FILTERS = {
+    'All lines': 0,
+    'Missing any document': COMPLETE,
+    'Missing Bank Slip': 1,
+    'Missing Form C': 2,
+    'Missing Declaration': 4,
+}
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def doc_mask(df_p):
+    """uint8 mask per payment line; a document counts as present unless its file is "None"."""
+    mask = np.zeros(len(df_p), dtype=np.uint8)
+    for col, bit in DOCS.values():
+        if col in df_p.columns:
+            present = (df_p[col].astype(str) != "None").fillna(True).to_numpy(dtype=bool)
+            mask |= present.astype(np.uint8) * np.uint8(bit)
+    return pd.Series(mask, index=df_p.index, name='Doc_Mask')
+
+
+def compliance_lines(df_q, df_i, df_p):
+    """
+    One row per (quote, payment line) as the matrix shows them: payments of the quote's invoices,
+    or only those allocated to the quote once any of them carries a Quote_Ref.
+    """
+    quotes = pd.DataFrame({'Business': df_q['Business'], 'Quote_ID': _str(df_q['Quote_ID']),
+                           'Project_Name': df_q['Project_Name']}).drop_duplicates(['Business', 'Quote_ID'])
+    invs = pd.DataFrame({'Business': df_i['Business'], 'Quote_ID': _str(df_i['Quote_Ref']),
+                         'Invoice_Ref': _str(df_i['Invoice_No'])}).drop_duplicates()
+    pays = pd.DataFrame({
+        'Invoice_Ref': _str(df_p['Invoice_Ref']),
+        'Quote': _str(df_p['Quote_Ref']) if 'Quote_Ref' in df_p.columns else "",
+        'Payment_ID': _str(df_p['Payment_ID']),
+        'Amount': pd.to_numeric(df_p['Amount'], errors='coerce').fillna(0.0),
+        'Doc_Mask': doc_mask(df_p),
+        '_pos': np.arange(len(df_p)),
+    })
+    lines = quotes.reset_index(drop=True).rename_axis('_q').reset_index() \
+        .merge(invs, on=['Business', 'Quote_ID']).merge(pays, on='Invoice_Ref')
+
+    allocated = (lines['Quote'].str.len() > 0).groupby([lines['Business'], lines['Quote_ID']]).transform('any')
+    lines = lines[~allocated | (lines['Quote'] == lines['Quote_ID'])]
+    lines = lines.sort_values(['_q', '_pos'], kind='stable')
+    return lines.drop(columns=['_q', '_pos']).reset_index(drop=True)
+
+
+def missing(lines, show):
+    """Lines that lack at least one of the documents selected by MISSING_FILTERS[show]."""
+    bits = MISSING_FILTERS[show]
+    if not bits:
+        return lines
+    return lines[(lines['Doc_Mask'].to_numpy() & bits) != bits]
+
+
+def compliance_summary(lines, df_q=None):
+    """Per quote: payment lines, fully documented lines and missing count per document.
+    With `df_q`, quotes without payment lines are listed too (all counts 0)."""
+    flags = pd.DataFrame({'Lines': 1, 'Complete': (lines['Doc_Mask'] == COMPLETE).astype(int)}, index=lines.index)
+    for doc, (_, bit) in DOCS.items():
+        flags[f"No {doc}"] = ((lines['Doc_Mask'].to_numpy() & bit) == 0).astype(int)
+    keys = [lines['Business'], lines['Quote_ID'], lines['Project_Name']]
+    out = flags.groupby(keys, sort=False, dropna=False).sum().reset_index()
+    if df_q is not None:
+        quotes = pd.DataFrame({'Business': df_q['Business'], 'Quote_ID': _str(df_q['Quote_ID']),
+                               'Project_Name': df_q['Project_Name']}).drop_duplicates(['Business', 'Quote_ID'])
+        out = quotes.merge(out.drop(columns='Project_Name'), on=['Business', 'Quote_ID'], how='left')
+        out[list(flags.columns)] = out[list(flags.columns)].fillna(0).astype(int)
+    out['Complete %'] = (out['Complete'] / out['Lines'] * 100.0).round(1)
+    return out
+
+
+def matrix_table(lines):
+    """Display frame of the matrix with ✅ / ❌ per document."""
+    out = pd.DataFrame({
+        'Project': lines['Project_Name'],
+        'Invoice': lines['Invoice_Ref'],
+        'Quote': lines['Quote'],
+        'Payment ID': lines['Payment_ID'],
+        'Amount': lines['Amount'],
+    })
+    mask = lines['Doc_Mask'].to_numpy()
+    for doc, (_, bit) in DOCS.items():
+        out[doc] = np.where(mask & bit, "✅", "❌")
+    return out.reset_index(drop=True)
@@ -0,0 +1,284 @@
+import hashlib
+import inspect
+import io
+import re
+import sqlite3
+from contextlib import contextmanager
+import numpy as np
+import pdfplumber
+import ingest
+
+# --- DUPLICATE DETECTION INDEX ---
+# One SQLite file shared by app.py and app12.py (all business units).
+# 1. invoice_numbers: normalized invoice number -> where it is booked, one row per raw spelling
+#    ("INV-1" and "inv 1" in one unit are two rows under the same key)
+# 2. documents: content fingerprint of every uploaded invoice PDF
+#       content_hash = sha256 of the normalized text + total  -> exact duplicate
+#       simhash      = 64-bit SimHash of word shingles         -> near duplicate (rescans, re-exports)
+#    Near duplicates are found through 8 indexed 8-bit bands: two hashes within
+#    NEAR_DISTANCE bits always share at least one band (pigeonhole), so no full scan is needed.
+# Writes from the apps register their invoice numbers directly. The table re-syncs from the workbook
+# only when the invoice numbers themselves changed behind it; other writes (payments) cost one hash.
+
+INDEX_FILE = 'Dedup_Index.sqlite'
+NEAR_DISTANCE = 7  # a changed number/date on a one-page invoice flips ~5-13 bits, unrelated texts ~20+
+BANDS = NEAR_DISTANCE + 1
+BAND_BITS = 64 // BANDS
+SHINGLE = 3
+
+_BAND_COLS = [f"b{i}" for i in range(BANDS)]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoice_numbers (
+    app TEXT NOT NULL, norm_no TEXT NOT NULL, invoice_no TEXT, business TEXT,
+    PRIMARY KEY (app, norm_no, business, invoice_no)
+);
+CREATE INDEX IF NOT EXISTS ix_inv_norm ON invoice_numbers (norm_no);
+CREATE TABLE IF NOT EXISTS documents (
+    content_hash TEXT PRIMARY KEY, simhash INTEGER, """ + ", ".join(f"{b} INTEGER" for b in _BAND_COLS) + """,
+    app TEXT, business TEXT, invoice_no TEXT, file TEXT, total REAL
+);
+CREATE TABLE IF NOT EXISTS sync_state (app TEXT PRIMARY KEY, data_version TEXT);
+CREATE TABLE IF NOT EXISTS number_state (app TEXT PRIMARY KEY, numbers_hash TEXT);
+""" + "".join(f"CREATE INDEX IF NOT EXISTS ix_doc_{b} ON documents ({b});\n" for b in _BAND_COLS)
+
+
+@contextmanager
+def open_index(path=INDEX_FILE):
+    """Connection that commits on success and is always closed."""
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        conn.executescript(_SCHEMA)
+        _migrate(conn)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _migrate(conn):
+    # files written before the raw number was part of the key kept one spelling per key: rebuild the
+    # table, and let each app's next sync_invoice_numbers refill it from its workbook
+    key = [r[1] for r in sorted(conn.execute("PRAGMA table_info(invoice_numbers)"), key=lambda r: r[5]) if r[5]]
+    if 'invoice_no' not in key:
+        with conn:
+            conn.execute("DROP TABLE invoice_numbers")
+            conn.execute("DELETE FROM sync_state")
+            conn.execute("DELETE FROM number_state")
+        conn.executescript(_SCHEMA)
+
+
+def normalize_invoice_no(no):
+    """'inv-0012 ' / 'INV 12' / 'INV/12' -> 'INV12' (case, separators and leading zeros ignored)."""
+    s = re.sub(r'[^A-Z0-9]', '', str(no).upper())
+    return re.sub(r'(?<![0-9])0+(?=[0-9])', '', s)
+
+
+# --- FINGERPRINTS ---
+def document_text(file_obj_or_path):
+    """All page text of a PDF (uploaded file object, bytes or path)."""
+    src = file_obj_or_path
+    if hasattr(src, 'getvalue'):
+        src = io.BytesIO(src.getvalue())
+    elif isinstance(src, bytes):
+        src = io.BytesIO(src)
+    try:
+        with pdfplumber.open(src) as pdf:
+            return "\n".join(p.extract_text() or "" for p in pdf.pages)
+    except Exception:
+        return ""
+
+
+def _simhash(words):
+    if len(words) < SHINGLE:
+        words = words + [""] * (SHINGLE - len(words))
+    shingles = {" ".join(words[i:i + SHINGLE]) for i in range(len(words) - SHINGLE + 1)}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                       for s in shingles], dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    return sum(1 << int(i) for i in np.flatnonzero(votes))
+
+
+def _signed(h):
+    # SQLite integers are signed 64-bit
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def _bands(h):
+    mask = (1 << BAND_BITS) - 1
+    return [(h >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+def fingerprint(text, total=0.0, raw=b""):
+    """
+    {'content_hash', 'simhash', 'total'} for a document.
+    Text-less PDFs (scans) fall back to a hash of the file bytes and get no simhash.
+    """
+    words = re.findall(r"\w+", (text or "").lower())
+    total = round(float(total or 0.0), 2)
+    if not words:
+        return {'content_hash': hashlib.sha256(raw).hexdigest(), 'simhash': None, 'total': total}
+    norm = " ".join(words)
+    return {
+        'content_hash': hashlib.sha256(f"{norm}|{total:.2f}".encode('utf-8')).hexdigest(),
+        'simhash': _simhash(words),
+        'total': total,
+    }
+
+
+def _raw(file_obj_or_path):
+    if hasattr(file_obj_or_path, 'getvalue'):
+        return file_obj_or_path.getvalue()
+    if isinstance(file_obj_or_path, bytes):
+        return file_obj_or_path
+    with open(file_obj_or_path, 'rb') as f:
+        return f.read()
+
+
+def fingerprint_document(file_obj_or_path, total=0.0):
+    raw = _raw(file_obj_or_path)
+    return fingerprint(document_text(raw), total, raw)
+
+
+def parse_and_fingerprint(file_obj_or_path, parser='parse_invoice_v2', progress=None):
+    """
+    (parsed invoice, fingerprint, text) in one pass over the same bytes — one parser_pool job per upload.
+    `parser` is an ingest function: parse_invoice_v2 (dict) or parse_invoice (tuple, app.py).
+    `text` is the document text the fingerprint was taken from; the vault index takes it as is.
+    """
+    raw = _raw(file_obj_or_path)
+    parsed = getattr(ingest, parser)(io.BytesIO(raw), progress=progress)
+    total = parsed['total'] if isinstance(parsed, dict) else parsed[2]
+    text = document_text(raw)
+    return parsed, fingerprint(text, total, raw), text
+
+
+def parse_with_text(file_obj_or_path, parser=None, progress=None):
+    """
+    (parsed, document text) of one file: any ingest parser plus the text for the vault index, one job.
+    parser=None: (None, text), for text that is only routed or indexed.
+    """
+    raw = _raw(file_obj_or_path)
+    if parser is None:
+        return None, document_text(raw)
+    fn = getattr(ingest, parser)
+    parsed = fn(io.BytesIO(raw), progress=progress) if 'progress' in inspect.signature(fn).parameters \
+        else fn(io.BytesIO(raw))
+    return parsed, document_text(raw)
+
+
+# --- LOOKUPS ---
+def find_invoice_no(no, path=INDEX_FILE):
+    """Every place a (normalized) invoice number is already booked, across apps and businesses."""
+    key = normalize_invoice_no(no)
+    if not key:
+        return []
+    with open_index(path) as conn:
+        rows = conn.execute("SELECT app, invoice_no, business FROM invoice_numbers WHERE norm_no = ?", (key,)).fetchall()
+    return [{'app': a, 'invoice_no': i, 'business': b} for a, i, b in rows]
+
+
+def find_invoice_nos(nos, path=INDEX_FILE):
+    """find_invoice_no for many numbers in one query: {normalized no: [matches]} (numbers with hits only)."""
+    keys = sorted({normalize_invoice_no(n) for n in nos} - {""})
+    out = {}
+    with open_index(path) as conn:
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            for k, a, n, b in conn.execute(
+                    f"SELECT norm_no, app, invoice_no, business FROM invoice_numbers WHERE norm_no IN "
+                    f"({','.join('?' * len(chunk))})", chunk):
+                out.setdefault(k, []).append({'app': a, 'invoice_no': n, 'business': b})
+    return out
+
+
+def find_document(fp, path=INDEX_FILE):
+    """{'exact': [...], 'near': [...]} earlier uploads matching a fingerprint."""
+    cols = "content_hash, simhash, app, business, invoice_no, file, total"
+    with open_index(path) as conn:
+        exact = conn.execute(f"SELECT {cols} FROM documents WHERE content_hash = ?", (fp['content_hash'],)).fetchall()
+        near = []
+        if fp.get('simhash') is not None:
+            b = _bands(fp['simhash'])
+            cands = conn.execute(
+                f"SELECT {cols} FROM documents WHERE ({' OR '.join(f'{c} = ?' for c in _BAND_COLS)}) AND content_hash != ?",
+                (*b, fp['content_hash'])).fetchall()
+            for row in cands:
+                dist = bin((row[1] % (1 << 64)) ^ fp['simhash']).count("1")
+                if dist <= NEAR_DISTANCE:
+                    near.append(row + (dist,))
+
+    def as_dict(row):
+        d = dict(zip(['content_hash', 'simhash', 'app', 'business', 'invoice_no', 'file', 'total'], row))
+        if len(row) > 7:
+            d['distance'] = row[7]
+        return d
+    return {'exact': [as_dict(r) for r in exact], 'near': [as_dict(r) for r in near]}
+
+
+def describe_matches(no, fp, path=INDEX_FILE):
+    """Human-readable duplicate warnings for one upload: (blocking, warnings)."""
+    blocking, warnings = [], []
+    for m in find_invoice_no(no, path):
+        blocking.append(f"Invoice No '{no}' already booked as '{m['invoice_no']}' ({m['business']}, {m['app']})")
+    if fp is not None:
+        hits = find_document(fp, path)
+        for m in hits['exact']:
+            blocking.append(f"Same document already uploaded as '{m['invoice_no']}' ({m['business']}, file {m['file']})")
+        for m in hits['near']:
+            same_total = abs((m['total'] or 0.0) - fp['total']) < 0.01
+            warnings.append(f"Looks like '{m['invoice_no']}' ({m['business']}, file {m['file']}"
+                            f"{', same total' if same_total else ''})")
+    return blocking, warnings
+
+
+# --- UPDATES ---
+def register_invoices(app, rows, data_version=None, path=INDEX_FILE):
+    """
+    Record booked invoices. `rows`: dicts with invoice_no, business and optionally
+    file + fingerprint (from fingerprint_document). `data_version` = workbook fingerprint after the write.
+    """
+    with open_index(path) as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO invoice_numbers VALUES (?, ?, ?, ?)",
+            [(app, normalize_invoice_no(r['invoice_no']), str(r['invoice_no']), str(r['business'])) for r in rows])
+        docs = []
+        for r in rows:
+            fp = r.get('fingerprint')
+            if not fp:
+                continue
+            sh = fp['simhash']
+            bands = _bands(sh) if sh is not None else [None] * BANDS
+            docs.append((fp['content_hash'], _signed(sh) if sh is not None else None, *bands,
+                         app, str(r['business']), str(r['invoice_no']), str(r.get('file', "")), fp['total']))
+        conn.executemany(f"INSERT OR REPLACE INTO documents VALUES ({', '.join(['?'] * (BANDS + 7))})", docs)
+        if data_version is not None:
+            conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (app, data_version))
+
+
+def sync_invoice_numbers(app, data_version, invoice_nos, businesses, path=INDEX_FILE):
+    """
+    Bring one app's invoice-number table in line with the workbook. A single lookup while the workbook
+    fingerprint is unchanged; after a write, a hash of the numbers tells payment-only writes apart,
+    and a real change (edited in Excel, restored from backup) only applies the difference.
+    """
+    with open_index(path) as conn:
+        row = conn.execute("SELECT data_version FROM sync_state WHERE app = ?", (app,)).fetchone()
+        if row and row[0] == data_version:
+            return False
+        nos = [str(n) for n in invoice_nos]
+        biz = [str(b) for b in businesses]
+        numbers = hashlib.sha1("\n".join(f"{n}\x1f{b}" for n, b in zip(nos, biz)).encode('utf-8')).hexdigest()
+        row = conn.execute("SELECT numbers_hash FROM number_state WHERE app = ?", (app,)).fetchone()
+        changed = not (row and row[0] == numbers)
+        if changed:
+            want = {(n, b) for n, b in zip(nos, biz) if n.strip()}
+            have = set(conn.execute("SELECT invoice_no, business FROM invoice_numbers WHERE app = ?", (app,)))
+            conn.executemany("DELETE FROM invoice_numbers WHERE app = ? AND norm_no = ? AND business = ? AND invoice_no = ?",
+                             [(app, normalize_invoice_no(n), b, n) for n, b in have - want])
+            conn.executemany("INSERT OR REPLACE INTO invoice_numbers VALUES (?, ?, ?, ?)",
+                             [(app, normalize_invoice_no(n), n, b) for n, b in want - have])
+            conn.execute("INSERT OR REPLACE INTO number_state VALUES (?, ?)", (app, numbers))
+        conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (app, data_version))
+    return changed
@@ -0,0 +1,93 @@
+import os
+from itertools import islice
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - CSV / JSONL still work without pyarrow
+    pa = None
+    pq = None
+
+# --- STREAMING LEDGER EXPORT ---
+# Writes ledger rows from a generator (ledger.iter_ledger_rows / iter_all_ledgers) in fixed-size
+# chunks, so memory is bounded by CHUNK_ROWS whatever the ledger size and there is no Excel row cap.
+#   csv     : header once, then appended chunks
+#   parquet : one row group per chunk, fixed schema (BI tools read it lazily)
+#   jsonl   : one JSON object per line
+# Output goes to "<path>.tmp" first and is renamed at the end: a failed export never leaves a half file.
+
+CHUNK_ROWS = 50_000
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'jsonl': '.jsonl'}
+LEDGER_COLS = ['Business', 'Type', 'Ref', 'Date', 'Description', 'Debit', 'Credit', 'Balance', 'Status']
+_TEXT_COLS = ['Business', 'Type', 'Ref', 'Description', 'Status']
+_AMOUNT_COLS = ['Debit', 'Credit', 'Balance']
+
+
+def _schema():
+    return pa.schema([(c, pa.timestamp('us') if c == 'Date' else pa.float64() if c in _AMOUNT_COLS else pa.string())
+                      for c in LEDGER_COLS])
+
+
+def chunks(rows, chunk_rows=CHUNK_ROWS, skip_types=('SPACE',)):
+    """Ledger rows -> DataFrames of at most `chunk_rows` with LEDGER_COLS and stable dtypes."""
+    rows = (r for r in rows if r.get('Type') not in skip_types)
+    while True:
+        batch = list(islice(rows, chunk_rows))
+        if not batch:
+            return
+        df = pd.DataFrame(batch).reindex(columns=LEDGER_COLS)
+        for c in _TEXT_COLS:
+            df[c] = df[c].fillna("").astype(str)
+        for c in _AMOUNT_COLS:
+            df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0).astype(float)
+        # header / total rows carry '' as date -> null
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce').astype('datetime64[us]')
+        yield df
+
+
+def export_format(path):
+    for fmt, ext in FORMATS.items():
+        if path.lower().endswith(ext):
+            return fmt
+    raise ValueError(f"unsupported export format: {path}")
+
+
+def export_ledger(rows, path, fmt=None, chunk_rows=CHUNK_ROWS, progress=None):
+    """
+    Stream `rows` to `path` as csv / parquet / jsonl (from the extension unless `fmt` is given).
+    progress(rows_written) is called after every chunk. Returns the number of rows written.
+    """
+    fmt = fmt or export_format(path)
+    if fmt == 'parquet' and pq is None:
+        raise RuntimeError("Parquet export needs pyarrow")
+    tmp = path + ".tmp"
+    written = 0
+    writer = None
+    try:
+        if fmt == 'parquet':
+            writer = pq.ParquetWriter(tmp, _schema(), compression='snappy')
+        else:
+            writer = open(tmp, 'w', encoding='utf-8', newline='')
+        for df in chunks(rows, chunk_rows):
+            if fmt == 'parquet':
+                writer.write_table(pa.Table.from_pandas(df, schema=_schema(), preserve_index=False))
+            elif fmt == 'csv':
+                df.to_csv(writer, header=(written == 0), index=False)
+            else:
+                text = df.to_json(orient='records', lines=True, date_format='iso', force_ascii=False)
+                writer.write(text if text.endswith("\n") else text + "\n")
+            written += len(df)
+            if progress:
+                progress(written)
+        if fmt == 'csv' and written == 0:
+            writer.write(",".join(LEDGER_COLS) + "\n")
+        writer.close()
+        writer = None
+        os.replace(tmp, path)
+        return written
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
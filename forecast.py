@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+from aging import invoice_outstanding, legacy_invoice_outstanding, _str, _num
+from rollups import quote_rollup
+
+# --- CASH-COLLECTION FORECAST (MONTE CARLO) ---
+# 1. Delay distributions per business, fitted from history (amount-weighted, empirical):
+#       collection : invoice date -> payment date
+#       billing    : quote date   -> invoice date   (for the unbilled part of each quote)
+#    Units with fewer than MIN_SAMPLES observations borrow the pooled distribution.
+# 2. Every open balance draws n_sims delays at once, conditioned on the age it already has
+#    (an invoice 50 days old can only be paid after day 50), and lands in a month bucket.
+# 3. One bincount over (scenario, month) gives the cash-in per scenario -> P10/P50/P90 per month.
+
+MIN_SAMPLES = 5
+DEFAULT_DELAY_DAYS = 45.0  # mean delay when there is no history at all (exponential)
+N_SIMS = 2000
+QUANTILES = 1024   # resolution of the inverse-CDF lookup table
+PERCENTILES = (10, 50, 90)
+POOLED = '*'
+
+
+def collection_delays(df_i, df_p):
+    """Days from invoice date to payment date per payment line (app12 model): Business, Days, Weight."""
+    inv = pd.DataFrame({'Invoice_No': _str(df_i['Invoice_No']), 'Business': df_i['Business'],
+                        'Inv_Date': pd.to_datetime(df_i['Date'], errors='coerce')})
+    inv = inv.groupby('Invoice_No').agg(Business=('Business', 'first'), Inv_Date=('Inv_Date', 'min'))
+    pays = pd.DataFrame({'Invoice_No': _str(df_p['Invoice_Ref']), 'Pay_Date': pd.to_datetime(df_p['Date'], errors='coerce'),
+                         'Weight': _num(df_p['Amount'])}).join(inv, on='Invoice_No', how='inner')
+    pays['Days'] = (pays['Pay_Date'] - pays['Inv_Date']).dt.days
+    return pays.dropna(subset=['Days'])[['Business', 'Days', 'Weight']]
+
+
+def legacy_collection_delays(df_inv, df_pay):
+    """Same for the app.py layout (Business_Unit / Payment_Date / Amount_Received)."""
+    inv = pd.DataFrame({'Invoice_No': _str(df_inv['Invoice_No']), 'Business': df_inv['Business_Unit'],
+                        'Inv_Date': pd.to_datetime(df_inv['Date'], errors='coerce')})
+    inv = inv.groupby('Invoice_No').agg(Business=('Business', 'first'), Inv_Date=('Inv_Date', 'min'))
+    pays = pd.DataFrame({'Invoice_No': _str(df_pay['Invoice_Ref']),
+                         'Pay_Date': pd.to_datetime(df_pay['Payment_Date'], errors='coerce'),
+                         'Weight': _num(df_pay['Amount_Received'])}).join(inv, on='Invoice_No', how='inner')
+    pays['Days'] = (pays['Pay_Date'] - pays['Inv_Date']).dt.days
+    return pays.dropna(subset=['Days'])[['Business', 'Days', 'Weight']]
+
+
+def billing_delays(df_q, df_i):
+    """Days from quote date to invoice date per invoice line: Business, Days, Weight."""
+    q = pd.DataFrame({'Business': df_q['Business'], 'Quote_Ref': _str(df_q['Quote_ID']),
+                      'Q_Date': pd.to_datetime(df_q['Date'], errors='coerce')}).drop_duplicates(['Business', 'Quote_Ref'])
+    lines = pd.DataFrame({'Business': df_i['Business'], 'Quote_Ref': _str(df_i['Quote_Ref']),
+                          'Inv_Date': pd.to_datetime(df_i['Date'], errors='coerce'),
+                          'Weight': _num(df_i['Split_Amount'])}).merge(q, on=['Business', 'Quote_Ref'])
+    lines['Days'] = (lines['Inv_Date'] - lines['Q_Date']).dt.days
+    return lines.dropna(subset=['Days'])[['Business', 'Days', 'Weight']]
+
+
+def fit_delays(samples):
+    """
+    {business: (days, cdf, quantile table)} plus POOLED for every unit together.
+    days/cdf: the empirical amount-weighted distribution; the table holds QUANTILES evenly spaced
+    inverse-CDF points so a draw is one array lookup instead of a search.
+    Negative gaps (backdated entries) count as same-day; zero-weight lines are dropped.
+    """
+    s = samples[samples['Weight'] > 0].assign(Days=lambda d: d['Days'].clip(lower=0).astype(int))
+
+    def dist(part):
+        w = part.groupby('Days')['Weight'].sum()
+        days, cdf = w.index.to_numpy(), (w.cumsum() / w.sum()).to_numpy()
+        levels = (np.arange(QUANTILES) + 0.5) / QUANTILES
+        table = days[np.minimum(np.searchsorted(cdf, levels), len(days) - 1)].astype(np.int32)
+        return days, cdf, table
+
+    model = {POOLED: dist(s)} if len(s) else {}
+    for biz, part in s.groupby('Business'):
+        if len(part) >= MIN_SAMPLES:
+            model[biz] = dist(part)
+    return model
+
+
+def sample_delays(model, business, age, rng, n_sims):
+    """
+    (n_sims, len(age)) remaining days until the event, for items that are already `age` days old.
+    Inverse-CDF draw restricted to the part of the distribution beyond `age`;
+    items older than anything observed wait an exponential tail.
+    """
+    age = np.asarray(age, dtype=np.int32)
+    fitted = model.get(business, model.get(POOLED))
+    if fitted is None:
+        return rng.exponential(DEFAULT_DELAY_DAYS, size=(n_sims, len(age))).astype(np.int32)
+
+    days, cdf, table = fitted
+    pos = np.searchsorted(days, age, side='right')         # observed delays <= age
+    below = np.where(pos > 0, cdf[np.maximum(pos - 1, 0)], 0.0).astype(np.float32)
+    # float32 / int32 all the way: these arrays are n_sims x items
+    level = rng.random((n_sims, len(age)), dtype=np.float32) * (np.float32(1.0) - below) + below
+    idx = np.minimum((level * np.float32(QUANTILES)).astype(np.int32), QUANTILES - 1)
+    remaining = np.maximum(table[idx] - age, 0)
+
+    beyond = pos >= len(days)
+    if beyond.any():
+        tail = max(float(days.mean()), 1.0)
+        remaining[:, beyond] = rng.exponential(tail, size=(n_sims, int(beyond.sum())))
+    return remaining
+
+
+def simulate(items, collect_model, bill_model=None, as_of=None, months=12, n_sims=N_SIMS, seed=0):
+    """
+    items: Business, Amount, Age_Days, Stage ('billed' = waiting for payment, 'unbilled' = not invoiced yet).
+    Unbilled items draw a billing delay first, then a fresh collection delay.
+    Returns one row per month: Month, Expected, P10/P50/P90 and the cumulative Cum_P10/P50/P90.
+    """
+    as_of = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).normalize()
+    rng = np.random.default_rng(seed)
+    month_starts = pd.date_range(as_of.to_period('M').to_timestamp(), periods=months + 1, freq='MS')
+    # day offsets (from as_of) where each month ends; month 0 is the rest of the current month.
+    # day -> month lookup; the last slot (== months) collects everything beyond the horizon
+    edges = (month_starts[1:] - as_of).days.to_numpy()
+    month_of_day = np.searchsorted(edges, np.arange(edges[-1] + 1), side='right').astype(np.int32)
+    slots = months + 1
+
+    cash = np.zeros(n_sims * slots)
+    sim_offset = (np.arange(n_sims, dtype=np.int32) * slots)[:, None]
+    items = items[items['Amount'] > 0]
+    for (biz, stage), part in items.groupby(['Business', 'Stage']):
+        age = part['Age_Days'].clip(lower=0).to_numpy()
+        amount = part['Amount'].to_numpy(dtype=float)
+        remaining = sample_delays(collect_model if stage == 'billed' else bill_model or {}, biz, age, rng, n_sims)
+        if stage == 'unbilled':
+            remaining += sample_delays(collect_model, biz, np.zeros(len(age)), rng, n_sims)
+
+        month = month_of_day[np.minimum(remaining, edges[-1])]
+        cash += np.bincount((month + sim_offset).ravel(), weights=np.broadcast_to(amount, month.shape).ravel(),
+                            minlength=n_sims * slots)
+
+    cash = cash.reshape(n_sims, slots)[:, :months]
+    out = pd.DataFrame({'Month': month_starts[:-1].strftime('%Y-%m'), 'Expected': cash.mean(axis=0)})
+    cum = cash.cumsum(axis=1)
+    for p, monthly, total in zip(PERCENTILES, np.percentile(cash, PERCENTILES, axis=0),
+                                 np.percentile(cum, PERCENTILES, axis=0)):
+        out[f'P{p}'] = monthly
+        out[f'Cum_P{p}'] = total
+    return out
+
+
+def _age(as_of, dates):
+    # undated balances count as new
+    return (as_of - pd.to_datetime(dates, errors='coerce')).dt.days.fillna(0)
+
+
+def open_items(df_q, df_i, df_p, as_of=None, include_unbilled=True):
+    """Forecast inputs for app12: open invoice balances + unbilled quote scope, with their ages."""
+    as_of = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).normalize()
+    inv = invoice_outstanding(df_i, df_p)
+    parts = [pd.DataFrame({'Business': inv['Business'], 'Amount': inv['Outstanding'],
+                           'Age_Days': _age(as_of, inv['Date']), 'Stage': 'billed'})]
+    if include_unbilled and not df_q.empty:
+        q = quote_rollup(df_q, df_i, df_p)
+        parts.append(pd.DataFrame({'Business': q['Business'], 'Amount': q['Unbilled'],
+                                   'Age_Days': _age(as_of, q['Date']),
+                                   'Stage': 'unbilled'}))
+    return pd.concat(parts, ignore_index=True)
+
+
+def forecast_cash_in(df_q, df_i, df_p, business=None, as_of=None, months=12, n_sims=N_SIMS,
+                     include_unbilled=True, seed=0):
+    """Monthly P10/P50/P90 cash-in for one unit (or the whole portfolio when business is None)."""
+    items = open_items(df_q, df_i, df_p, as_of, include_unbilled)
+    if business is not None:
+        items = items[items['Business'] == business]
+    return simulate(items, fit_delays(collection_delays(df_i, df_p)), fit_delays(billing_delays(df_q, df_i)),
+                    as_of, months, n_sims, seed)
+
+
+def legacy_forecast_cash_in(df_inv, df_pay, business=None, as_of=None, months=12, n_sims=N_SIMS, seed=0):
+    """Same for app.py: open invoices only (that layout has no quotes)."""
+    as_of = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).normalize()
+    inv = legacy_invoice_outstanding(df_inv, df_pay)
+    items = pd.DataFrame({'Business': inv['Business'], 'Amount': inv['Outstanding'],
+                          'Age_Days': _age(as_of, inv['Date']), 'Stage': 'billed'})
+    if business is not None:
+        items = items[items['Business'] == business]
+    model = fit_delays(legacy_collection_delays(df_inv, df_pay)) if not df_pay.empty else {}
+    return simulate(items, model, None, as_of, months, n_sims, seed)
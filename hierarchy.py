@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+# --- LEDGER HIERARCHY ---
+# Business -> Quote -> Invoice line -> Payment line as parallel NumPy arrays in depth-first order:
+#   level / parent / end : node i's subtree is the slice [i, end[i])
+#   row                  : position of the node's source row in df_q / df_i / df_p (-1 for businesses
+#                          and the per-business bucket of invoices whose quote does not exist)
+#   value, billed, collected : the node's own amount (quote value, invoice line, payment line)
+#   cum_*                : prefix sums over those columns, so a subtree total is cum[end] - cum[i]
+#   sub_*                : the subtree totals themselves, O(1) to read
+# The tree is immutable and built once per published ledger version (LedgerView.derived); a write
+# rebuilds it rather than patching it, so every session reading a version sees a consistent tree.
+# Payments hang under the invoice line with the rule of the Master Ledger: if any payment of the
+# invoice carries a Quote_Ref only those allocated to the quote count, otherwise all of them.
+# They are attached once per (quote, invoice) to its first line (pay_line maps every line to it).
+
+BUSINESS, QUOTE, INVOICE, PAYMENT = 0, 1, 2, 3
+COLS = ('value', 'billed', 'collected')
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+class Hierarchy:
+    def __init__(self, level, parent, row, ref, amounts, businesses, orphans):
+        n = len(level)
+        self.level = level
+        self.parent = parent
+        self.row = row
+        self.ref = ref
+        self.own = amounts
+        self.end = self._ends(level)
+        self.cum = {c: np.concatenate(([0.0], np.cumsum(amounts[c]))) for c in COLS}
+        self.sub = {c: self.cum[c][self.end] - self.cum[c][:n] for c in COLS}
+        self.business_node = businesses   # business -> node
+        self.orphan_node = orphans        # business -> bucket node (only if it has such invoices)
+        self.holder = np.arange(n, dtype=np.int64)  # quote row -> quote node holding its invoices
+        self.pay_line = np.arange(n, dtype=np.int64)  # invoice line -> line holding its payments
+
+    @staticmethod
+    def _ends(level):
+        # end[i] = first later node at the same or a higher level (stack-free: per level, next start)
+        n = len(level)
+        end = np.full(n, n, dtype=np.int64)
+        for lv in range(int(level.max()) + 1 if n else 0):
+            starts = np.flatnonzero(level <= lv)
+            at = np.flatnonzero(level == lv)
+            nxt = np.searchsorted(starts, at, side='right')
+            end[at] = np.where(nxt < len(starts), starts[np.minimum(nxt, len(starts) - 1)], n)
+        return end
+
+    # --- reads ---
+    def total(self, node, col):
+        """Subtree total of `col` under `node`, O(1)."""
+        return float(self.sub[col][node])
+
+    def totals(self, node):
+        return {c: float(self.sub[c][node]) for c in COLS}
+
+    def children(self, node):
+        c = node + 1
+        while c < self.end[node]:
+            yield int(c)
+            c = self.end[c]
+
+    def quotes(self, business):
+        """Quote nodes of a business in Quotations order (without the orphan bucket)."""
+        node = self.business_node.get(business)
+        if node is None:
+            return []
+        orphan = self.orphan_node.get(business)
+        return [q for q in self.children(node) if q != orphan]
+
+    def business_totals(self, business, include_orphans=True):
+        node = self.business_node.get(business)
+        if node is None:
+            return {c: 0.0 for c in COLS}
+        out = self.totals(node)
+        orphan = self.orphan_node.get(business)
+        if orphan is not None and not include_orphans:
+            out = {c: out[c] - float(self.sub[c][orphan]) for c in COLS}
+        return out
+
+
+def build_hierarchy(df_q, df_i, df_p):
+    """Hierarchy of the three ledger sheets in one vectorized pass."""
+    # businesses: Quotations order, then units that only have invoices
+    biz = pd.unique(pd.concat([df_q['Business'], df_i['Business']]).dropna())
+    biz_no = {b: k for k, b in enumerate(biz)}
+
+    q = pd.DataFrame({'b': df_q['Business'].map(biz_no), 'qid': _str(df_q['Quote_ID']),
+                      'value': pd.to_numeric(df_q['Total_Value'], errors='coerce').fillna(0.0).to_numpy(),
+                      'row': np.arange(len(df_q))}).dropna(subset=['b'])
+    q['b'] = q['b'].astype(np.int64)
+    q['qo'] = q.groupby('b').cumcount()
+    first = q.drop_duplicates(['b', 'qid'])
+    # duplicate Quote_IDs: invoices go to the first row, the others read its totals
+    q = q.merge(first[['b', 'qid', 'qo']].rename(columns={'qo': 'hold_qo'}), on=['b', 'qid'])
+
+    i = pd.DataFrame({'b': df_i['Business'].map(biz_no), 'qid': _str(df_i['Quote_Ref']),
+                      'inv': _str(df_i['Invoice_No']),
+                      'billed': pd.to_numeric(df_i['Split_Amount'], errors='coerce').fillna(0.0).to_numpy(),
+                      'row': np.arange(len(df_i))}).dropna(subset=['b'])
+    i['b'] = i['b'].astype(np.int64)
+    i = i.merge(first[['b', 'qid', 'qo']], on=['b', 'qid'], how='left')
+    orphan = i['qo'].isna()
+    i['qo'] = i['qo'].fillna(np.iinfo(np.int32).max).astype(np.int64)  # bucket sorts after the quotes
+    i['lo'] = i.sort_values('row').groupby(['b', 'qo']).cumcount()
+    i['pay_lo'] = i.groupby(['b', 'qo', 'inv'])['lo'].transform('min')
+
+    p = pd.DataFrame({'inv': _str(df_p['Invoice_Ref']),
+                      'pq': _str(df_p['Quote_Ref']) if 'Quote_Ref' in df_p.columns else "",
+                      'collected': pd.to_numeric(df_p['Amount'], errors='coerce').fillna(0.0).to_numpy(),
+                      'row': np.arange(len(df_p))})
+    allocated = (p['pq'].str.len() > 0).groupby(p['inv']).any()
+    holders = i[i['lo'] == i['pay_lo']][['b', 'qo', 'qid', 'inv', 'lo']]
+    pays = holders.merge(p, on='inv')
+    alloc = pays['inv'].map(allocated).fillna(False).astype(bool)
+    pays = pays[~alloc | (pays['pq'] == pays['qid'])]
+    pays['po'] = pays['row']
+
+    # one key per node: (business, quote, line, payment), -1 = "the node itself" so parents sort first
+    n_b, n_q, n_i, n_p = len(biz), len(q), len(i), len(pays)
+    kb = np.concatenate((np.arange(n_b), q['b'], i['b'], pays['b'])).astype(np.int64)
+    kq = np.concatenate((np.full(n_b, -1), q['qo'], i['qo'], pays['qo'])).astype(np.int64)
+    kl = np.concatenate((np.full(n_b + n_q, -1), i['lo'], pays['lo'])).astype(np.int64)
+    kp = np.concatenate((np.full(n_b + n_q + n_i, -1), pays['po'])).astype(np.int64)
+
+    # orphan bucket nodes (one per business with unmatched invoices)
+    ob = np.unique(i.loc[orphan, 'b'].to_numpy())
+    kb = np.concatenate((kb, ob))
+    kq = np.concatenate((kq, np.full(len(ob), np.iinfo(np.int32).max)))
+    kl = np.concatenate((kl, np.full(len(ob), -1)))
+    kp = np.concatenate((kp, np.full(len(ob), -1)))
+
+    order = np.lexsort((kp, kl, kq, kb))
+    n = len(order)
+    level = np.concatenate((np.full(n_b, BUSINESS), np.full(n_q, QUOTE), np.full(n_i, INVOICE),
+                            np.full(n_p, PAYMENT), np.full(len(ob), QUOTE))).astype(np.int8)[order]
+    row = np.concatenate((np.full(n_b, -1), q['row'], i['row'], pays['row'], np.full(len(ob), -1)))[order]
+    ref = np.concatenate((biz.astype(object), q['qid'].to_numpy(object), i['inv'].to_numpy(object),
+                          df_p['Payment_ID'].astype(str).to_numpy(object)[pays['row'].to_numpy()]
+                          if n_p else np.array([], dtype=object),
+                          np.full(len(ob), "", dtype=object)))[order]
+    amounts = {
+        'value': np.concatenate((np.zeros(n_b), q['value'], np.zeros(n_i + n_p + len(ob))))[order],
+        'billed': np.concatenate((np.zeros(n_b + n_q), i['billed'], np.zeros(n_p + len(ob))))[order],
+        'collected': np.concatenate((np.zeros(n_b + n_q + n_i), pays['collected'], np.zeros(len(ob))))[order],
+    }
+
+    # node id of each key, then parents by looking up the key one level up
+    kb, kq, kl, kp = kb[order], kq[order], kl[order], kp[order]
+    keys = pd.MultiIndex.from_arrays([kb, kq, kl, kp])
+    lookup = pd.Series(np.arange(n), index=keys)
+    up = np.where(level == PAYMENT, 2, np.where(level == INVOICE, 1, np.where(level == QUOTE, 0, -1)))
+    pk = [kb, np.where(up >= 1, kq, -1), np.where(up >= 2, kl, -1), np.full(n, -1)]
+    parent = np.where(level == BUSINESS, -1,
+                      lookup.reindex(pd.MultiIndex.from_arrays(pk)).fillna(-1).to_numpy(np.int64))
+
+    tree = Hierarchy(level, parent.astype(np.int64), row.astype(np.int64), ref, amounts,
+                     {b: int(lookup[(k, -1, -1, -1)]) for k, b in enumerate(biz)},
+                     {biz[b]: int(lookup[(b, np.iinfo(np.int32).max, -1, -1)]) for b in ob})
+
+    # quote rows sharing a Quote_ID read the first row's subtree; lines point at their payment line
+    qn = lookup.reindex(pd.MultiIndex.from_arrays([q['b'], q['qo'], np.full(n_q, -1), np.full(n_q, -1)])).to_numpy()
+    qh = lookup.reindex(pd.MultiIndex.from_arrays([q['b'], q['hold_qo'], np.full(n_q, -1), np.full(n_q, -1)])).to_numpy()
+    tree.holder[qn] = qh
+    ln = lookup.reindex(pd.MultiIndex.from_arrays([i['b'], i['qo'], i['lo'], np.full(n_i, -1)])).to_numpy()
+    lh = lookup.reindex(pd.MultiIndex.from_arrays([i['b'], i['qo'], i['pay_lo'], np.full(n_i, -1)])).to_numpy()
+    tree.pay_line[ln] = lh
+    return tree
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# --- ID ALLOCATOR ---
+# ULID-style ids: 48-bit millisecond timestamp + 80 random bits in Crockford base32 (26 chars),
+# behind a readable prefix: "PAY-01JAB3...", "QT-01JAB3...". Plain string order = creation order.
+#   - across sessions / processes: the 80 random bits make a collision practically impossible
+#   - within a thread: an id in the same millisecond (or after the clock stepped back) increments
+#     the previous random part instead of redrawing it, so ids stay strictly increasing
+# State is thread-local and reset in forked children, so there is no lock and no shared counter.
+
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_DECODE = {c: i for i, c in enumerate(_ALPHABET)}
+_RAND_BITS = 80
+_RAND_MAX = (1 << _RAND_BITS) - 1
+_local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: _local.__dict__.clear())
+
+
+def _encode(value, length=26):
+    out = []
+    for _ in range(length):
+        out.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(out))
+
+
+def ulid(now_ms=None):
+    """26-char sortable id. `now_ms` only for tests / backfills."""
+    ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+    last_ms, last_rand = getattr(_local, 'state', (-1, 0))
+    if ms <= last_ms:
+        ms, rand = last_ms, last_rand + 1
+        if rand > _RAND_MAX:  # 2^80 ids in one millisecond: borrow the next one
+            ms, rand = ms + 1, int.from_bytes(os.urandom(10), 'big')
+    else:
+        rand = int.from_bytes(os.urandom(10), 'big')
+    _local.state = (ms, rand)
+    return _encode((ms << _RAND_BITS) | rand)
+
+
+def new_id(prefix):
+    """'PAY-01JAB3…' style id for a new record."""
+    return f"{prefix}-{ulid()}"
+
+
+def new_ids(prefix, n):
+    """n increasing ids for one batch (e.g. the quotes of one uploaded agreement)."""
+    return [new_id(prefix) for _ in range(n)]
+
+
+def id_time(record_id):
+    """Creation time encoded in an id from new_id() (line suffixes allowed), or None for legacy ids."""
+    code = next((p for p in str(record_id).upper().split('-') if len(p) == 26), "")
+    if not code or any(c not in _DECODE for c in code):
+        return None
+    ms = 0
+    for c in code[:10]:
+        ms = (ms << 5) | _DECODE[c]
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
@@ -1,6 +1,13 @@
 import pdfplumber
+import io
 import os
 import re
+import time
+import pandas as pd
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pdfminer.pdftypes import resolve1
 from datetime import datetime
 import dateparser
 
@@ -39,7 +46,12 @@ def extract_dynamic_date(text, default=None):
         except: pass
     return default or datetime.now().date()
 
-def parse_multi_sow_agreement(pdf_path):
+def _report(progress, fraction, message=""):
+    # optional progress hook: progress(fraction 0..1, message), used by parser_pool
+    if progress:
+        progress(fraction, message)
+
+def parse_multi_sow_agreement(pdf_path, progress=None):
     """
     ROBUST PARSER: Scans for multiple 'Scope of Work' sections.
     """
@@ -48,7 +60,12 @@ def parse_multi_sow_agreement(pdf_path):
     
     try:
         with pdfplumber.open(pdf_path) as pdf:
-            full_text = "\n".join([p.extract_text() for p in pdf.pages if p.extract_text()])
+            page_texts = []
+            for n, p in enumerate(pdf.pages, start=1):
+                page_text = p.extract_text()
+                if page_text: page_texts.append(page_text)
+                _report(progress, n / len(pdf.pages), f"Reading page {n}/{len(pdf.pages)}")
+            full_text = "\n".join(page_texts)
             text = clean_text(full_text)
             
             # 1. Find Global Document Date
@@ -101,7 +118,133 @@ def parse_multi_sow_agreement(pdf_path):
 
     return extracted_sows
 
-def parse_invoice_v2(pdf_path):
+# --- TABLE PAGE DETECTION ---
+# extract_tables() needs pdfplumber's full layout pass over a page, which is what makes long
+# bills slow. Pages go through two cheap checks first and only survivors are table-scanned:
+#   1. drawing operators in the raw content stream (no layout analysis at all)
+#   2. ruling lines per orientation + digit characters from the parsed page objects
+# With the default "lines" strategy a table needs at least 2 horizontal and 2 vertical rules,
+# and a line item needs a number, so neither check can drop a line item.
+MIN_RULES = 2
+PARALLEL_MIN_PAGES = 8   # below this, process start-up costs more than it saves
+TABLE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Upper bound on the edges each path operator can contribute (curves -> up to 3 segments)
+_EDGE_OPS = {b'l': 1, b'h': 1, b're': 4, b'c': 3, b'v': 3, b'y': 3}
+
+
+def stream_rule_score(page):
+    """Stage 1: possible ruling-line edges counted straight from the page content stream."""
+    try:
+        contents = resolve1(page.page_obj.attrs.get('Contents'))
+        streams = contents if isinstance(contents, list) else [contents]
+        data = b" ".join(resolve1(s).get_data() for s in streams if s is not None)
+    except Exception:
+        return None  # unreadable stream -> let the full check decide
+    if b'Do' in data.split():
+        return None  # form XObjects can hold their own ruling lines
+    counts = Counter(tok for tok in data.split() if tok in _EDGE_OPS)
+    return sum(_EDGE_OPS[op] * n for op, n in counts.items())
+
+
+def score_table_page(page):
+    """Stage 2: ruling lines per orientation + share of digit characters (parses the page)."""
+    h_rules = v_rules = 0
+    for edge in page.edges:
+        if edge['orientation'] == 'h':
+            h_rules += 1
+        else:
+            v_rules += 1
+    chars = page.chars
+    digits = sum(1 for c in chars if c['text'].isdigit())
+    return {'h_rules': h_rules, 'v_rules': v_rules, 'numeric_density': digits / len(chars) if chars else 0.0}
+
+
+def is_table_candidate(score):
+    return score['h_rules'] >= MIN_RULES and score['v_rules'] >= MIN_RULES and score['numeric_density'] > 0
+
+
+def items_from_tables(tables):
+    """Line items (desc + amount) from the rows of extracted tables."""
+    items = []
+    for table in tables:
+        for row in table:
+            cleaned_row = [clean_text(str(cell)) if cell else "" for cell in row]
+
+            # Find Description & Amount columns
+            desc_candidates = [c for c in cleaned_row if len(c) > 5 and not re.match(r'^[\d,.]+$', c)]
+            amt_candidates = [c for c in cleaned_row if re.search(r'[\d,]+\.?\d*', c)]
+
+            if desc_candidates and amt_candidates:
+                desc = desc_candidates[0].replace('\n', ' ')
+                if "Description" in desc or "Item" in desc: continue
+
+                try:
+                    amt_txt = amt_candidates[-1]
+                    amt = float(re.sub(r'[^\d.]', '', amt_txt))
+                    if amt > 0:
+                        items.append({'desc': desc, 'amount': amt})
+                except: pass
+    return items
+
+
+def _page_items_for(page):
+    if not is_table_candidate(score_table_page(page)):
+        return []
+    return items_from_tables(page.extract_tables())
+
+
+def _page_items(pdf_bytes, page_numbers):
+    # Worker side: own copy of the document
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return [_page_items_for(pdf.pages[i]) for i in page_numbers]
+
+
+def _read_bytes(pdf_path):
+    if hasattr(pdf_path, 'getvalue'):
+        return pdf_path.getvalue()
+    if hasattr(pdf_path, 'read'):
+        pos = pdf_path.tell()
+        data = pdf_path.read()
+        pdf_path.seek(pos)
+        return data
+    with open(pdf_path, 'rb') as f:
+        return f.read()
+
+
+def extract_line_items(pdf, pdf_bytes=None, progress=None):
+    """
+    Two-stage table scan over an open pdfplumber document: pages without enough drawing
+    operators are never laid out; the rest are scored and only candidates table-scanned.
+    Long bills are split across worker processes.
+    """
+    candidates = []
+    for i, page in enumerate(pdf.pages):
+        rules = stream_rule_score(page)
+        if rules is None or rules >= MIN_RULES * 2:
+            candidates.append(i)
+
+    if pdf_bytes is None or len(candidates) < PARALLEL_MIN_PAGES or TABLE_WORKERS < 2:
+        items = []
+        for n, i in enumerate(candidates, start=1):
+            items += _page_items_for(pdf.pages[i])
+            _report(progress, 0.1 + 0.9 * n / len(candidates), f"Tables on page {i + 1} ({n}/{len(candidates)})")
+        return items
+
+    chunks = [candidates[k::TABLE_WORKERS] for k in range(TABLE_WORKERS)]
+    per_page = {}
+    try:
+        # spawn: never fork a process that runs Streamlit threads
+        with ProcessPoolExecutor(max_workers=TABLE_WORKERS, mp_context=mp.get_context('spawn')) as pool:
+            for chunk, results in zip(chunks, pool.map(_page_items, [pdf_bytes] * len(chunks), chunks)):
+                per_page.update(zip(chunk, results))
+    except Exception:
+        # e.g. daemonic parent (no child processes allowed) -> same work in-process
+        per_page = {i: _page_items_for(pdf.pages[i]) for i in candidates}
+    return [item for i in candidates for item in per_page[i]]
+
+
+def parse_invoice_v2(pdf_path, progress=None):
     """Advanced Invoice Parser with Table Support"""
     inv_data = {
         'no': "DRAFT", 
@@ -111,7 +254,8 @@ def parse_invoice_v2(pdf_path):
     }
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        pdf_bytes = _read_bytes(pdf_path)
+        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
             first_page_text = clean_text(pdf.pages[0].extract_text())
             
             # Header Info
@@ -120,28 +264,10 @@ def parse_invoice_v2(pdf_path):
             
             inv_data['date'] = extract_dynamic_date(first_page_text)
             inv_data['total'] = find_amount_in_text(first_page_text)
+            _report(progress, 0.1, "Header read")
 
-            # Table Scan
-            for page in pdf.pages:
-                tables = page.extract_tables()
-                for table in tables:
-                    for row in table:
-                        cleaned_row = [clean_text(str(cell)) if cell else "" for cell in row]
-                        
-                        # Find Description & Amount columns
-                        desc_candidates = [c for c in cleaned_row if len(c) > 5 and not re.match(r'^[\d,.]+$', c)]
-                        amt_candidates = [c for c in cleaned_row if re.search(r'[\d,]+\.?\d*', c)]
-                        
-                        if desc_candidates and amt_candidates:
-                            desc = desc_candidates[0].replace('\n', ' ')
-                            if "Description" in desc or "Item" in desc: continue
-                            
-                            try:
-                                amt_txt = amt_candidates[-1]
-                                amt = float(re.sub(r'[^\d.]', '', amt_txt))
-                                if amt > 0:
-                                    inv_data['items'].append({'desc': desc, 'amount': amt})
-                            except: pass
+            # Table Scan (candidate pages only)
+            inv_data['items'] = extract_line_items(pdf, pdf_bytes, progress)
 
     except Exception as e:
         print(f"Error parsing PDF: {e}")
@@ -151,6 +277,48 @@ def parse_invoice_v2(pdf_path):
         
     return inv_data
 
+def parse_invoice(file_path, progress=None):
+    """
+    Reads a PDF and extracts Invoice No, Date, Amount, and Project (app.py layout).
+    """
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            text = ""
+            for n, page in enumerate(pdf.pages, start=1):
+                text += page.extract_text() or ""
+                _report(progress, n / len(pdf.pages), f"Reading page {n}/{len(pdf.pages)}")
+        
+        # Simple Regex Logic (Adjust as needed)
+        # 1. Invoice Number (Looks for INV-...)
+        inv_match = re.search(r'(INV-\d{4}-\d{3}|INV-\w+-\d+)', text)
+        invoice_no = inv_match.group(0) if inv_match else f"INV-{int(time.time())}"
+        
+        # 2. Amount (Looks for $ or numbers with decimals)
+        amt_match = re.search(r'\$\s?([\d,]+\.\d{2})', text)
+        if amt_match:
+            amount = float(amt_match.group(1).replace(',', ''))
+        else:
+            # Fallback: look for largest number
+            nums = re.findall(r'([\d,]+\.\d{2})', text)
+            amount = float(max(nums).replace(',', '')) if nums else 0.0
+            
+        # 3. Date
+        date_match = re.search(r'(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})', text)
+        inv_date = pd.to_datetime(date_match.group(0)) if date_match else datetime.today()
+
+        # 4. Project Name (Heuristic)
+        project = "General Project"
+        lines = text.split('\n')
+        for line in lines[:10]: # Check first 10 lines
+            if "Project:" in line:
+                project = line.replace("Project:", "").strip()
+                break
+                
+        return invoice_no, inv_date, amount, project
+
+    except Exception as e:
+        return "MANUAL_CHECK", datetime.today(), 0.0, "Manual Entry"
+
 def parse_payment(pdf_path):
     """Simple Payment Parser"""
     inv_ref = None
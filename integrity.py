@@ -0,0 +1,251 @@
+import threading
+import pandas as pd
+
+# --- LEDGER INTEGRITY CHECKS ---
+# Every check is a set / grouped operation over the Quotations, Invoices and Payments frames.
+# Each issue carries the keys it depends on (Business + Quote_ID, Invoice_No, Payment_ID), so
+# after a write only the touched keys are re-checked:
+#   1. touched_keys(): rows whose content hash changed since the last snapshot -> affected keys
+#   2. check_ledger(..., keys): the same checks over only the rows those keys need
+#   3. revalidate(): old issues on touched keys are replaced by the fresh ones
+
+TOL = 0.01
+
+ORPHAN_QUOTE_REF = 'Invoice line -> unknown quote'
+ORPHAN_PAYMENT = 'Payment -> unknown invoice'
+PAYMENT_QUOTE_MISMATCH = 'Payment allocated to a quote not on the invoice'
+OVER_BILLED = 'Quote over-billed'
+OVER_COLLECTED = 'Invoice over-collected'
+DUPLICATE_QUOTE = 'Duplicate Quote_ID'
+DUPLICATE_PAYMENT = 'Duplicate Payment_ID'
+
+CHECKS = [ORPHAN_QUOTE_REF, ORPHAN_PAYMENT, PAYMENT_QUOTE_MISMATCH, OVER_BILLED, OVER_COLLECTED,
+          DUPLICATE_QUOTE, DUPLICATE_PAYMENT]
+SEVERITY = {ORPHAN_QUOTE_REF: 'error', ORPHAN_PAYMENT: 'error', PAYMENT_QUOTE_MISMATCH: 'warning',
+            OVER_BILLED: 'warning', OVER_COLLECTED: 'error', DUPLICATE_QUOTE: 'error', DUPLICATE_PAYMENT: 'error'}
+ISSUE_COLS = ['Check', 'Severity', 'Business', 'Quote_ID', 'Invoice_No', 'Payment_ID', 'Amount', 'Detail']
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def _num(s):
+    return pd.to_numeric(s, errors='coerce').fillna(0.0)
+
+
+def _qkey(biz, qid):
+    return _str(biz) + "\x1f" + _str(qid)
+
+
+def _frames(df_q, df_i, df_p):
+    q = pd.DataFrame({'Business': _str(df_q['Business']), 'Quote_ID': _str(df_q['Quote_ID']),
+                      'Value': _num(df_q['Total_Value'])})
+    i = pd.DataFrame({'Business': _str(df_i['Business']), 'Invoice_No': _str(df_i['Invoice_No']),
+                      'Quote_Ref': _str(df_i['Quote_Ref']), 'Amount': _num(df_i['Split_Amount'])})
+    p = pd.DataFrame({'Payment_ID': _str(df_p['Payment_ID']), 'Invoice_Ref': _str(df_p['Invoice_Ref']),
+                      'Quote_Ref': _str(df_p['Quote_Ref']) if 'Quote_Ref' in df_p.columns else "",
+                      'Amount': _num(df_p['Amount'])})
+    return q, i, p
+
+
+def _isin(s, values):
+    # hash lookup through an Index; Series.isin walks large Arrow-string value lists in Python
+    return pd.Series(pd.Index(values).unique().get_indexer(s) >= 0, index=s.index)
+
+
+def _money(s):
+    return s.map('{:,.2f}'.format).astype(str)
+
+
+def _issues(check, frame, detail, **cols):
+    out = pd.DataFrame({c: "" for c in ISSUE_COLS if c not in ('Amount',)}, index=frame.index)
+    out['Amount'] = 0.0
+    for col, values in cols.items():
+        out[col] = values
+    out['Check'] = check
+    out['Severity'] = SEVERITY[check]
+    out['Detail'] = detail
+    return out[ISSUE_COLS]
+
+
+# which touched keys an issue depends on (its other key columns are only labels, or blank)
+DEPENDS = {ORPHAN_QUOTE_REF: ('quotes', 'invoices'), ORPHAN_PAYMENT: ('invoices', 'payments'),
+           PAYMENT_QUOTE_MISMATCH: ('quotes', 'invoices', 'payments'), OVER_BILLED: ('quotes',),
+           OVER_COLLECTED: ('invoices',), DUPLICATE_QUOTE: ('quotes',), DUPLICATE_PAYMENT: ('invoices', 'payments')}
+
+
+def _touches(issues, keys):
+    """Rows of `issues` that depend on any of the touched keys."""
+    if keys is None:
+        return pd.Series(True, index=issues.index)
+    hit = {'quotes': _isin(_qkey(issues['Business'], issues['Quote_ID']), keys['quotes']),
+           'invoices': _isin(issues['Invoice_No'], keys['invoices']),
+           'payments': _isin(issues['Payment_ID'], keys['payments'])}
+    out = pd.Series(False, index=issues.index)
+    for check, kinds in DEPENDS.items():
+        out |= (issues['Check'] == check) & pd.concat([hit[k] for k in kinds], axis=1).any(axis=1)
+    return out
+
+
+def _context(df_q, df_i, df_p, keys):
+    """
+    The slice of the ledger a restricted check needs: every row of the touched quotes,
+    invoices and payments, plus the rows they point at (existence / pairing lookups).
+    Filters run on the raw ID columns, so nothing is built for the untouched rows.
+    """
+    quote_ids = pd.Index(keys['quotes']).str.split("\x1f").str[-1]
+    p_ids = _str(df_p['Payment_ID'])
+    p_sel = _isin(_str(df_p['Invoice_Ref']), keys['invoices']) | _isin(p_ids, keys['payments'])
+    if 'Quote_Ref' in df_p.columns:
+        p_sel |= _isin(_str(df_p['Quote_Ref']), quote_ids)  # allocations to a touched quote
+    p_sel |= _isin(p_ids, p_ids[p_sel])  # the twins of a selected Payment_ID, wherever they are booked
+    ctx_p = df_p[p_sel]
+    i_nos = _str(df_i['Invoice_No'])
+    i_sel = (_isin(i_nos, keys['invoices']) | _isin(_str(df_i['Quote_Ref']), quote_ids)
+             | _isin(i_nos, _str(ctx_p['Invoice_Ref'])))
+    ctx_i = df_i[i_sel]
+    ctx_q = df_q[_isin(_str(df_q['Quote_ID']), quote_ids.append(pd.Index(_str(ctx_i['Quote_Ref']))))]
+    return ctx_q, ctx_i, ctx_p
+
+
+def check_ledger(df_q, df_i, df_p, keys=None):
+    """
+    All integrity issues, or (with `keys` from touched_keys) only those on the touched keys.
+    Returns a DataFrame with ISSUE_COLS, one row per problem.
+    """
+    if keys is not None:
+        df_q, df_i, df_p = _context(df_q, df_i, df_p, keys)
+    q, i, p = _frames(df_q, df_i, df_p)
+    i_qkey = _qkey(i['Business'], i['Quote_Ref'])
+    out = []
+
+    # 1. invoice lines pointing at a quote that does not exist in the same business
+    orphan = i[~_isin(i_qkey, _qkey(q['Business'], q['Quote_ID']))]
+    out.append(_issues(ORPHAN_QUOTE_REF, orphan, "Quote_Ref " + orphan['Quote_Ref'] + " not found in " + orphan['Business'],
+                       Business=orphan['Business'], Quote_ID=orphan['Quote_Ref'], Invoice_No=orphan['Invoice_No'],
+                       Amount=orphan['Amount']))
+
+    # 2. payments whose Invoice_Ref matches no invoice
+    inv_biz = i.drop_duplicates('Invoice_No').set_index('Invoice_No')['Business']
+    known = _isin(p['Invoice_Ref'], inv_biz.index)
+    lost = p[~known]
+    out.append(_issues(ORPHAN_PAYMENT, lost, "Invoice_Ref " + lost['Invoice_Ref'] + " not found",
+                       Invoice_No=lost['Invoice_Ref'], Payment_ID=lost['Payment_ID'], Amount=lost['Amount']))
+
+    # 3. payment lines allocated to a quote that is not on their invoice
+    alloc = p[known & (p['Quote_Ref'] != "")]
+    bad = alloc[~_isin(alloc['Invoice_Ref'] + "\x1f" + alloc['Quote_Ref'], i['Invoice_No'] + "\x1f" + i['Quote_Ref'])]
+    out.append(_issues(PAYMENT_QUOTE_MISMATCH, bad,
+                       "Quote_Ref " + bad['Quote_Ref'] + " is not billed on " + bad['Invoice_Ref'],
+                       Business=bad['Invoice_Ref'].map(inv_biz), Quote_ID=bad['Quote_Ref'],
+                       Invoice_No=bad['Invoice_Ref'], Payment_ID=bad['Payment_ID'], Amount=bad['Amount']))
+
+    # 4. quotes billed above their value
+    billed = i.groupby(['Business', 'Quote_Ref'])['Amount'].sum().rename_axis(['Business', 'Quote_ID'])
+    qv = q.groupby(['Business', 'Quote_ID'])['Value'].sum()
+    over = pd.concat([qv.rename('Value'), billed.rename('Billed')], axis=1, join='inner')
+    over = over[over['Billed'] > over['Value'] + TOL].reset_index()
+    out.append(_issues(OVER_BILLED, over,
+                       "billed " + _money(over['Billed']) + " of " + _money(over['Value']),
+                       Business=over['Business'], Quote_ID=over['Quote_ID'], Amount=over['Billed'] - over['Value']))
+
+    # 5. invoices collected above their billed total
+    inv_total = i.groupby('Invoice_No').agg(Business=('Business', 'first'), Billed=('Amount', 'sum'))
+    inv_total['Paid'] = p.groupby('Invoice_Ref')['Amount'].sum().reindex(inv_total.index).fillna(0.0)
+    oc = inv_total[inv_total['Paid'] > inv_total['Billed'] + TOL].reset_index()
+    out.append(_issues(OVER_COLLECTED, oc,
+                       "collected " + _money(oc['Paid']) + " of " + _money(oc['Billed']),
+                       Business=oc['Business'], Invoice_No=oc['Invoice_No'], Amount=oc['Paid'] - oc['Billed']))
+
+    # 6. duplicate keys
+    dq = q[q.duplicated(['Business', 'Quote_ID'], keep=False)].drop_duplicates(['Business', 'Quote_ID'])
+    out.append(_issues(DUPLICATE_QUOTE, dq, "Quote_ID used more than once in " + dq['Business'],
+                       Business=dq['Business'], Quote_ID=dq['Quote_ID']))
+    dp = p[p.duplicated('Payment_ID', keep=False) & (p['Payment_ID'] != "")].drop_duplicates('Payment_ID')
+    out.append(_issues(DUPLICATE_PAYMENT, dp, "Payment_ID used more than once",
+                       Business=dp['Invoice_Ref'].map(inv_biz), Invoice_No=dp['Invoice_Ref'],
+                       Payment_ID=dp['Payment_ID']))
+
+    issues = pd.concat(out, ignore_index=True)
+    key_cols = ['Business', 'Quote_ID', 'Invoice_No', 'Payment_ID']
+    issues[key_cols] = issues[key_cols].fillna("")
+    if keys is not None:
+        # the context also holds partial groups of untouched keys: keep only the touched ones
+        issues = issues[_touches(issues, keys)]
+    return issues.reset_index(drop=True)
+
+
+# --- INCREMENTAL RE-VALIDATION ---
+# only these columns can change a check result; edits elsewhere (files, notes) are not re-checked
+CHECK_COLS = (['Business', 'Quote_ID', 'Total_Value'],
+              ['Business', 'Invoice_No', 'Quote_Ref', 'Split_Amount'],
+              ['Payment_ID', 'Invoice_Ref', 'Quote_Ref', 'Amount'])
+
+
+def ledger_snapshot(df_q, df_i, df_p):
+    """The three sheets plus a hash of the checked columns per row, to find what a write touched."""
+    frames = (df_q, df_i, df_p)
+    hashes = [pd.util.hash_pandas_object(df[[c for c in cols if c in df.columns]], index=False)
+              for df, cols in zip(frames, CHECK_COLS)]
+    return {'frames': frames, 'hashes': hashes}
+
+
+def _changed(old_df, old_h, new_df, new_h):
+    n = min(len(old_h), len(new_h))
+    if (old_h.values[:n] == new_h.values[:n]).all():
+        # usual write: rows appended (or the tail removed), everything before untouched
+        return pd.concat([old_df.iloc[n:], new_df.iloc[n:]], ignore_index=True)
+    # otherwise: rows whose hash occurs a different number of times before/after (handles identical rows)
+    counts = pd.concat([old_h.value_counts().rename('old'), new_h.value_counts().rename('new')], axis=1).fillna(0)
+    diff = counts.index[counts['old'] != counts['new']]
+    return pd.concat([old_df[old_h.isin(diff).values], new_df[new_h.isin(diff).values]], ignore_index=True)
+
+
+def touched_keys(old, new):
+    """Quote / invoice / payment keys affected by the rows that changed between two ledger_snapshot()s."""
+    cq, ci, cp = _frames(*[_changed(o, oh, n, nh) for o, oh, n, nh
+                           in zip(old['frames'], old['hashes'], new['frames'], new['hashes'])])
+    # an invoice line moving touches its quote too
+    return {'quotes': pd.Index(pd.concat([_qkey(cq['Business'], cq['Quote_ID']),
+                                          _qkey(ci['Business'], ci['Quote_Ref'])])).unique(),
+            'invoices': pd.Index(pd.concat([ci['Invoice_No'], cp['Invoice_Ref']])).unique(),
+            'payments': pd.Index(cp['Payment_ID']).unique()}
+
+
+def revalidate(issues, df_q, df_i, df_p, keys):
+    """Replace the issues on touched keys with a fresh restricted check."""
+    if not any(len(k) for k in keys.values()):
+        return issues
+    kept = issues[~_touches(issues, keys)]
+    return pd.concat([kept, check_ledger(df_q, df_i, df_p, keys)], ignore_index=True)
+
+
+_state_lock = threading.Lock()
+
+
+def update_integrity(state, data_version, df_q, df_i, df_p):
+    """
+    Issues for the current data version, using `state` (a dict kept across runs) to re-check
+    only what changed since the last version it saw. First call runs the full check.
+    """
+    with _state_lock:
+        if state.get('version') == data_version:
+            return state['issues']
+        snap = ledger_snapshot(df_q, df_i, df_p)
+        if 'issues' in state:
+            touched = touched_keys(state['snapshot'], snap)
+            issues = revalidate(state['issues'], df_q, df_i, df_p, touched)
+        else:
+            touched = None
+            issues = check_ledger(df_q, df_i, df_p)
+        state.update(version=data_version, issues=issues, snapshot=snap, touched=touched)
+        return issues
+
+
+def summarize(issues):
+    """Count + amount per check (all checks listed, zeros included)."""
+    summary = issues.groupby('Check').agg(Issues=('Check', 'size'), Amount=('Amount', 'sum'))
+    summary = summary.reindex(CHECKS, fill_value=0)
+    summary.insert(0, 'Severity', [SEVERITY[c] for c in summary.index])
+    return summary.reset_index()
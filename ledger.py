@@ -0,0 +1,175 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from openpyxl.styles import PatternFill, Font
+from hierarchy import build_hierarchy, QUOTE, INVOICE, PAYMENT
+
+# --- LEDGER ROW GENERATOR ---
+# The Master Ledger view of app12 as a stream of row dicts: QUOTE header, its INVOICE lines,
+# the PAYMENT lines allocated to each, a SUB_SUM status line per invoice, a SUMMARY per quote
+# and one GRAND total per business. Every subtotal is read from the hierarchy (hierarchy.py),
+# built once up front, so a unit is a single walk and only the current row lives in memory.
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def _pick(df, col, rows, default=""):
+    """row position -> value of `col`, for the given rows only."""
+    values = df[col].iloc[rows].astype(object).tolist() if col in df.columns else [default] * len(rows)
+    return dict(zip(rows.tolist(), values))
+
+
+def _icons(df_p, rows):
+    """Document icons of the given payment lines, once per line instead of once per ledger row."""
+    sub = df_p.iloc[rows]
+    flags = [(_str(sub[col]) if col in sub.columns else pd.Series("None", index=sub.index)) != "None"
+             for col in ('Proof_File', 'Form_C_File', 'Payment_Decl_File')]
+    icons = [' '.join(i for i, on in zip(("🏦", "📄", "📝"), f) if on) for f in zip(*flags)]
+    return dict(zip(rows.tolist(), icons))
+
+
+def iter_ledger_rows(curr_biz, df_q, df_i, df_p, tree=None):
+    """Rows of generate_ledger_view for one business, one dict at a time. Totals come from the hierarchy."""
+    tree = tree if tree is not None else build_hierarchy(df_q, df_i, df_p)
+    # only the source rows under this business are converted to Python values
+    node = tree.business_node.get(curr_biz)
+    span = slice(node, tree.end[node]) if node is not None else slice(0, 0)
+    level, rows = tree.level[span], tree.row[span]
+    q_rows, i_rows = rows[level == QUOTE], rows[level == INVOICE]
+    p_rows = np.unique(rows[(level == PAYMENT) & (rows >= 0)])
+    q_rows = q_rows[q_rows >= 0]
+    q_date, q_name = _pick(df_q, 'Date', q_rows), _pick(df_q, 'Project_Name', q_rows)
+    inv_date, inv_desc = _pick(df_i, 'Date', i_rows), _pick(df_i, 'Description', i_rows)
+    p_date, icons = _pick(df_p, 'Date', p_rows), _icons(df_p, p_rows)
+    value, billed, collected = tree.own['value'], tree.own['billed'], tree.own['collected']
+    sub_billed, sub_collected = tree.sub['billed'], tree.sub['collected']
+
+    for qn in tree.quotes(curr_biz):
+        qr, hold = tree.row[qn], tree.holder[qn]
+        q_val = float(value[qn])
+        q_billed = float(sub_billed[hold])
+        # ✅ Collected against this Quote (works even if invoice spans multiple quotes)
+        q_collected = float(sub_collected[hold])
+
+        # ✅ Quote header Remaining Quoted Balance = Total Quote - Total Billed
+        q_unbilled = q_val - q_billed
+
+        # 1) QUOTE HEADER
+        yield {
+            'Type': 'QUOTE', 'Ref': tree.ref[qn], 'Date': q_date[qr],
+            'Description': f"📂 PROJECT: {q_name[qr]}",
+            'Debit': q_val, 'Credit': q_collected, 'Balance': q_unbilled,
+            'Status': "⏳" if q_unbilled > 1.0 else "✅"
+        }
+
+        # 2) INVOICE LOOP (per quote)
+        for ln in tree.children(hold):
+            ir = tree.row[ln]
+            inv_amt = float(billed[ln])
+            yield {
+                'Type': 'INVOICE', 'Ref': tree.ref[ln], 'Date': inv_date[ir],
+                'Description': f"  ↳ 🧾 Inv: {inv_desc[ir]}",
+                'Debit': inv_amt, 'Credit': 0, 'Balance': 0, 'Status': ''
+            }
+
+            # 3) PAYMENT LOOP (allocated by quote+invoice)
+            pay_line = tree.pay_line[ln]
+            for pn in tree.children(pay_line):
+                pr = tree.row[pn]
+                yield {
+                    'Type': 'PAYMENT', 'Ref': tree.ref[pn], 'Date': p_date.get(pr, ""),
+                    'Description': f"    ↳ 💰 Payment Received {icons.get(pr, '')}",
+                    'Debit': 0, 'Credit': float(collected[pn]), 'Balance': 0, 'Status': ''
+                }
+
+            # ✅ Invoice status line with % covered directly under invoice (strict)
+            inv_collected = float(sub_collected[pay_line])
+            inv_bal = inv_amt - inv_collected
+            pct = (inv_collected / inv_amt * 100.0) if inv_amt > 0 else 0.0
+            yield {
+                'Type': 'SUB_SUM', 'Ref': '', 'Date': '',
+                'Description': f"    👉 Status: {pct:.1f}% Cleared (Due: {inv_bal:,.0f})",
+                'Debit': 0, 'Credit': 0, 'Balance': inv_bal, 'Status': "✅" if inv_bal < 1.0 else "🔴"
+            }
+
+        # 4) QUOTE SUMMARY ROW: show Unbilled vs Unpaid
+        q_unpaid = q_billed - q_collected
+        yield {
+            'Type': 'SUMMARY', 'Ref': 'TOTAL', 'Date': '',
+            'Description': f"📊 PROJECT TOTALS | Unbilled: {q_unbilled:,.0f} | Unpaid: {q_unpaid:,.0f} | Billed: {q_billed:,.0f}",
+            'Debit': q_billed, 'Credit': q_collected, 'Balance': q_unpaid,
+            'Status': "✅" if q_unpaid < 1.0 else "🔴"
+        }
+        yield {'Type': 'SPACE'}
+
+    # GRAND TOTAL (invoices without an existing quote are not part of any project)
+    grand = tree.business_totals(curr_biz, include_orphans=False)
+    grand_billed, grand_collected = grand['billed'], grand['collected']
+    grand_outstanding = grand_billed - grand_collected
+    g_pct = (grand_collected / grand_billed * 100.0) if grand_billed > 0 else 0.0
+    yield {
+        'Type': 'GRAND', 'Ref': 'ALL', 'Date': datetime.today(),
+        'Description': f"BUSINESS GRAND TOTAL ({g_pct:.1f}% Collected)",
+        'Debit': grand_billed, 'Credit': grand_collected, 'Balance': grand_outstanding,
+        'Status': "🟢" if grand_outstanding < 1.0 else "🔴"
+    }
+
+
+def iter_all_ledgers(df_q, df_i, df_p, businesses=None, tree=None):
+    """Ledger rows of every business (or the given ones), each tagged with its Business."""
+    tree = tree if tree is not None else build_hierarchy(df_q, df_i, df_p)
+    if businesses is None:
+        businesses = pd.unique(df_q['Business'].dropna()).tolist()
+    for biz in businesses:
+        for row in iter_ledger_rows(biz, df_q, df_i, df_p, tree=tree):
+            row['Business'] = biz
+            yield row
+
+
+# --- EXCEL SHEET ---
+LEDGER_SHEET = 'Master_Ledger_View'
+
+
+def _fill(color):
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+def write_ledger_sheet(writer, ledger_df):
+    """The Master_Ledger_View sheet of the master workbook, coloured by row type (openpyxl ExcelWriter)."""
+    ledger_df.to_excel(writer, sheet_name=LEDGER_SHEET, index=False)
+    ws = writer.book[LEDGER_SHEET]
+    fill_q, fill_inv, fill_pay = _fill("E3F2FD"), _fill("FFF9C4"), _fill("E8F5E9")
+    fill_sum, fill_grand = _fill("F5F5F5"), _fill("212121")
+    font_grand = Font(color="FFFFFF", bold=True)
+    red_font = Font(color="FF0000", bold=True)
+    green_font = Font(color="008000", bold=True)
+
+    for row in ws.iter_rows(min_row=2):
+        rtype = row[0].value
+        status = row[7].value
+
+        if rtype == 'QUOTE':
+            for cell in row:
+                cell.fill = fill_q
+                cell.font = Font(bold=True)
+        elif rtype == 'INVOICE':
+            for cell in row:
+                cell.fill = fill_inv
+        elif rtype == 'PAYMENT':
+            for cell in row:
+                cell.fill = fill_pay
+        elif rtype == 'SUMMARY':
+            for cell in row:
+                cell.fill = fill_sum
+                cell.font = Font(bold=True)
+        elif rtype == 'GRAND':
+            for cell in row:
+                cell.fill = fill_grand
+                cell.font = font_grand
+
+        if status == '🔴':
+            row[7].font = red_font
+        elif status == '✅' or status == '🟢':
+            row[7].font = green_font
@@ -0,0 +1,159 @@
+import os
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from snapshot import file_fingerprint, write_snapshots
+from schema import MODELS, load_workbook, normalize, schema_tag
+from shards import open_store
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+    import msvcrt
+
+# --- SHARED LEDGER SERVICE ---
+# One per workbook per server process (the apps keep it in st.cache_resource), shared by every session:
+#   - view()   : latest published LedgerView. Sessions get shallow copies of the SAME frames; pandas
+#                copy-on-write gives a session its own copy only of what it modifies, so memory does
+#                not grow with the number of users and nobody can change the shared data.
+#   - commit() : the only write path. Serialized by one lock: apply the update to the LATEST frames,
+#                write the workbook + snapshot, publish the result as the next version. Other sessions
+#                see it on their next rerun without touching the file.
+# If the workbook changes outside the service (Excel, another process) the fingerprint no longer
+# matches and the next view() reloads it once for everybody.
+# Once the workbook was split into per-unit, per-year shards (shards.py) the service reads and writes
+# those instead: a commit rewrites only the shards whose rows changed, and the app's persist() is skipped.
+# The apps and the headless API (api.py) run as separate processes on the same workbook, so a commit
+# also holds <workbook>.lock: the process that gets it second re-reads the first one's save before
+# applying its own change.
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock on <path>.lock across processes (blocks until it is free)."""
+    with open(f"{path}.lock", 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class LedgerConflict(Exception):
+    """The ledger got a newer version since the caller's view; re-apply the change on the latest data."""
+
+
+class LedgerView:
+    """One published, immutable version of the ledger, plus indexes derived from it."""
+
+    def __init__(self, version, fingerprint, frames):
+        self.version = version
+        self.fingerprint = fingerprint
+        self._frames = frames
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, sheet):
+        return self._frames[sheet].copy(deep=False)
+
+    def frames(self):
+        return {name: df.copy(deep=False) for name, df in self._frames.items()}
+
+    def derived(self, key, build):
+        """build(frames) once per version for all sessions (lookup indexes, payment maps, ...)."""
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = build(self._frames)
+            return self._derived[key]
+
+
+class LedgerService:
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self._lock = threading.RLock()
+        self._view = None
+        self._store = None
+
+    def shards(self):
+        """ShardStore when the workbook was split (shards.py), else None."""
+        if self._store is None:
+            self._store = open_store(self.path, self.model)
+        return self._store
+
+    def fingerprint(self):
+        store = self.shards()
+        return store.fingerprint() if store is not None else file_fingerprint(self.path)
+
+    def _load(self):
+        store = self.shards()
+        if store is not None:
+            frames = store.load()
+        elif os.path.exists(self.path):
+            frames = load_workbook(self.path, self.model)
+        else:
+            frames = normalize(self.model, {})
+        return frames
+
+    def _publish(self, frames):
+        version = self._view.version + 1 if self._view else 1
+        sheets = MODELS[self.model]['sheets']
+        frames = {name: df[sheets[name]] for name, df in frames.items()}
+        self._view = LedgerView(version, self.fingerprint(), frames)
+        return self._view
+
+    def _current(self):
+        if self._view is None or self._view.fingerprint != self.fingerprint():
+            self._publish(self._load())
+        return self._view
+
+    def view(self):
+        """Latest version; reloads only when the workbook changed outside the service."""
+        view = self._view
+        if view is not None and view.fingerprint == self.fingerprint():
+            return view
+        with self._lock:
+            return self._current()
+
+    def commit(self, update, persist, base_version=None):
+        """
+        update(frames) -> new frames, applied to the latest version under the write lock.
+        persist(new_frames, old_frames) writes the workbook; if it raises nothing is published.
+        Sharded ledgers write the changed shards instead and never call persist.
+        base_version: the version the caller's change was made on (LedgerConflict if it is stale).
+        Returns the new LedgerView.
+        """
+        with self._lock, _file_lock(self.path):
+            current = self._current()
+            if base_version is not None and base_version != current.version:
+                raise LedgerConflict(f"ledger is at version {current.version}, change was made on {base_version}")
+            frames = normalize(self.model, update(current.frames()))
+            store = self.shards()
+            if store is not None:
+                store.save(frames, current.frames())
+            else:
+                persist(frames, current.frames())
+                write_snapshots(self.path, frames, meta={'schema': schema_tag(self.model)})
+            return self._publish(frames)
+
+
+def replace_frames(frames):
+    """commit() update that swaps in a session's full frames (use with base_version)."""
+    return lambda current: {**current, **frames}
+
+
+def append_rows(sheet, rows):
+    """commit() update that appends `rows` to one sheet of the latest version."""
+    def update(current):
+        current[sheet] = pd.concat([current[sheet], pd.DataFrame(rows)], ignore_index=True)
+        return current
+    return update
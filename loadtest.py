@@ -0,0 +1,392 @@
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from unittest.mock import MagicMock
+from streamlit import config as st_config
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import app_test, local_script_runner
+from ledger_service import LedgerService, LedgerConflict
+from schema import normalize, write_stamp
+from shards import split_workbook
+
+# --- CONCURRENT SESSION LOAD TEST ---
+# Headless driver for "how many finance users can one Streamlit process take". N simulated sessions
+# (one AppTest each, on its own thread, sharing the process-wide caches exactly like browser sessions
+# of one server) run a random mix of user actions against a synthetic workbook in a scratch folder:
+#   switch    : pick another business unit in the sidebar
+#   filter    : change a date filter (app.py: sidebar From date, app12.py: aging as-of date)
+#   pay       : record a payment against an open invoice (with a bank slip in app12.py)
+#   upload    : upload a generated invoice PDF, let the parser pool read it, save it
+# Every rerun is timed. The report gives p50 / p95 / p99 per action, write contention measured on
+# LedgerService.commit (lock wait, time holding the lock, refused stale saves) and process memory
+# per extra session.
+#
+#   python loadtest.py --app app12.py --sessions 8 --actions 20
+#   python loadtest.py --app app.py --sessions 16 --invoices 2000 --csv runs.csv
+#   python loadtest.py --app app12.py --sharded      (same, on the per-unit, per-year shards)
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+FILES = {'app12.py': ('Finance_Master_V5.xlsx', 'master'), 'app.py': ('Finance_Ledger.xlsx', 'legacy')}
+ACTIONS = {'switch': 0.35, 'filter': 0.30, 'pay': 0.20, 'upload': 0.15}
+CONFLICT_TEXT = "Another user saved the ledger first"
+
+
+# --- SYNTHETIC WORKBOOK ---
+def synthetic_frames(model, units=4, quotes=50, invoices=400, payments=600, seed=0):
+    """Random but consistent ledger: invoices reference existing quotes, payments cover part of them."""
+    rng = np.random.default_rng(seed)
+    biz = [f"Unit_{k + 1}" for k in range(units)]
+    day0 = pd.Timestamp('2025-01-01')
+    inv_no = [f"INV-SYN-{k:05d}" for k in range(invoices)]
+    inv_biz = rng.choice(biz, invoices)
+    inv_amt = rng.uniform(500, 20000, invoices).round(2)
+    inv_date = day0 + pd.to_timedelta(rng.integers(0, 300, invoices), unit='D')
+    pay_of = rng.integers(0, invoices, payments)
+    pay_amt = (inv_amt[pay_of] * rng.uniform(0.05, 0.4, payments)).round(2)
+    pay_date = inv_date[pay_of] + pd.to_timedelta(rng.integers(5, 60, payments), unit='D')
+    pay_id = [f"PAY-SYN-{k:06d}" for k in range(payments)]
+
+    if model == 'legacy':
+        return normalize('legacy', {
+            'Invoices': pd.DataFrame({'Invoice_No': inv_no, 'Date': inv_date, 'Entry_Date': inv_date,
+                                      'Client': 'Synthetic', 'Project_Name': [f"Project {k % 37}" for k in range(invoices)],
+                                      'Total_Amount': inv_amt, 'PDF_File': "Manual_Entry", 'Business_Unit': inv_biz}),
+            'Payments': pd.DataFrame({'Payment_ID': pay_id, 'Invoice_Ref': np.array(inv_no)[pay_of],
+                                      'Amount_Received': pay_amt, 'Method': 'Bank', 'Proof_File': "Manual_Entry",
+                                      'Payment_Date': pay_date, 'Entry_Date': pay_date}),
+        })
+
+    n_q = units * quotes
+    q_biz = np.repeat(biz, quotes)
+    q_id = [f"QT-SYN-{k:05d}" for k in range(n_q)]
+    # each invoice bills a quote of its own business
+    q_of = np.array([rng.integers(0, quotes) + biz.index(b) * quotes for b in inv_biz])
+    q_val = np.zeros(n_q)
+    np.add.at(q_val, q_of, inv_amt)
+    q_val = (q_val * rng.uniform(1.0, 1.6, n_q)).round(2) + 1000.0
+    return normalize('master', {
+        'Quotations': pd.DataFrame({'Quote_ID': q_id, 'Date': day0, 'Business': q_biz,
+                                    'Project_Name': [f"Project {k}" for k in range(n_q)], 'Total_Value': q_val,
+                                    'Agreement_File': "None", 'Status': 'Synthetic'}),
+        'Invoices': pd.DataFrame({'Invoice_No': inv_no, 'Quote_Ref': np.array(q_id)[q_of], 'Date': inv_date,
+                                  'Business': inv_biz, 'Split_Amount': inv_amt, 'Description': 'Synthetic services',
+                                  'Invoice_File': "None", 'Declaration_File': "None"}),
+        'Payments': pd.DataFrame({'Payment_ID': pay_id, 'Parent_Payment_ID': pay_id,
+                                  'Invoice_Ref': np.array(inv_no)[pay_of], 'Quote_Ref': np.array(q_id)[q_of][pay_of],
+                                  'Date': pay_date, 'Amount': pay_amt, 'Proof_File': "slip.pdf",
+                                  'Form_C_File': "None", 'Payment_Decl_File': "None"}),
+    })
+
+
+def write_synthetic_workbook(path, model, **sizes):
+    frames = synthetic_frames(model, **sizes)
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for name, df in frames.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+        write_stamp(writer, model)
+    return sorted(set(frames['Invoices']['Business' if model == 'master' else 'Business_Unit']))
+
+
+def invoice_pdf(invoice_no, amount):
+    """Smallest valid one-page PDF both invoice parsers can read."""
+    lines = [f"Invoice No: {invoice_no}", f"Date: {date.today():%Y-%m-%d}", "Project: Load Test",
+             f"Total ${amount:,.2f}"]
+    stream = "".join(f"BT /F1 12 Tf 72 {720 - 20 * k} Td ({s}) Tj ET\n" for k, s in enumerate(lines))
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 4 0 R >> >> "
+            "/Contents 5 0 R >>",
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+            f"<< /Length {len(stream)} >>\nstream\n{stream}endstream"]
+    out, offsets = "%PDF-1.4\n", []
+    for k, obj in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += f"{k} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF"
+    return out.encode('latin-1')
+
+
+# --- MEASUREMENT ---
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:  # not Linux: peak instead of current
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class CommitStats:
+    """Timings of every LedgerService.commit in this process (all sessions share the service)."""
+
+    def __init__(self):
+        self.waits, self.holds, self.refused = [], [], 0
+        self.service = None
+        self._lock = threading.Lock()
+
+    def landed(self, sheet, col, value):
+        """True if `value` is in `col` of the latest published version (did a session's save go through?)."""
+        if self.service is None:
+            return False
+        return bool((self.service.view()[sheet][col].astype(str) == value).any())
+
+    def install(self):
+        original = LedgerService.commit
+
+        def commit(service, update, persist, base_version=None):
+            self.service = service
+            t0 = time.perf_counter()
+            with service._lock:  # re-entrant: the real commit takes it again
+                t1 = time.perf_counter()
+                try:
+                    return original(service, update, persist, base_version)
+                except LedgerConflict:
+                    with self._lock:
+                        self.refused += 1
+                    raise
+                finally:
+                    with self._lock:
+                        self.waits.append(t1 - t0)
+                        self.holds.append(time.perf_counter() - t1)
+
+        LedgerService.commit = commit
+
+
+# --- APPTEST, ONE PROCESS, MANY SESSIONS ---
+def share_apptest_runtime():
+    """
+    AppTest assumes one run at a time: each run installs its own mock Runtime and clears it when it
+    ends, recompiles the script, and flips the appTest config flag. With runs on several threads
+    that pulls the runtime from under the other sessions (and parallel compiles trip CPython 3.11's
+    ast). Here all sessions share one compiled script and fall back to one mock runtime, as the
+    sessions of a real server share its single Runtime.
+    """
+    st_config.set_option('global.appTest', True)
+    scripts = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: scripts
+    shared = MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or shared)
+    Runtime.exists = classmethod(lambda cls: True)  # else forms lose their id and submits get dropped
+
+
+# --- SIMULATED SESSION ---
+def _find(elements, label):
+    for e in elements:
+        if str(e.label).startswith(label):
+            return e
+    raise KeyError(label)  # not on the page: the session reloads
+
+
+class Session:
+    def __init__(self, no, app, businesses, stats, seed, timeout):
+        self.no = no
+        self.app = app
+        self.businesses = businesses
+        self.stats = stats
+        self.rng = random.Random(seed)
+        self.at = AppTest.from_file(os.path.join(REPO, app), default_timeout=timeout)
+        self.samples = []  # (session, action, seconds, outcome)
+        self.uploads = 0
+        self.payments = 0
+
+    def timed(self, action, run, landed=None):
+        """Time one rerun. landed(): for saves, whether the record reached the ledger."""
+        t = time.perf_counter()
+        try:
+            at = run()
+            errors = [str(e.value) for e in at.error]
+            if at.exception:
+                outcome = f"exception: {at.exception[0].message[:80]}"
+            elif any(CONFLICT_TEXT in e for e in errors):
+                outcome = 'conflict'
+            elif landed is not None and not landed():
+                outcome = f"rejected: {errors[0][:80] if errors else 'not saved'}"
+            else:
+                outcome = 'ok'
+        except Exception as e:  # AppTest timeout, widget vanished mid-run...
+            outcome = f"failed: {type(e).__name__}: {str(e)[:80]}"
+        self.samples.append((self.no, action, time.perf_counter() - t, outcome))
+        return outcome == 'ok'
+
+    def open(self):
+        if self.timed('open', self.at.run):
+            self.switch()
+
+    def switch(self):
+        box = self.at.sidebar.selectbox[0]
+        biz = self.rng.choice(self.businesses)
+        self.timed('switch', lambda: box.set_value(biz).run())
+
+    def filter(self):
+        day = date(2025, 1, 1) + timedelta(days=self.rng.randint(0, 360))
+        if self.app == 'app.py':
+            widget = self.at.sidebar.date_input[0]
+        else:
+            widget = self.at.date_input(key='biz_aging_asof')
+        self.timed('filter', lambda: widget.set_value(day).run())
+
+    def pay(self):
+        # every slip gets its own name, so the Proof_File column tells whether this save landed
+        self.payments += 1
+        name = f"slip_s{self.no}_{self.payments:04d}.pdf"
+        slip_file = (name, invoice_pdf(f"SLIP-{self.no}-{self.payments}", 1.0), 'application/pdf')
+        landed = lambda: self.stats.landed('Payments', 'Proof_File', name)
+        pick = _find(self.at.selectbox, "Select Invoice to Pay")
+        if self.app == 'app.py':
+            slip, submit = _find(self.at.file_uploader, "Attach Proof"), _find(self.at.button, "Confirm Payment")
+            pick.set_value(self.rng.choice(pick.options))
+        else:
+            if not self.timed('pay_select', lambda: pick.set_value(self.rng.choice(pick.options)).run()):
+                return
+            slip, submit = _find(self.at.file_uploader, "🏦 Bank Slip"), _find(self.at.button, "💾 Record Payment")
+        slip.set_value(slip_file)
+        self.timed('pay', lambda: submit.click().run(), landed)
+
+    def upload(self):
+        self.uploads += 1
+        no = f"INV-LT{self.no}-{self.uploads:04d}"
+        pdf = (f"{no}.pdf", invoice_pdf(no, self.rng.uniform(100, 5000)), 'application/pdf')
+        if self.app == 'app.py':
+            uploader, save_label = lambda: _find(self.at.file_uploader, "Drag & Drop PDF Invoice"), "💾 Save Invoice"
+        else:
+            uploader, save_label = lambda: self.at.file_uploader(key='inv_up'), "💾 Process"
+        box = uploader()
+        if not self.timed('upload_parse', lambda: box.set_value(pdf).run()):
+            return
+        save = _find(self.at.button, save_label)
+        self.timed('upload', lambda: save.click().run(), lambda: self.stats.landed('Invoices', 'Invoice_No', no))
+        uploader().set_value(None)  # the user takes the file out of the uploader again
+
+    def play(self, actions, think):
+        names, weights = list(ACTIONS), list(ACTIONS.values())
+        for _ in range(actions):
+            try:
+                getattr(self, self.rng.choices(names, weights)[0])()
+            except (KeyError, IndexError):  # page was cut short (e.g. st.stop after a refused save)
+                self.timed('reload', self.at.run)
+            time.sleep(self.rng.uniform(0, 2 * think))
+        return self.samples
+
+
+# --- REPORT ---
+def latency_table(samples):
+    df = pd.DataFrame(samples, columns=['Session', 'Action', 'Seconds', 'Outcome'])
+    rows = []
+    for action, g in list(df.groupby('Action', sort=False)) + [('ALL reruns', df[df['Action'] != 'open'])]:
+        ms = g['Seconds'].to_numpy() * 1000.0
+        if not len(ms):
+            continue
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        rows.append({'Action': action, 'Reruns': len(ms), 'p50 ms': p50, 'p95 ms': p95, 'p99 ms': p99,
+                     'max ms': ms.max(), 'Conflicts': int((g['Outcome'] == 'conflict').sum()),
+                     'Rejected': int(g['Outcome'].str.startswith('rejected').sum()),
+                     'Failures': int(g['Outcome'].str.startswith(('exception', 'failed')).sum())})
+    return pd.DataFrame(rows).round(0)
+
+
+def _pct(values, q):
+    return np.percentile(np.array(values) * 1000.0, q) if values else 0.0
+
+
+def run_load_test(app='app12.py', sessions=8, actions=15, think=0.5, seed=0, timeout=120, workdir=None,
+                  sharded=False, **sizes):
+    """Run the load test in `workdir` (a new temp folder by default). Returns (samples, summary dict)."""
+    workdir = workdir or tempfile.mkdtemp(prefix='fos_load_')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # the apps use relative paths for the workbook, vault and indexes
+    ledger_file, model = FILES[app]
+    businesses = write_synthetic_workbook(ledger_file, model, seed=seed, **sizes)
+    if sharded:
+        split_workbook(ledger_file, model)
+    stats = CommitStats()
+    stats.install()
+    share_apptest_runtime()
+
+    mem_start = rss_mb()
+    players = [Session(k + 1, app, businesses, stats, seed * 1000 + k, timeout) for k in range(sessions)]
+    players[0].open()  # builds the shared caches (ledger service, snapshots, indexes) once
+    mem_first = rss_mb()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(Session.open, players[1:]))
+    mem_open = rss_mb()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(lambda s: s.play(actions, think), players))
+    wall = time.perf_counter() - t0
+
+    samples = [s for p in players for s in p.samples]
+    summary = {
+        'app': app, 'sessions': sessions, 'sharded': sharded, 'workdir': workdir, 'wall_s': wall,
+        'commits': len(stats.holds), 'refused_saves': stats.refused,
+        'lock_wait_p50_ms': _pct(stats.waits, 50), 'lock_wait_p95_ms': _pct(stats.waits, 95),
+        'lock_wait_max_ms': _pct(stats.waits, 100), 'commit_p50_ms': _pct(stats.holds, 50),
+        'commit_p95_ms': _pct(stats.holds, 95),
+        'rss_start_mb': mem_start, 'rss_first_session_mb': mem_first, 'rss_all_open_mb': mem_open,
+        'mb_per_extra_session': (mem_open - mem_first) / max(1, sessions - 1), 'rss_peak_mb': peak_rss_mb(),
+    }
+    return samples, summary
+
+
+def print_report(samples, summary):
+    layout = "sharded" if summary['sharded'] else "one workbook"
+    print(f"\n=== {summary['app']} ({layout}): {summary['sessions']} concurrent sessions, {summary['wall_s']:.1f}s "
+          f"(workdir {summary['workdir']}) ===")
+    print(latency_table(samples).to_string(index=False))
+    problems = pd.Series([f"{action}: {outcome}" for _, action, _, outcome in samples if outcome != 'ok'])
+    for what, count in problems.value_counts().items():
+        print(f"  ⚠️ {count}x {what}")
+    print(f"\n✍️  Writes: {summary['commits']} commits, {summary['refused_saves']} refused as stale | "
+          f"lock wait p50 {summary['lock_wait_p50_ms']:.0f} / p95 {summary['lock_wait_p95_ms']:.0f} / "
+          f"max {summary['lock_wait_max_ms']:.0f} ms | commit p50 {summary['commit_p50_ms']:.0f} / "
+          f"p95 {summary['commit_p95_ms']:.0f} ms")
+    print(f"🧠 Memory: {summary['rss_start_mb']:.0f} MB before, {summary['rss_first_session_mb']:.0f} MB with one "
+          f"session, {summary['rss_all_open_mb']:.0f} MB with all open -> "
+          f"~{summary['mb_per_extra_session']:.1f} MB per extra session (peak {summary['rss_peak_mb']:.0f} MB)")
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Concurrent-session load test for app.py / app12.py")
+    ap.add_argument('--app', choices=list(FILES), default='app12.py')
+    ap.add_argument('--sessions', type=int, default=8)
+    ap.add_argument('--actions', type=int, default=15, help="actions per session")
+    ap.add_argument('--think', type=float, default=0.5, help="mean pause between actions (s)")
+    ap.add_argument('--units', type=int, default=4)
+    ap.add_argument('--quotes', type=int, default=50, help="quotations per unit (app12.py)")
+    ap.add_argument('--invoices', type=int, default=400)
+    ap.add_argument('--payments', type=int, default=600)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--timeout', type=float, default=120, help="max seconds per rerun")
+    ap.add_argument('--workdir', help="scratch folder (default: new temp folder)")
+    ap.add_argument('--csv', help="also write every timed rerun to this CSV")
+    ap.add_argument('--sharded', action='store_true', help="split the workbook per unit and fiscal year first")
+    args = ap.parse_args()
+
+    csv_path = os.path.abspath(args.csv) if args.csv else None
+    samples, summary = run_load_test(args.app, args.sessions, args.actions, args.think, args.seed, args.timeout,
+                                     args.workdir, args.sharded, units=args.units, quotes=args.quotes, invoices=args.invoices,
+                                     payments=args.payments)
+    print_report(samples, summary)
+    if csv_path:
+        pd.DataFrame(samples, columns=['Session', 'Action', 'Seconds', 'Outcome']).to_csv(csv_path, index=False)
+        print(f"📄 {len(samples)} reruns -> {csv_path}")
@@ -0,0 +1,228 @@
+import importlib
+import io
+import inspect
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing.connection import wait
+
+# --- SUPERVISED PARSER POOL ---
+# PDF parsing (ingest.py) runs in child processes so a malformed or huge document can
+# never hang the Streamlit script thread or eat the server's memory:
+#   - warm spawned workers, one document at a time each, at most `max_workers` per call; a worker
+#     pays interpreter start-up, the pdfplumber/pandas imports and its memory limit once and then
+#     goes back to an idle list shared by all sessions of the server process (IDLE_MAX kept)
+#   - wall-clock deadline per document -> the worker is killed and replaced
+#   - address-space limit per worker (Linux/macOS; ignored where `resource` is missing); a worker
+#     that ran out of memory exits and is replaced
+#   - progress messages from the parser's optional `progress` hook
+#   - cancellation through a callable checked while waiting
+#   - heartbeat(elapsed seconds) every POLL_SECONDS: lets a Streamlit caller touch a placeholder,
+#     which is where a rerun (Cancel click) interrupts the script and the workers get killed
+# Callers get (key, result, error) per job and fall back to manual entry when error is set.
+
+# parser name -> module that defines it (only these can be run)
+PARSERS = {
+    'parse_invoice': 'ingest',
+    'parse_invoice_v2': 'ingest',
+    'parse_multi_sow_agreement': 'ingest',
+    'parse_payment': 'ingest',
+    'parse_and_fingerprint': 'dedup',
+    'parse_with_text': 'dedup',
+}
+DEFAULT_TIMEOUT = 60       # seconds per document
+DEFAULT_MEMORY_MB = 1536   # address space per worker
+POLL_SECONDS = 0.1
+IDLE_MAX = 4               # warm workers kept per memory limit between calls
+
+
+class ParserError(Exception):
+    pass
+
+
+class ParserTimeout(ParserError):
+    pass
+
+
+class ParserCancelled(ParserError):
+    pass
+
+
+def _limit_memory(memory_mb):
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = int(memory_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker(memory_mb, conn):
+    # One pipe per worker: killing a worker mid-write can only break its own channel
+    _limit_memory(memory_mb)
+    try:
+        import ingest
+        ingest.TABLE_WORKERS = 1  # the pool already parallelises across documents
+        broken = None
+    except (MemoryError, ImportError) as e:  # e.g. a memory limit below what the imports need
+        broken = f"worker could not start ({type(e).__name__}), memory limit {memory_mb} MB"
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        if broken:
+            conn.send(('fatal', broken))
+            return
+        parser, source, params = job
+        try:
+            fn = getattr(importlib.import_module(PARSERS[parser]), parser)
+            src = io.BytesIO(source) if isinstance(source, bytes) else source
+
+            kwargs = dict(params)
+            if 'progress' in inspect.signature(fn).parameters:
+                kwargs['progress'] = lambda frac, msg="": conn.send(('progress', (float(frac), msg)))
+            result = fn(src, **kwargs)
+        except MemoryError:
+            # the heap may be left fragmented near the limit: report and make way for a fresh worker
+            conn.send(('fatal', f"memory limit ({memory_mb} MB) exceeded"))
+            return
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+        else:
+            conn.send(('done', result))
+
+
+# --- WARM WORKERS ---
+_idle = {}  # memory_mb -> [(process, pipe)] ready for a job
+_idle_lock = threading.Lock()
+
+
+def _checkout(ctx, memory_mb):
+    with _idle_lock:
+        workers = _idle.get(memory_mb, [])
+        while workers:
+            proc, conn = workers.pop()
+            if proc.is_alive():
+                return proc, conn
+            conn.close()
+    conn, child = ctx.Pipe()
+    proc = ctx.Process(target=_worker, args=(memory_mb, child), daemon=True)
+    proc.start()
+    child.close()  # parent keeps its end only -> EOF once the worker is gone
+    return proc, conn
+
+
+def _checkin(proc, conn, memory_mb):
+    with _idle_lock:
+        workers = _idle.setdefault(memory_mb, [])
+        if proc.is_alive() and len(workers) < IDLE_MAX:
+            workers.append((proc, conn))
+            return
+    _kill(proc, conn, grace=1)
+
+
+def _kill(proc, conn, grace=0.0):
+    if grace:
+        try:
+            conn.send(None)
+        except (OSError, ValueError):
+            pass
+        proc.join(timeout=grace)
+    if proc.is_alive():
+        proc.kill()
+        proc.join(timeout=1)
+    conn.close()
+
+
+def run_parsers(jobs, max_workers=2, timeout=DEFAULT_TIMEOUT, memory_mb=DEFAULT_MEMORY_MB,
+                on_progress=None, should_cancel=None, heartbeat=None):
+    """
+    Run `jobs` = {key: (parser_name, bytes_or_path[, parser kwargs])} in isolated processes.
+    Yields (key, result, error) as each job ends; error is a ParserError or None.
+    on_progress(key, fraction, message) and heartbeat(elapsed seconds) are called from the caller's thread.
+    Leaving the loop early (break, exception, Streamlit rerun) kills whatever is still running.
+    """
+    for job in jobs.values():
+        if job[0] not in PARSERS:
+            raise ValueError(f"unknown parser '{job[0]}'")
+
+    ctx = mp.get_context('spawn')
+    pending = list(jobs)
+    running = {}   # key -> (process, pipe, deadline)
+    started = time.monotonic()
+
+    def stop(key):
+        # killed mid-job (timeout, cancel, early exit): the worker is replaced, never reused
+        proc, conn, _ = running.pop(key)
+        _kill(proc, conn)
+
+    def release(key):
+        proc, conn, _ = running.pop(key)
+        _checkin(proc, conn, memory_mb)
+
+    try:
+        while pending or running:
+            if should_cancel and should_cancel():
+                for key in list(running):
+                    stop(key)
+                    yield key, None, ParserCancelled("cancelled")
+                for key in pending:
+                    yield key, None, ParserCancelled("cancelled")
+                return
+
+            while pending and len(running) < max_workers:
+                key = pending.pop(0)
+                parser, source, params = (tuple(jobs[key]) + ({},))[:3]
+                proc, conn = _checkout(ctx, memory_mb)
+                try:
+                    conn.send((parser, source, params))
+                except (OSError, ValueError):  # died while idle
+                    _kill(proc, conn)
+                    proc, conn = _checkout(ctx, memory_mb)
+                    conn.send((parser, source, params))
+                running[key] = (proc, conn, time.monotonic() + timeout)
+
+            by_conn = {conn: key for key, (_, conn, _) in running.items()}
+            for conn in wait(list(by_conn), timeout=POLL_SECONDS):
+                key = by_conn[conn]
+                try:
+                    kind, payload = conn.recv()
+                except (EOFError, OSError):
+                    # died without a word (OOM killer, crash in a native library, memory limit)
+                    proc = running[key][0]
+                    proc.join(timeout=1)
+                    exitcode = proc.exitcode
+                    stop(key)
+                    yield key, None, ParserError(f"worker exited unexpectedly (code {exitcode})")
+                    continue
+                if kind == 'progress':
+                    if on_progress:
+                        on_progress(key, *payload)
+                elif kind == 'fatal':
+                    stop(key)
+                    yield key, None, ParserError(payload)
+                else:
+                    release(key)
+                    yield key, (payload if kind == 'done' else None), (ParserError(payload) if kind == 'error' else None)
+
+            now = time.monotonic()
+            for key, (_, _, deadline) in list(running.items()):
+                if now > deadline:
+                    stop(key)
+                    yield key, None, ParserTimeout(f"no result after {timeout}s")
+            if heartbeat and (pending or running):
+                heartbeat(now - started)
+    finally:
+        for key in list(running):
+            stop(key)
+
+
+def run_parser(parser, source, params=None, **kwargs):
+    """Single document: returns the parser result or raises ParserError / ParserTimeout."""
+    for _, result, error in run_parsers({0: (parser, source, params or {})}, max_workers=1, **kwargs):
+        if error:
+            raise error
+        return result
@@ -0,0 +1,183 @@
+import hashlib
+import io
+import re
+import pandas as pd
+
+# --- BULK BANK RECONCILIATION ---
+# 1. read_statement(): CSV or OFX/QFX export -> one row per incoming credit
+# 2. match_statement(): hash-joins statement lines to OPEN invoices
+#       a) on invoice reference found in the narrative (normalized token join)
+#       b) otherwise on exact amount (to the cent) inside a date window
+#    Lines with more than one candidate are flagged 'ambiguous' for review.
+# 3. The apps turn confirmed lines into payment rows and save them in ONE write.
+
+DATE_COLS = ['date', 'transaction date', 'posting date', 'posted date', 'value date', 'booking date']
+AMOUNT_COLS = ['amount', 'credit', 'credit amount', 'deposit', 'deposits', 'paid in', 'money in']
+TEXT_COLS = ['description', 'narrative', 'details', 'memo', 'reference', 'payee', 'name', 'particulars']
+ID_COLS = ['fitid', 'transaction id', 'id', 'reference number', 'bank reference']
+
+TOKEN = re.compile(r"[A-Z0-9][A-Z0-9\-/_.]*[A-Z0-9]")
+MIN_KEY_LEN = 4  # shorter invoice numbers would match random digits in narratives
+
+STATUS_MATCHED = 'matched'
+STATUS_AMBIGUOUS = 'ambiguous'
+STATUS_UNMATCHED = 'unmatched'
+STATUS_POSTED = 'posted'
+
+
+def _norm_key(s):
+    return s.astype(str).str.upper().str.replace(r'[^A-Z0-9]', '', regex=True)
+
+
+def _to_amount(s):
+    s = s.astype(str).str.strip()
+    neg = s.str.startswith('(') & s.str.endswith(')')
+    val = pd.to_numeric(s.str.replace(r'[^\d.\-]', '', regex=True), errors='coerce')
+    return val.where(~neg, -val.abs())
+
+
+def _pick(columns, wanted):
+    lower = {str(c).strip().lower(): c for c in columns}
+    for w in wanted:
+        if w in lower:
+            return lower[w]
+    return None
+
+
+def _line_ids(df):
+    # Stable across re-imports of the same export: content + position among identical lines
+    base = df['Date'].astype(str) + '|' + df['Amount'].round(2).astype(str) + '|' + df['Description']
+    occurrence = base.groupby(base).cumcount().astype(str)
+    return (base + '|' + occurrence).map(lambda x: hashlib.sha1(x.encode('utf-8')).hexdigest()[:12].upper())
+
+
+def _read_csv(raw):
+    df = pd.read_csv(io.BytesIO(raw), dtype=str, keep_default_na=False)
+    c_date, c_amt = _pick(df.columns, DATE_COLS), _pick(df.columns, AMOUNT_COLS)
+    if c_date is None or c_amt is None:
+        raise ValueError(f"CSV needs a date and an amount/credit column (found: {list(df.columns)})")
+
+    text_cols = [c for c in df.columns if str(c).strip().lower() in TEXT_COLS]
+    c_id = _pick(df.columns, ID_COLS)
+    return pd.DataFrame({
+        'Date': pd.to_datetime(df[c_date], errors='coerce', dayfirst=False),
+        'Amount': _to_amount(df[c_amt]),
+        'Description': df[text_cols].agg(' '.join, axis=1).str.strip() if text_cols else "",
+        'Bank_ID': df[c_id] if c_id is not None else "",
+    })
+
+
+def _ofx_field(block, tag):
+    m = re.search(rf"<{tag}>([^<\r\n]*)", block, re.IGNORECASE)
+    return m.group(1).strip() if m else ""
+
+
+def _read_ofx(raw):
+    text = raw.decode('utf-8', errors='ignore')
+    rows = []
+    for block in re.findall(r"<STMTTRN>(.*?)(?=</STMTTRN>|<STMTTRN>|</BANKTRANLIST>)", text, re.IGNORECASE | re.DOTALL):
+        rows.append({
+            'Date': _ofx_field(block, 'DTPOSTED')[:8],
+            'Amount': _ofx_field(block, 'TRNAMT'),
+            'Description': ' '.join(x for x in (_ofx_field(block, 'NAME'), _ofx_field(block, 'MEMO'),
+                                                 _ofx_field(block, 'REFNUM'), _ofx_field(block, 'CHECKNUM')) if x),
+            'Bank_ID': _ofx_field(block, 'FITID'),
+        })
+    df = pd.DataFrame(rows, columns=['Date', 'Amount', 'Description', 'Bank_ID'])
+    df['Date'] = pd.to_datetime(df['Date'], format='%Y%m%d', errors='coerce')
+    df['Amount'] = _to_amount(df['Amount'])
+    return df
+
+
+def read_statement(file_obj_or_path, name=None):
+    """
+    Parse a bank export into Line_ID, Date, Amount, Description (incoming credits only).
+    Accepts a path or an uploaded file object; the format is picked from the extension.
+    """
+    if hasattr(file_obj_or_path, 'getvalue'):
+        raw = file_obj_or_path.getvalue()
+        name = name or getattr(file_obj_or_path, 'name', '')
+    else:
+        with open(file_obj_or_path, 'rb') as f:
+            raw = f.read()
+        name = name or str(file_obj_or_path)
+
+    df = _read_ofx(raw) if name.lower().endswith(('.ofx', '.qfx')) else _read_csv(raw)
+    df['Description'] = df['Description'].fillna("").astype(str)
+    df = df[(df['Amount'] > 0) & df['Date'].notna()].reset_index(drop=True)
+
+    bank_id = _norm_key(df['Bank_ID'].fillna(""))
+    df['Line_ID'] = bank_id.where(bank_id.str.len() > 0, _line_ids(df))
+    return df[['Line_ID', 'Date', 'Amount', 'Description']]
+
+
+def match_statement(stmt, open_invs, posted_ids=(), date_tol_days=3, max_delay_days=365, amount_tol=0.01):
+    """
+    Match statement lines to open invoices.
+    `open_invs` needs Invoice_No, Business, Date, Outstanding (aging.invoice_outstanding / legacy_invoice_outstanding).
+    `posted_ids` are Line_IDs already booked (re-imports are reported as 'posted', never doubled).
+    Returns one row per statement line with Invoice_No, Business, Due, Match_Type, Status, Candidates, Note.
+    """
+    inv = open_invs[open_invs['Outstanding'] > amount_tol][['Invoice_No', 'Business', 'Date', 'Outstanding']].copy()
+    inv['Invoice_No'] = inv['Invoice_No'].astype(str)
+    inv['Date'] = pd.to_datetime(inv['Date'], errors='coerce')
+    inv['_key'] = _norm_key(inv['Invoice_No'])
+    inv = inv[inv['_key'].str.len() >= MIN_KEY_LEN]
+
+    lines = stmt.copy()
+
+    # a) reference join: explode narrative tokens, hash-join on the normalized invoice number
+    tokens = lines[['Line_ID']].assign(_key=lines['Description'].str.upper().str.findall(TOKEN)).explode('_key').dropna()
+    tokens['_key'] = _norm_key(tokens['_key'])
+    by_ref = tokens.merge(inv, on='_key').drop_duplicates(['Line_ID', 'Invoice_No'])
+    by_ref['Match_Type'] = 'reference'
+
+    # b) amount join (cents) + date window, only for lines without a reference hit
+    rest = lines[~lines['Line_ID'].isin(by_ref['Line_ID'])][['Line_ID', 'Date', 'Amount']]
+    rest = rest.assign(_cents=(rest['Amount'] * 100).round().astype('int64'))
+    inv_c = inv.assign(_cents=(inv['Outstanding'] * 100).round().astype('int64'))
+    by_amt = rest.merge(inv_c.drop(columns=['_key']), on='_cents', suffixes=('', '_inv'))
+    lag = (by_amt['Date'] - by_amt['Date_inv']).dt.days
+    by_amt = by_amt[(lag >= -date_tol_days) & (lag <= max_delay_days)].copy()
+    by_amt['Match_Type'] = 'amount+date'
+
+    cands = pd.concat([by_ref[['Line_ID', 'Invoice_No', 'Business', 'Outstanding', 'Match_Type']],
+                       by_amt[['Line_ID', 'Invoice_No', 'Business', 'Outstanding', 'Match_Type']]], ignore_index=True)
+    n_cands = cands.groupby('Line_ID')['Invoice_No'].transform('size')
+    # An amount-only hit is only trusted if no other line claims the same invoice
+    n_claims = cands.groupby(['Invoice_No', 'Match_Type'])['Line_ID'].transform('size')
+    cands['_unique'] = (n_cands == 1) & ~((cands['Match_Type'] == 'amount+date') & (n_claims > 1))
+
+    first = cands.drop_duplicates('Line_ID').set_index('Line_ID')
+    cand_list = cands.groupby('Line_ID')['Invoice_No'].agg(', '.join)
+
+    out = lines.join(first[['Invoice_No', 'Business', 'Outstanding', 'Match_Type', '_unique']], on='Line_ID')
+    out = out.rename(columns={'Outstanding': 'Due'})
+    out['Candidates'] = out['Line_ID'].map(cand_list).fillna("")
+    out['Note'] = ""
+
+    has = out['Invoice_No'].notna()
+    unique = out['_unique'].astype('boolean').fillna(False).astype(bool)
+    over = has & (out['Amount'] > out['Due'] + amount_tol)
+    out['Status'] = STATUS_UNMATCHED
+    out.loc[has & unique & ~over, 'Status'] = STATUS_MATCHED
+    out.loc[has & ~unique, 'Status'] = STATUS_AMBIGUOUS
+    out.loc[has & ~unique, 'Note'] = "multiple candidates"
+    out.loc[has & unique & over, 'Status'] = STATUS_AMBIGUOUS
+    out.loc[has & unique & over, 'Note'] = "amount exceeds due"
+    out.loc[out['Line_ID'].isin(set(posted_ids)), 'Status'] = STATUS_POSTED
+
+    out['Confirm'] = out['Status'] == STATUS_MATCHED
+    return out.drop(columns=['_unique'])
+
+
+def parent_payment_id(line_id):
+    """Deterministic payment id for a statement line, so a second import is detected as 'posted'."""
+    return f"BNK-{line_id}"
+
+
+def posted_line_ids(payment_ids):
+    ids = pd.Series(payment_ids, dtype=object).dropna().astype(str)
+    ids = ids[ids.str.startswith('BNK-')].str[4:]
+    # app12 lines carry a "-<n>" suffix per quote allocation
+    return set(ids.str.replace(r'-\d+$', '', regex=True))
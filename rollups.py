@@ -0,0 +1,126 @@
+import pandas as pd
+
+# --- VECTORIZED ROLLUPS ---
+# Grouped equivalents of the per-quote / per-invoice loops in app12.py.
+# All functions take the raw Quotations / Invoices / Payments frames returned by load_db().
+
+
+def _str(s):
+    return s.fillna("").astype(str)
+
+
+def pair_collections(df_i, df_p):
+    """
+    Collected amount for every (Invoice_No, Quote_Ref) line pair in df_i.
+    Same rule as _payments_for_invoice_quote: if any payment line of an invoice carries a
+    Quote_Ref the allocation is used, otherwise all payments of the invoice count.
+    """
+    pairs = pd.DataFrame({
+        'Invoice_No': _str(df_i['Invoice_No']),
+        'Quote_Ref': _str(df_i['Quote_Ref']),
+    }).drop_duplicates()
+
+    if df_p.empty or pairs.empty:
+        pairs['Collected'] = 0.0
+        return pairs
+
+    p = pd.DataFrame({
+        'Invoice_Ref': _str(df_p['Invoice_Ref']),
+        'Quote_Ref': _str(df_p['Quote_Ref']) if 'Quote_Ref' in df_p.columns else "",
+        'Amount': pd.to_numeric(df_p['Amount'], errors='coerce').fillna(0.0),
+    })
+    p['_alloc'] = p['Quote_Ref'].str.len() > 0
+
+    by_inv = p.groupby('Invoice_Ref').agg(_inv_sum=('Amount', 'sum'), _has_alloc=('_alloc', 'any'))
+    by_pair = p.groupby(['Invoice_Ref', 'Quote_Ref'])['Amount'].sum().rename('_pair_sum')
+
+    out = pairs.join(by_inv, on='Invoice_No').join(by_pair, on=['Invoice_No', 'Quote_Ref'])
+    has_alloc = out['_has_alloc'].astype('boolean').fillna(False).astype(bool)
+    out['Collected'] = out['_pair_sum'].fillna(0.0).where(has_alloc, out['_inv_sum'].fillna(0.0))
+    return out[['Invoice_No', 'Quote_Ref', 'Collected']].reset_index(drop=True)
+
+
+def quote_rollup(df_q, df_i, df_p):
+    """One row per quote: Value, Billed, Collected, Unbilled, Unpaid (as in PROJECT TOTALS)."""
+    q = df_q[['Quote_ID', 'Business', 'Project_Name', 'Date', 'Total_Value']].copy()
+    q['Quote_ID'] = _str(q['Quote_ID'])
+    q['Value'] = pd.to_numeric(q['Total_Value'], errors='coerce').fillna(0.0)
+
+    i = pd.DataFrame({
+        'Business': df_i['Business'],
+        'Quote_Ref': _str(df_i['Quote_Ref']),
+        'Split_Amount': pd.to_numeric(df_i['Split_Amount'], errors='coerce').fillna(0.0),
+    })
+    billed = i.groupby(['Business', 'Quote_Ref'])['Split_Amount'].sum().rename('Billed')
+
+    # Collections are keyed on (invoice, quote) pairs, then summed per (business, quote)
+    pairs = pair_collections(df_i, df_p)
+    inv_biz = pd.DataFrame({'Invoice_No': _str(df_i['Invoice_No']), 'Quote_Ref': _str(df_i['Quote_Ref']),
+                            'Business': df_i['Business']}).drop_duplicates(['Invoice_No', 'Quote_Ref', 'Business'])
+    pairs = inv_biz.merge(pairs, on=['Invoice_No', 'Quote_Ref'], how='left')
+    collected = pairs.groupby(['Business', 'Quote_Ref'])['Collected'].sum()
+
+    q = q.join(billed, on=['Business', 'Quote_ID']).join(collected, on=['Business', 'Quote_ID'])
+    q['Billed'] = q['Billed'].fillna(0.0)
+    q['Collected'] = q['Collected'].fillna(0.0)
+    q['Unbilled'] = q['Value'] - q['Billed']
+    q['Unpaid'] = q['Billed'] - q['Collected']
+    return q.drop(columns=['Total_Value']).reset_index(drop=True)
+
+
+def business_rollup(df_q, df_i, df_p):
+    """
+    Dashboard KPIs for EVERY business unit in one grouped pass.
+    Collected: every payment line goes to the business of its quote (Quote_Ref), so an invoice number
+    used by two units credits each its own lines. Lines without a Quote_Ref fall back to the invoice.
+    """
+    value = df_q.groupby('Business')['Total_Value'].sum() if not df_q.empty else pd.Series(dtype=float)
+    n_quotes = df_q.groupby('Business')['Quote_ID'].nunique() if not df_q.empty else pd.Series(dtype=int)
+    billed = df_i.groupby('Business')['Split_Amount'].sum() if not df_i.empty else pd.Series(dtype=float)
+    n_invs = df_i.groupby('Business')['Invoice_No'].nunique() if not df_i.empty else pd.Series(dtype=int)
+
+    if not df_i.empty and not df_p.empty:
+        # (Invoice_Ref, Quote_Ref) -> quote -> Business; invoice lines cover quotes no longer in df_q
+        line_biz = pd.Series(df_i['Business'].values, index=_str(df_i['Quote_Ref']))
+        quote_biz = pd.concat([pd.Series(df_q['Business'].values, index=_str(df_q['Quote_ID'])), line_biz])
+        quote_biz = quote_biz[~quote_biz.index.duplicated()]
+        inv_biz = pd.Series(df_i['Business'].values, index=_str(df_i['Invoice_No'])).groupby(level=0).first()
+        q_ref = _str(df_p['Quote_Ref']) if 'Quote_Ref' in df_p.columns else pd.Series("", index=df_p.index)
+        pay_biz = q_ref.map(quote_biz).fillna(_str(df_p['Invoice_Ref']).map(inv_biz))
+        collected = pd.to_numeric(df_p['Amount'], errors='coerce').fillna(0.0).groupby(pay_biz).sum()
+    else:
+        collected = pd.Series(dtype=float)
+
+    out = pd.DataFrame({
+        'Quotes': n_quotes, 'Invoices': n_invs,
+        'Project_Value': value, 'Billed': billed, 'Collected': collected,
+    })
+    out.index.name = 'Business'
+    out = out.fillna(0)
+    out['Outstanding'] = (out['Billed'] - out['Collected']).clip(lower=0.0)
+    out['Unbilled'] = (out['Project_Value'] - out['Billed']).clip(lower=0.0)
+    out['Collection_Rate'] = (out['Collected'] / out['Billed'].where(out['Billed'] > 0) * 100.0).fillna(0.0)
+    return out.reset_index().sort_values('Outstanding', ascending=False, ignore_index=True)
+
+
+def legacy_business_rollup(df_inv, df_pay):
+    """Same idea for the app.py layout (Invoices.Total_Amount / Payments.Amount_Received)."""
+    if df_inv.empty:
+        return pd.DataFrame(columns=['Business', 'Invoices', 'Billed', 'Collected', 'Outstanding', 'Collection_Rate'])
+
+    amt = pd.to_numeric(df_inv['Total_Amount'], errors='coerce').fillna(0.0)
+    billed = amt.groupby(df_inv['Business_Unit']).sum()
+    n_invs = df_inv.groupby('Business_Unit')['Invoice_No'].nunique()
+
+    if not df_pay.empty:
+        inv_biz = pd.Series(df_inv['Business_Unit'].values, index=_str(df_inv['Invoice_No'])).groupby(level=0).first()
+        pay_biz = _str(df_pay['Invoice_Ref']).map(inv_biz)
+        collected = pd.to_numeric(df_pay['Amount_Received'], errors='coerce').fillna(0.0).groupby(pay_biz).sum()
+    else:
+        collected = pd.Series(dtype=float)
+
+    out = pd.DataFrame({'Invoices': n_invs, 'Billed': billed, 'Collected': collected}).fillna(0)
+    out.index.name = 'Business'
+    out['Outstanding'] = out['Billed'] - out['Collected']
+    out['Collection_Rate'] = (out['Collected'] / out['Billed'].where(out['Billed'] > 0) * 100.0).fillna(0.0)
+    return out.reset_index().sort_values('Outstanding', ascending=False, ignore_index=True)
@@ -0,0 +1,218 @@
+import os
+import sys
+from datetime import datetime
+import pandas as pd
+from snapshot import read_snapshot, snapshot_meta, write_snapshots
+from ids import new_id
+
+# --- SCHEMA VERSIONS & MIGRATION ---
+# Each workbook carries a hidden "_Schema" sheet (model + version). Loading goes:
+#   1. snapshot manifest says the frames were normalized for this model/version -> return them as-is
+#   2. otherwise ONE openpyxl pass, normalize (missing columns, numeric / text / date types),
+#      stamp the workbook if it was older (one-time upgrade) and write a tagged snapshot
+# So column patching only runs after the workbook changed outside a normalized save; steady-state
+# loads are a plain Arrow read. Bump a model's version when its columns or types change.
+#
+# Models:
+#   master : app12.py  Finance_Master_V5.xlsx  (Quotations / Invoices / Payments / Archived)
+#   legacy : app.py    Finance_Ledger.xlsx     (Invoices / Payments)
+# migrate_legacy_workbook() converts a legacy workbook into a new master workbook.
+
+STAMP_SHEET = '_Schema'
+
+MASTER_SHEETS = {
+    'Quotations': ['Quote_ID', 'Date', 'Business', 'Project_Name', 'Total_Value', 'Agreement_File', 'Status'],
+    'Invoices': ['Invoice_No', 'Quote_Ref', 'Date', 'Business', 'Split_Amount', 'Description', 'Invoice_File',
+                 'Declaration_File'],
+    'Payments': ['Payment_ID', 'Parent_Payment_ID', 'Invoice_Ref', 'Quote_Ref', 'Date', 'Amount', 'Proof_File',
+                 'Form_C_File', 'Payment_Decl_File'],
+    # one summary row per quote moved to the cold archive (archive.py)
+    'Archived': ['Quote_ID', 'Date', 'Business', 'Project_Name', 'Total_Value', 'Billed', 'Collected', 'Invoices',
+                 'Payments', 'Files', 'Archive_Batch', 'Archived_At'],
+}
+LEGACY_SHEETS = {
+    'Invoices': ['Invoice_No', 'Date', 'Entry_Date', 'Client', 'Project_Name', 'Total_Amount', 'PDF_File',
+                 'Business_Unit'],
+    'Payments': ['Payment_ID', 'Invoice_Ref', 'Amount_Received', 'Method', 'Proof_File', 'Payment_Date',
+                 'Entry_Date'],
+}
+
+# per model, per sheet: column -> kind ('num', 'str', 'str_blank', 'file', 'date')
+_TYPES = {
+    'master': {
+        'Quotations': {'Total_Value': 'num', 'Quote_ID': 'str', 'Agreement_File': 'file'},
+        'Invoices': {'Split_Amount': 'num', 'Invoice_No': 'str', 'Quote_Ref': 'str',
+                     'Invoice_File': 'file', 'Declaration_File': 'file'},
+        'Payments': {'Amount': 'num', 'Invoice_Ref': 'str', 'Quote_Ref': 'str_blank', 'Payment_ID': 'str',
+                     'Parent_Payment_ID': 'str_blank', 'Proof_File': 'file', 'Form_C_File': 'file',
+                     'Payment_Decl_File': 'file'},
+        'Archived': {'Quote_ID': 'str', 'Total_Value': 'num', 'Billed': 'num', 'Collected': 'num',
+                     'Invoices': 'str_blank', 'Payments': 'str_blank', 'Files': 'str_blank', 'Archive_Batch': 'str'},
+    },
+    'legacy': {
+        'Invoices': {'Date': 'date', 'Entry_Date': 'date', 'Invoice_No': 'str', 'Business_Unit': 'str'},
+        'Payments': {'Payment_Date': 'date', 'Entry_Date': 'date'},
+    },
+}
+
+MODELS = {
+    'master': {'version': 2, 'sheets': MASTER_SHEETS},  # 2: Archived sheet
+    'legacy': {'version': 1, 'sheets': LEGACY_SHEETS},
+}
+
+
+def schema_tag(model):
+    return f"{model}:{MODELS[model]['version']}"
+
+
+def _coerce(s, kind):
+    if kind == 'num':
+        return pd.to_numeric(s, errors='coerce').fillna(0.0)
+    if kind == 'str':
+        return s.astype(str)
+    if kind == 'str_blank':
+        return s.fillna("").astype(str)
+    if kind == 'file':
+        return s.fillna("None").astype(str)
+    return pd.to_datetime(s, errors='coerce')
+
+
+def normalize(model, frames):
+    """Model columns first (missing ones added as ""), extra columns kept after them, types enforced."""
+    out = {}
+    for name, cols in MODELS[model]['sheets'].items():
+        df = frames.get(name)
+        df = pd.DataFrame(columns=cols) if df is None else df.copy()
+        for c in cols:
+            if c not in df.columns:
+                df[c] = ""
+        df = df[cols + [c for c in df.columns if c not in cols]]
+        for c, kind in _TYPES[model][name].items():
+            df[c] = _coerce(df[c], kind)
+        out[name] = df
+    return out
+
+
+def stamp_frame(model):
+    return pd.DataFrame({'Key': ['model', 'version', 'migrated_at'],
+                         'Value': [model, str(MODELS[model]['version']), datetime.now().isoformat(timespec='seconds')]})
+
+
+def read_stamp(df):
+    """(model, version) from a _Schema sheet; (None, 0) for unstamped workbooks."""
+    if df is None or not {'Key', 'Value'} <= set(df.columns):
+        return None, 0
+    kv = dict(zip(df['Key'].astype(str), df['Value']))
+    try:
+        return kv.get('model'), int(kv.get('version', 0))
+    except (TypeError, ValueError):
+        return kv.get('model'), 0
+
+
+def write_stamp(writer, model):
+    """Add the hidden _Schema sheet to an open openpyxl ExcelWriter."""
+    stamp_frame(model).to_excel(writer, sheet_name=STAMP_SHEET, index=False)
+    writer.book[STAMP_SHEET].sheet_state = 'hidden'
+
+
+def upgrade_workbook(path, model, data):
+    """One-time rewrite of the model sheets (other sheets untouched) with the current stamp."""
+    with pd.ExcelWriter(path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+        for name, df in data.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+        write_stamp(writer, model)
+
+
+def load_workbook(path, model):
+    """
+    Normalized model sheets of the workbook at `path` ({sheet: DataFrame}).
+    Raises like pd.read_excel when the workbook is missing.
+    """
+    sheets = MODELS[model]['sheets']
+    meta = snapshot_meta(path)
+    if meta and meta.get('schema') == schema_tag(model):
+        cached = read_snapshot(path, sheets)
+        if cached is not None:
+            return cached
+
+    frames = pd.read_excel(path, sheet_name=None)
+    stamped_model, version = read_stamp(frames.get(STAMP_SHEET))
+    data = normalize(model, frames)
+    if stamped_model != model or version < MODELS[model]['version']:
+        try:
+            upgrade_workbook(path, model, data)
+        except Exception as e:  # read-only / open in Excel: still usable, retried next load
+            print(f"Schema upgrade skipped: {e}")
+    write_snapshots(path, data, meta={'schema': schema_tag(model)})
+    return {n: df[sheets[n]] for n, df in data.items()}
+
+
+# --- LEGACY -> MASTER ---
+
+def legacy_to_master(df_inv, df_pay):
+    """
+    app.py ledger -> app12 model. One quotation per (Business_Unit, Project_Name) valued at what was
+    billed; payments keep their ids and get the Quote_Ref of their invoice when it is unambiguous.
+    """
+    data = normalize('legacy', {'Invoices': df_inv, 'Payments': df_pay})
+    inv, pay = data['Invoices'], data['Payments']
+    inv['Total_Amount'] = pd.to_numeric(inv['Total_Amount'], errors='coerce').fillna(0.0)
+    inv['Project_Name'] = inv['Project_Name'].fillna("").astype(str)
+
+    groups = inv.groupby(['Business_Unit', 'Project_Name'], sort=False)
+    qt = groups.agg(Date=('Date', 'min'), Total_Value=('Total_Amount', 'sum')).reset_index()
+    qt['Quote_ID'] = [new_id('QT') for _ in range(len(qt))]
+    qt = qt.rename(columns={'Business_Unit': 'Business'})
+    qt['Agreement_File'] = "None"
+    qt['Status'] = 'Migrated'
+    quote_of = dict(zip(zip(qt['Business'], qt['Project_Name']), qt['Quote_ID']))
+
+    client = inv['Client'].fillna("").astype(str)
+    invoices = pd.DataFrame({
+        'Invoice_No': inv['Invoice_No'],
+        'Quote_Ref': [quote_of[k] for k in zip(inv['Business_Unit'], inv['Project_Name'])],
+        'Date': inv['Date'],
+        'Business': inv['Business_Unit'],
+        'Split_Amount': inv['Total_Amount'],
+        'Description': client.where(client != "", inv['Project_Name']),
+        'Invoice_File': inv['PDF_File'].replace("", None),
+        'Declaration_File': "None",
+    })
+
+    # invoice numbers that exist in more than one quote can't be allocated automatically
+    refs = invoices.groupby('Invoice_No')['Quote_Ref'].agg(lambda s: s.iloc[0] if s.nunique() == 1 else "")
+    pay_ids = pay['Payment_ID'].fillna("").astype(str)
+    payments = pd.DataFrame({
+        'Payment_ID': pay_ids,
+        'Parent_Payment_ID': pay_ids,
+        'Invoice_Ref': pay['Invoice_Ref'].astype(str),
+        'Quote_Ref': pay['Invoice_Ref'].astype(str).map(refs).fillna(""),
+        'Date': pay['Payment_Date'],
+        'Amount': pay['Amount_Received'],
+        'Proof_File': pay['Proof_File'].replace("", None),
+        'Form_C_File': "None",
+        'Payment_Decl_File': "None",
+    })
+    return normalize('master', {'Quotations': qt, 'Invoices': invoices, 'Payments': payments})
+
+
+def migrate_legacy_workbook(src, dst):
+    """Write a new stamped master workbook at `dst` from the legacy workbook `src`. Never overwrites."""
+    if os.path.exists(dst):
+        raise FileExistsError(dst)
+    legacy = load_workbook(src, 'legacy')
+    data = legacy_to_master(legacy['Invoices'], legacy['Payments'])
+    with pd.ExcelWriter(dst, engine='openpyxl') as writer:
+        for name, df in data.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+        write_stamp(writer, 'master')
+    write_snapshots(dst, data, meta={'schema': schema_tag('master')})
+    return {name: len(df) for name, df in data.items()}
+
+
+if __name__ == '__main__':
+    # python schema.py Finance_Ledger.xlsx Finance_Master_V5.xlsx
+    if len(sys.argv) != 3:
+        sys.exit("usage: python schema.py <legacy.xlsx> <new_master.xlsx>")
+    counts = migrate_legacy_workbook(sys.argv[1], sys.argv[2])
+    print(", ".join(f"{n}: {c}" for n, c in counts.items()))
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import pandas as pd
+from snapshot import file_fingerprint, snapshot_dir, write_snapshots
+from schema import MODELS, load_workbook, normalize, schema_tag, write_stamp
+
+# --- WORKBOOK SHARDS ---
+# One workbook per (business unit, fiscal year) instead of one for the whole group:
+#   <workbook>_shards/manifest.json            : model, fiscal year start, (unit, year) -> shard file
+#   <workbook>_shards/<unit>/FY2025.xlsx       : the model sheets with only that unit's rows of that year
+# Every shard is a normal stamped workbook with its own Arrow snapshot (schema.load_workbook), so
+#   - load() reads only the shards of the requested units / years, and a shard edited in Excel is the
+#     only one that goes through openpyxl again
+#   - save() rewrites only the shards whose rows changed (usually one), each through a temp file, and
+#     then the manifest: a failed write can damage one unit-year, never the group's history
+# Rows go by their unit and their own date; payments (no unit column) follow their quote, else their
+# invoice. Rows without a date land in an "undated" shard, rows without a unit under UNASSIGNED.
+# python shards.py Finance_Master_V5.xlsx master  -> creates the layout (the workbook is left as is)
+
+MANIFEST = 'manifest.json'
+FISCAL_YEAR_START = 1  # month the fiscal year starts in; FY2025 is the year that starts in 2025
+UNASSIGNED = '_Unassigned'
+
+# per model, per sheet: (unit column, date column); None = derived from the invoice / quote
+PARTITION = {
+    'master': {'Quotations': ('Business', 'Date'), 'Invoices': ('Business', 'Date'), 'Payments': (None, 'Date'),
+               'Archived': ('Business', 'Date')},
+    'legacy': {'Invoices': ('Business_Unit', 'Date'), 'Payments': (None, 'Payment_Date')},
+}
+
+
+def shard_root(path):
+    return f"{os.path.splitext(path)[0]}_shards"
+
+
+def open_store(path, model):
+    """ShardStore of the workbook at `path` if it was split, else None."""
+    root = shard_root(path)
+    return ShardStore(root, model) if os.path.exists(os.path.join(root, MANIFEST)) else None
+
+
+def fiscal_years(dates, start=FISCAL_YEAR_START):
+    """Fiscal year of each date (float, NaN when there is no usable date)."""
+    d = pd.to_datetime(pd.Series(dates), errors='coerce')
+    return d.dt.year - (d.dt.month < start).astype(int)
+
+
+def _first(keys, values):
+    return pd.Series(values.to_numpy(), index=keys.astype(str).to_numpy()).groupby(level=0).first()
+
+
+def _units(model, name, frames):
+    unit_col = PARTITION[model][name][0]
+    if unit_col is not None:
+        units = frames[name][unit_col]
+    else:
+        inv, pay = frames['Invoices'], frames['Payments']
+        units = pay['Invoice_Ref'].astype(str).map(_first(inv['Invoice_No'], inv[PARTITION[model]['Invoices'][0]]))
+        if model == 'master':
+            # allocated lines follow their quote (an invoice can span quotes of one unit only)
+            q = frames['Quotations']
+            units = pay['Quote_Ref'].astype(str).map(_first(q['Quote_ID'], q['Business'])).fillna(units)
+    units = units.fillna("").astype(str).str.strip()
+    return units.mask(units.isin(["", "nan", "None"]), UNASSIGNED)
+
+
+def partition(model, frames, start=FISCAL_YEAR_START):
+    """{(unit, fiscal year or None): {sheet: rows}} of normalized frames; every shard has every sheet."""
+    sheets = MODELS[model]['sheets']
+    frames = normalize(model, frames)
+    parts = {}
+    for name, (_, date_col) in PARTITION[model].items():
+        df = frames[name][sheets[name]].copy()
+        df[date_col] = pd.to_datetime(df[date_col], errors='coerce')  # what the shard gives back when read
+        years = fiscal_years(df[date_col], start).astype(object)
+        years = years.where(years.notna(), None).to_numpy()
+        units = _units(model, name, frames).to_numpy()
+        for key, rows in df.groupby([units, years], sort=False, dropna=False):
+            key = (key[0], None if pd.isna(key[1]) else int(key[1]))
+            parts.setdefault(key, {})[name] = rows.reset_index(drop=True)
+    for part in parts.values():
+        for name, cols in sheets.items():
+            part.setdefault(name, frames[name][cols].iloc[0:0])
+    return parts
+
+
+def _same(a, b):
+    for name in a:
+        try:
+            pd.testing.assert_frame_equal(a[name], b[name], check_dtype=False, check_index_type=False)
+        except AssertionError:
+            return False
+    return True
+
+
+def _label(year):
+    return f"FY{year}" if year is not None else "undated"
+
+
+class ShardStore:
+    """The sharded layout of one workbook. Writes are not locked here: LedgerService serializes them."""
+
+    def __init__(self, root, model):
+        self.root = root
+        self.model = model
+        self._manifest = (None, None)  # (fingerprint, parsed) of manifest.json
+
+    def manifest(self):
+        path = os.path.join(self.root, MANIFEST)
+        fp = file_fingerprint(path)
+        if fp is None:
+            return None
+        if self._manifest[0] != fp:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._manifest = (fp, json.load(f))
+        return self._manifest[1]
+
+    def entries(self, businesses=None, years=None):
+        """Manifest entries of the given units / fiscal years (all when None)."""
+        manifest = self.manifest() or {'shards': []}
+        return [e for e in manifest['shards']
+                if (businesses is None or e['business'] in businesses)
+                and (years is None or e['fiscal_year'] in years)]
+
+    def businesses(self):
+        return sorted({e['business'] for e in self.entries()} - {UNASSIGNED})
+
+    def fingerprint(self):
+        """Changes when the manifest or any shard on disk changes (a few stats, no reads)."""
+        files = [MANIFEST] + [e['file'] for e in self.entries()]
+        ids = "|".join(f"{f}={file_fingerprint(os.path.join(self.root, f))}" for f in files)
+        return hashlib.sha1(ids.encode('utf-8')).hexdigest()[:16]
+
+    def load(self, businesses=None, years=None):
+        """Normalized model sheets of the requested shards only ({sheet: DataFrame})."""
+        parts = [load_workbook(os.path.join(self.root, e['file']), self.model)
+                 for e in self.entries(businesses, years)]
+        out = {}
+        for name, cols in MODELS[self.model]['sheets'].items():
+            frames = [p[name] for p in parts if len(p[name])]
+            out[name] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=cols)
+        return normalize(self.model, out)
+
+    def _write(self, rel, part):
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp.xlsx"
+        with pd.ExcelWriter(tmp, engine='openpyxl') as writer:
+            for name, df in part.items():
+                df.to_excel(writer, sheet_name=name, index=False)
+            write_stamp(writer, self.model)
+        os.replace(tmp, path)
+        write_snapshots(path, part, meta={'schema': schema_tag(self.model)})
+
+    def _file_for(self, key, taken):
+        folder = re.sub(r'[^\w\- .]', '_', key[0]).strip(' .') or '_'
+        rel = f"{folder}/{_label(key[1])}.xlsx"
+        n = 2
+        while rel in taken:  # two unit names that clean up to the same folder
+            rel = f"{folder}_{n}/{_label(key[1])}.xlsx"
+            n += 1
+        return rel
+
+    def save(self, frames, previous=None):
+        """
+        Write the shards whose rows differ from `previous` (every shard when None), then the manifest.
+        Returns the (unit, fiscal year) keys written or removed.
+        """
+        manifest = self.manifest() or {'model': self.model, 'schema': schema_tag(self.model),
+                                       'fiscal_year_start': FISCAL_YEAR_START, 'shards': []}
+        start = manifest.get('fiscal_year_start', FISCAL_YEAR_START)
+        entries = {(e['business'], e['fiscal_year']): e for e in manifest['shards']}
+        new = partition(self.model, frames, start)
+        old = partition(self.model, previous, start) if previous is not None else {}
+        changed = []
+        for key, part in new.items():
+            if key in entries and key in old and _same(part, old[key]):
+                continue
+            entry = entries.get(key) or {'business': key[0], 'fiscal_year': key[1],
+                                         'file': self._file_for(key, {e['file'] for e in entries.values()})}
+            self._write(entry['file'], part)
+            entry['rows'] = {name: len(df) for name, df in part.items()}
+            entries[key] = entry
+            changed.append(key)
+        for key in set(entries) - set(new):
+            if previous is None or key in old:  # left alone if it is not in the caller's data at all
+                path = os.path.join(self.root, entries.pop(key)['file'])
+                if os.path.exists(path):
+                    os.remove(path)
+                shutil.rmtree(snapshot_dir(path), ignore_errors=True)
+                changed.append(key)
+
+        manifest['shards'] = sorted(entries.values(), key=lambda e: (e['business'], e['fiscal_year'] or 0))
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, MANIFEST)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(f"{path}.tmp", path)
+        return changed
+
+
+def load_ledger(path, model, businesses=None, years=None):
+    """
+    Model sheets of some units / fiscal years, read-only. Sharded: only those shards are read;
+    single workbook: the whole file is loaded and filtered.
+    """
+    store = open_store(path, model)
+    if store is not None:
+        return store.load(businesses, years)
+    parts = partition(model, load_workbook(path, model))
+    keep = [p for (b, y), p in parts.items()
+            if (businesses is None or b in businesses) and (years is None or y in years)]
+    return {name: pd.concat([p[name] for p in keep], ignore_index=True) if keep else pd.DataFrame(columns=cols)
+            for name, cols in MODELS[model]['sheets'].items()}
+
+
+def split_workbook(path, model):
+    """Create the sharded layout next to the workbook at `path`. Never overwrites an existing one."""
+    if open_store(path, model) is not None:
+        raise FileExistsError(shard_root(path))
+    store = ShardStore(shard_root(path), model)
+    store.save(load_workbook(path, model))
+    return store.entries()
+
+
+if __name__ == '__main__':
+    # python shards.py Finance_Master_V5.xlsx master
+    if len(sys.argv) != 3 or sys.argv[2] not in MODELS:
+        sys.exit("usage: python shards.py <workbook.xlsx> <master|legacy>")
+    for e in split_workbook(sys.argv[1], sys.argv[2]):
+        print(f"{e['file']}: " + ", ".join(f"{n} {c}" for n, c in e['rows'].items()))
@@ -0,0 +1,157 @@
+import json
+import os
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - streamlit ships pyarrow, but keep Excel-only mode working
+    pa = None
+    feather = None
+
+# --- SNAPSHOT SIDECAR ---
+# Every successful workbook write also drops one Arrow IPC (Feather v2) file per sheet into
+# "<workbook>.snap/". The manifest remembers the fingerprint of the workbook it was taken from,
+# so a snapshot is only trusted while the .xlsx on disk is byte-for-byte the file we wrote.
+# If a human edits the workbook in Excel the fingerprint changes and loaders fall back to openpyxl.
+
+MANIFEST = 'manifest.json'
+
+
+def snapshot_dir(path):
+    return f"{path}.snap"
+
+
+def file_fingerprint(path):
+    """Cheap identity of a file on disk (size + mtime in ns). None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+def _arrow_safe(df):
+    """Coerce object columns with mixed Python types into something Arrow can store."""
+    out = df.copy()
+    for col in out.columns:
+        s = out[col]
+        if s.dtype != object:
+            continue
+        kind = infer_dtype(s, skipna=True)
+        if kind in ('date', 'datetime', 'datetime64'):
+            # Excel hands these back as datetime64, so store them the same way
+            out[col] = pd.to_datetime(s, errors='coerce')
+        elif kind not in ('string', 'empty', 'integer', 'floating', 'boolean', 'decimal', 'bytes'):
+            out[col] = s.where(s.isna(), s.astype(str))
+    out.columns = [str(c) for c in out.columns]
+    return out
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(snapshot_dir(path), MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshots(path, sheets, meta=None):
+    """
+    Write one Arrow snapshot per sheet for the workbook at `path`.
+    Call this AFTER the workbook itself has been fully written (the fingerprint is taken last).
+    `meta` is merged into the manifest (e.g. the schema version the frames were normalized to).
+    Returns True if the snapshot is now valid.
+    """
+    if pa is None or not os.path.exists(path):
+        return False
+
+    snap = snapshot_dir(path)
+    os.makedirs(snap, exist_ok=True)
+    manifest_path = os.path.join(snap, MANIFEST)
+
+    try:
+        # Invalidate first: a crash half-way must never leave a manifest pointing at mixed files
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        for name, df in sheets.items():
+            table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+            final = os.path.join(snap, f"{name}.arrow")
+            tmp = final + ".tmp"
+            # Uncompressed so reads can be served straight from the memory map
+            feather.write_feather(table, tmp, compression='uncompressed')
+            os.replace(tmp, final)
+
+        manifest = {
+            'source': os.path.basename(path),
+            'fingerprint': file_fingerprint(path),
+            'sheets': list(sheets.keys()),
+        }
+        manifest.update(meta or {})
+        tmp = manifest_path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_path)
+        return True
+    except Exception as e:
+        print(f"Snapshot skipped: {e}")
+        return False
+
+
+def snapshot_is_fresh(path, sheet_names):
+    manifest = _read_manifest(path)
+    if not manifest or manifest.get('fingerprint') != file_fingerprint(path):
+        return False
+    return all(s in manifest.get('sheets', []) for s in sheet_names)
+
+
+def _read_arrow(file_path, columns=None):
+    with pa.memory_map(file_path, 'r') as source:
+        available = pa.ipc.open_file(source).schema.names
+    if columns is not None:
+        # Only pull the columns the caller needs; missing ones are the loader's job to add
+        columns = [c for c in columns if c in available]
+    table = feather.read_table(file_path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def snapshot_meta(path):
+    """Manifest of the snapshot if it still matches the workbook on disk, else None."""
+    manifest = _read_manifest(path)
+    if not manifest or manifest.get('fingerprint') != file_fingerprint(path):
+        return None
+    return manifest
+
+
+def read_snapshot(path, sheets):
+    """Like read_sheets but snapshot-only: None when the snapshot is stale or unreadable."""
+    names = list(sheets.keys())
+    if pa is None or not snapshot_is_fresh(path, names):
+        return None
+    try:
+        snap = snapshot_dir(path)
+        return {n: _read_arrow(os.path.join(snap, f"{n}.arrow"), sheets[n]) for n in names}
+    except Exception as e:
+        print(f"Snapshot unreadable, using Excel: {e}")
+        return None
+
+
+def read_sheets(path, sheets):
+    """
+    Load several sheets of a workbook, preferring the Arrow snapshot.
+    `sheets` maps sheet name -> list of required columns (or None for all columns).
+    Falls back to ONE openpyxl pass over the workbook when the snapshot is stale,
+    then refreshes the snapshot so the next load is fast again.
+    Raises like pd.read_excel when the workbook or a sheet is missing.
+    """
+    names = list(sheets.keys())
+    cached = read_snapshot(path, sheets)
+    if cached is not None:
+        return cached
+
+    frames = pd.read_excel(path, sheet_name=names)
+    write_snapshots(path, frames)
+    return {n: (frames[n][[c for c in sheets[n] if c in frames[n].columns]] if sheets[n] is not None else frames[n])
+            for n in names}
@@ -0,0 +1,161 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+from schema import normalize
+
+# --- AS-OF (POINT-IN-TIME) LEDGER ---
+# Every row of the app.py ledger lives on two time axes:
+#   transaction time : Invoices.Date / Payments.Payment_Date  (when it happened)
+#   knowledge time   : when the ledger learned it - Entry_Date, else the time the history first saw the row
+# Ledger_History.sqlite keeps what is needed to answer "the ledger on 30 June as known on 5 July":
+#   rows       : the last synced version of every row (key, hash, known since). Rows from before the history
+#                existed and without an Entry_Date count as known from the start.
+#   superseded : change log. A row that was edited or deleted leaves its old version here together with
+#                the interval it was the truth [known_from, replaced_at).
+# sync_history() runs once per workbook version (cheap lookup otherwise) and diffs by row hash, so it
+# catches edits made in Excel as well as the app's own appends. timeline() lays current rows and old
+# versions side by side with their intervals once per version (the app caches it); as_of() then never
+# replays history - any (transaction date, knowledge date) pair is one vectorized mask over that table.
+
+HISTORY_FILE = 'Ledger_History.sqlite'
+KEY_COLS = {'Invoices': 'Invoice_No', 'Payments': 'Payment_ID'}
+TX_DATE = {'Invoices': 'Date', 'Payments': 'Payment_Date'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    app TEXT NOT NULL, sheet TEXT NOT NULL, row_key TEXT NOT NULL, hash INTEGER, known_from TEXT, row TEXT,
+    PRIMARY KEY (app, sheet, row_key)
+);
+CREATE TABLE IF NOT EXISTS superseded (
+    id INTEGER PRIMARY KEY, app TEXT NOT NULL, sheet TEXT NOT NULL, row_key TEXT NOT NULL,
+    known_from TEXT, replaced_at TEXT NOT NULL, row TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_superseded ON superseded (app, sheet, replaced_at);
+CREATE TABLE IF NOT EXISTS sync_state (app TEXT PRIMARY KEY, data_version TEXT);
+"""
+
+
+@contextmanager
+def open_history(path=HISTORY_FILE):
+    """Connection that commits on success and is always closed."""
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def row_keys(sheet, df):
+    """Stable row identity: the record id, plus its occurrence number when ids repeat (or are blank)."""
+    ids = df[KEY_COLS[sheet]].fillna("").astype(str)
+    return ids + "#" + ids.groupby(ids).cumcount().astype(str)
+
+
+def _hashes(df):
+    try:
+        h = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:  # unhashable cells (mixed objects straight from Excel)
+        h = pd.util.hash_pandas_object(df.astype(str), index=False)
+    return pd.Series(h.to_numpy().view('int64'), index=df.index)  # sqlite integers are signed
+
+
+def _iso(values):
+    d = pd.to_datetime(pd.Series(values), errors='coerce')
+    return d.dt.strftime('%Y-%m-%dT%H:%M:%S').astype(object).where(d.notna(), None).tolist()
+
+
+def _rows_json(df):
+    return [json.dumps(r, default=str) for r in df.astype(object).where(df.notna(), None).to_dict('records')]
+
+
+def sync_history(app, data_version, frames, path=HISTORY_FILE, now=None):
+    """
+    Record new, changed and deleted rows of the ledger `frames` (Invoices, Payments) since the last sync.
+    Only does work when `data_version` (the ledger fingerprint) changed. Returns True if it synced.
+    """
+    now = (now or datetime.now()).isoformat(timespec='seconds')
+    with open_history(path) as conn:
+        row = conn.execute("SELECT data_version FROM sync_state WHERE app = ?", (app,)).fetchone()
+        if row and row[0] == data_version:
+            return False
+        conn.execute("BEGIN IMMEDIATE")  # two sessions syncing the same version must not both log the changes
+        row = conn.execute("SELECT data_version FROM sync_state WHERE app = ?", (app,)).fetchone()
+        if row and row[0] == data_version:
+            return False
+        first = row is None
+        for sheet in KEY_COLS:
+            df = frames[sheet]
+            keys, hashes = row_keys(sheet, df), _hashes(df)
+            known = dict(conn.execute("SELECT row_key, hash FROM rows WHERE app = ? AND sheet = ?", (app, sheet)))
+            old_hash = pd.Series(known, dtype='Int64').reindex(keys.to_numpy())
+            new = old_hash.isna().to_numpy()
+            changed = ~new & (old_hash.to_numpy(dtype='int64', na_value=0) != hashes.to_numpy())
+            gone = sorted(set(known) - set(keys))
+
+            # old versions of edited / deleted rows go to the change log first
+            replaced = keys[changed].tolist() + gone
+            for i in range(0, len(replaced), 500):
+                chunk = replaced[i:i + 500]
+                conn.execute(
+                    "INSERT INTO superseded (app, sheet, row_key, known_from, replaced_at, row) "
+                    "SELECT app, sheet, row_key, known_from, ?, row FROM rows WHERE app = ? AND sheet = ? "
+                    f"AND row_key IN ({','.join('?' * len(chunk))})", [now, app, sheet] + chunk)
+                conn.execute(f"DELETE FROM rows WHERE app = ? AND sheet = ? AND row_key IN "
+                             f"({','.join('?' * len(chunk))})", [app, sheet] + chunk)
+
+            # new rows are known since their Entry_Date (from the start on the very first sync), edits since now
+            write = new | changed
+            entry = _iso(df.loc[write, 'Entry_Date']) if 'Entry_Date' in df.columns else [None] * int(write.sum())
+            since = [now if c else e if e is not None and e <= now else None if first else now
+                     for e, c in zip(entry, changed[write])]
+            conn.executemany(
+                "INSERT INTO rows (app, sheet, row_key, hash, known_from, row) VALUES (?, ?, ?, ?, ?, ?)",
+                zip([app] * len(since), [sheet] * len(since), keys[write], hashes[write].tolist(), since,
+                    _rows_json(df[write])))
+        conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (app, data_version))
+    return True
+
+
+def timeline(app, frames, path=HISTORY_FILE):
+    """
+    Bitemporal table per sheet, built once per ledger version: the current rows plus every superseded
+    version, each with _known_from / _replaced_at (NaT = known from the start / still current) and _tx.
+    """
+    out = {}
+    with open_history(path) as conn:
+        for sheet, date_col in TX_DATE.items():
+            df = frames[sheet]
+            known = dict(conn.execute("SELECT row_key, known_from FROM rows WHERE app = ? AND sheet = ?",
+                                      (app, sheet)).fetchall())
+            old = conn.execute("SELECT known_from, replaced_at, row FROM superseded "
+                               "WHERE app = ? AND sheet = ? ORDER BY id", (app, sheet)).fetchall()
+            cur = df.assign(_known_from=row_keys(sheet, df).map(known), _replaced_at=None)
+            if old:
+                past = pd.DataFrame([json.loads(r[2]) for r in old])
+                past = normalize('legacy', {sheet: past})[sheet].assign(
+                    _known_from=[r[0] for r in old], _replaced_at=[r[1] for r in old])
+                cur = pd.concat([cur, past[[c for c in cur.columns if c in past.columns]]], ignore_index=True)
+            for c in ('_known_from', '_replaced_at'):
+                cur[c] = pd.to_datetime(cur[c].astype(object), errors='coerce')
+            cur['_tx'] = pd.to_datetime(cur[date_col], errors='coerce')
+            out[sheet] = cur
+    return out
+
+
+def as_of(line, tx_until, known_on):
+    """
+    Sheets with transactions up to `tx_until` as they were known at the end of `known_on` (both dates).
+    `line`: timeline(). A single mask per sheet, no replay.
+    """
+    t_end = pd.Timestamp(tx_until).normalize() + pd.Timedelta(days=1)
+    k_end = pd.Timestamp(known_on).normalize() + pd.Timedelta(days=1)
+    out = {}
+    for sheet, df in line.items():
+        keep = ((df['_known_from'].isna() | (df['_known_from'] < k_end))
+                & (df['_replaced_at'].isna() | (df['_replaced_at'] >= k_end)) & (df['_tx'] < t_end))
+        out[sheet] = df.loc[keep.to_numpy(), [c for c in df.columns if not c.startswith('_')]].reset_index(drop=True)
+    return out
@@ -0,0 +1,68 @@
+import random
+import pandas as pd
+from integrity import ISSUE_COLS, check_ledger, update_integrity
+
+# update_integrity() re-checks only the keys a write touched; it must always agree with a full check_ledger().
+
+
+def _ledger():
+    q = pd.DataFrame({'Business': ['A', 'A', 'B'], 'Quote_ID': ['Q0', 'Q1', 'Q0'], 'Total_Value': [100.0, 50.0, 80.0]})
+    i = pd.DataFrame({'Business': ['A', 'A', 'B'], 'Invoice_No': ['I1', 'I1', 'I2'], 'Quote_Ref': ['Q1', 'Q1', 'Q0'],
+                      'Split_Amount': [20.0, 10.0, 40.0]})
+    p = pd.DataFrame({'Payment_ID': ['P6', 'P7', 'P7'], 'Invoice_Ref': ['I1', 'I1', 'I2'],
+                      'Quote_Ref': ['Q0', 'Q1', 'Q0'], 'Amount': [5.0, 5.0, 5.0]})
+    return q, i, p
+
+
+def _rows(issues):
+    out = issues[ISSUE_COLS].copy()
+    out['Amount'] = out['Amount'].round(2)
+    return sorted(map(tuple, out.astype(str).to_numpy().tolist()))
+
+
+def _assert_same(state, version, q, i, p):
+    assert _rows(update_integrity(state, version, q, i, p)) == _rows(check_ledger(q, i, p))
+
+
+def test_edits_keep_issues_on_untouched_rows():
+    q, i, p = _ledger()
+    state = {}
+    _assert_same(state, 0, q, i, p)
+    q = q.copy()
+    q.loc[0, 'Total_Value'] = 90.0  # P6 is still allocated to Q0, which is not on I1
+    _assert_same(state, 1, q, i, p)
+    i = i.copy()
+    i.loc[0, 'Split_Amount'] = 25.0  # P7 is still booked twice (its twin is on I2)
+    _assert_same(state, 2, q, i, p)
+
+
+def _random_write(rng, frames):
+    name = rng.choice(list(frames))
+    df = frames[name]
+    values = {'Business': ['A', 'B', ''], 'Quote_ID': ['Q0', 'Q1', 'Q2', ''],
+              'Quote_Ref': ['Q0', 'Q1', 'Q2', 'QX', ''], 'Invoice_No': ['I1', 'I2', 'I3', ''],
+              'Invoice_Ref': ['I1', 'I2', 'I3', 'IX', ''], 'Payment_ID': ['P6', 'P7', 'P8', '']}
+    op = rng.choice(['edit', 'delete', 'append'] if len(df) else ['append'])
+    if op == 'delete':
+        df = df.drop(df.index[rng.randrange(len(df))])
+    else:
+        row = df.iloc[rng.randrange(len(df))].to_dict() if len(df) else {c: values.get(c, [1.0])[0] for c in df}
+        for col in rng.sample(list(df.columns), rng.randint(1, 2)):
+            row[col] = rng.choice(values[col]) if col in values else float(rng.randrange(0, 120, 5))
+        if op == 'append':
+            df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
+        else:
+            df = df.copy()
+            df.loc[df.index[rng.randrange(len(df))]] = pd.Series(row)
+    frames[name] = df.reset_index(drop=True)
+
+
+def test_incremental_matches_full_check():
+    for seed in range(15):
+        rng = random.Random(seed)
+        q, i, p = _ledger()
+        frames = {'q': q, 'i': i, 'p': p}
+        state = {}
+        for version in range(20):
+            _assert_same(state, version, frames['q'], frames['i'], frames['p'])
+            _random_write(rng, frames)
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import pandas as pd
+from parser_pool import run_parsers
+
+# --- VAULT FULL-TEXT SEARCH ---
+# SQLite FTS5 index over every file stored under Master_Vault.
+#   files      : one row per vault path with its content hash (+ size/mtime for cheap re-scans)
+#   files_fts  : FTS5 table (rowid = files.id) holding file name + extracted text
+# Indexing is incremental: a path whose content hash did not change is never re-read.
+# safe_copy() queues each stored file for a single background indexer thread, so
+# uploads never wait on text extraction. PDF text is extracted in parser_pool workers (timeout,
+# memory cap), a whole sync batch at a time; a PDF that fails there is indexed by name only.
+
+INDEX_FILE = 'Vault_Index.sqlite'
+TEXT_TYPES = ('.csv', '.ofx', '.qfx', '.txt')
+INDEX_WORKERS = 2  # parser_pool workers extracting PDF text during a sync
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, content_hash TEXT,
+    business TEXT, size INTEGER, mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files (content_hash);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, body, tokenize='unicode61 remove_diacritics 2');
+"""
+
+_indexer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vault-index')
+_lock = threading.Lock()
+
+
+@contextmanager
+def open_index(path=INDEX_FILE):
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _business(rel_path):
+    parts = rel_path.replace('\\', '/').split('/')
+    return parts[0] if len(parts) > 1 else ""
+
+
+def pool_texts(paths, max_workers=INDEX_WORKERS):
+    """{path: PDF text}, extracted in parser_pool workers; a file that fails or times out reads as ""."""
+    jobs = {p: ('parse_with_text', p) for p in paths}
+    return {p: (result[1] if error is None else "") for p, result, error in run_parsers(jobs, max_workers=max_workers)}
+
+
+def file_text(path, raw=None):
+    """Searchable text of a vault file: PDF text layer, or the file itself for statements/notes."""
+    if path.lower().endswith('.pdf'):
+        return pool_texts([path])[path]
+    if path.lower().endswith(TEXT_TYPES):
+        if raw is None:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        return raw.decode('utf-8', errors='ignore')
+    return ""  # images etc.: searchable by file name only
+
+
+def _index_one(conn, path, rel, text=None):
+    # hash check first: unchanged content is never re-read for text
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    info = os.stat(path)
+
+    row = conn.execute("SELECT id, content_hash FROM files WHERE path = ?", (rel,)).fetchone()
+    if row and row[1] == digest:
+        conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE id = ?", (info.st_size, info.st_mtime_ns, row[0]))
+        return False
+
+    body = text if text is not None else file_text(path, raw)
+    if row:
+        conn.execute("DELETE FROM files_fts WHERE rowid = ?", (row[0],))
+        conn.execute("UPDATE files SET content_hash = ?, size = ?, mtime_ns = ? WHERE id = ?",
+                     (digest, info.st_size, info.st_mtime_ns, row[0]))
+        doc_id = row[0]
+    else:
+        doc_id = conn.execute(
+            "INSERT INTO files (path, content_hash, business, size, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+            (rel, digest, _business(rel), info.st_size, info.st_mtime_ns)).lastrowid
+    # the vault path is searchable too (folders carry Quote_ID / invoice numbers),
+    # with separators as spaces so "INV-2025-001" also matches "2025"
+    conn.execute("INSERT INTO files_fts (rowid, name, body) VALUES (?, ?, ?)",
+                 (doc_id, re.sub(r'[/_\-.]+', ' ', rel), body))
+    return True
+
+
+def index_file(path, vault, text=None, index_path=INDEX_FILE):
+    """
+    (Re)index one file. Skipped when the stored content hash is unchanged.
+    `text` can be passed in when a parser already extracted it. Returns True if the index changed.
+    """
+    rel = os.path.relpath(path, vault).replace('\\', '/')
+    with _lock, open_index(index_path) as conn:
+        return _index_one(conn, path, rel, text)
+
+
+def index_in_background(path, vault, text=None, index_path=INDEX_FILE):
+    """Queue a file for the background indexer (used by safe_copy)."""
+    return _indexer.submit(_safe_index, path, vault, text, index_path)
+
+
+def _safe_index(path, vault, text, index_path):
+    try:
+        return index_file(path, vault, text, index_path)
+    except Exception as e:
+        print(f"Vault index: could not index {path}: {e}")
+        return False
+
+
+def _stale(path, rel, hashes):
+    # a touched file whose bytes did not change keeps its text: no extraction for it
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest() != hashes.get(rel)
+    except OSError:
+        return False
+
+
+def sync_vault(vault, index_path=INDEX_FILE, batch=500):
+    """
+    Bring the index in line with the folder: new/changed files (size or mtime differs) are
+    indexed, deleted files dropped. Unchanged files cost one stat each; changes are written
+    in batches of `batch` files per transaction. Returns (indexed, removed).
+    """
+    with open_index(index_path) as conn:
+        rows = conn.execute("SELECT path, size, mtime_ns, content_hash FROM files").fetchall()
+    known = {p: (s, m) for p, s, m, _ in rows}
+    hashes = {p: h for p, _, _, h in rows}
+
+    seen, changed = set(), []
+    for root, _, names in os.walk(vault):
+        for name in names:
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, vault).replace('\\', '/')
+            seen.add(rel)
+            info = os.stat(full)
+            if known.get(rel) != (info.st_size, info.st_mtime_ns):
+                changed.append((full, rel))
+
+    indexed = 0
+    for k in range(0, len(changed), batch):
+        chunk = changed[k:k + batch]
+        texts = pool_texts([full for full, rel in chunk if full.lower().endswith('.pdf') and _stale(full, rel, hashes)])
+        with _lock, open_index(index_path) as conn:
+            for full, rel in chunk:
+                try:
+                    indexed += _index_one(conn, full, rel, texts.get(full))
+                except Exception as e:
+                    print(f"Vault index: could not index {full}: {e}")
+
+    gone = [p for p in known if p not in seen]
+    with _lock, open_index(index_path) as conn:
+        for p in gone:
+            conn.execute("DELETE FROM files_fts WHERE rowid = (SELECT id FROM files WHERE path = ?)", (p,))
+            conn.execute("DELETE FROM files WHERE path = ?", (p,))
+    return indexed, len(gone)
+
+
+def sync_vault_in_background(vault, index_path=INDEX_FILE):
+    return _indexer.submit(sync_vault, vault, index_path)
+
+
+def _fts_query(text):
+    # Every word must match; quoting keeps user input from being read as FTS syntax.
+    # A trailing * keeps prefix search ("INV-20*").
+    terms = []
+    for word in re.findall(r"[\w\-/.]+\*?", text):
+        prefix = word.endswith('*')
+        word = re.sub(r'[\-/.]+', ' ', word.rstrip('*')).strip()
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return " AND ".join(terms)
+
+
+def search(query, business=None, limit=50, index_path=INDEX_FILE):
+    """Best matches first: Path, Business, File, Snippet, Score (bm25, lower = better)."""
+    cols = ['Path', 'Business', 'File', 'Snippet', 'Score']
+    match = _fts_query(query)
+    if not match or not os.path.exists(index_path):
+        return pd.DataFrame(columns=cols)
+
+    sql = """
+        SELECT f.path, f.business, files_fts.name, snippet(files_fts, 1, '**', '**', ' … ', 12), bm25(files_fts)
+        FROM files_fts JOIN files f ON f.id = files_fts.rowid
+        WHERE files_fts MATCH ?"""
+    params = [match]
+    if business:
+        sql += " AND f.business = ?"
+        params.append(business)
+    sql += " ORDER BY bm25(files_fts) LIMIT ?"
+    params.append(int(limit))
+
+    with open_index(index_path) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    out = pd.DataFrame(rows, columns=cols)
+    out['File'] = out['Path'].str.rsplit('/', n=1).str[-1]
+    return out
+
+
+def same_content(rel_paths, vault, index_path=INDEX_FILE):
+    """Vault-relative path -> the other indexed paths holding byte-identical content."""
+    digests = {}
+    for rel in rel_paths:
+        try:
+            with open(os.path.join(vault, rel), 'rb') as f:
+                digests[rel] = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            continue
+    with open_index(index_path) as conn:
+        return {rel: [p for (p,) in conn.execute("SELECT path FROM files WHERE content_hash = ? AND path != ?",
+                                                 (digest, rel))]
+                for rel, digest in digests.items()}
+
+
+def file_records(sources):
+    """
+    Business + file name -> ledger record, for linking search hits back to rows.
+    `sources`: (kind, df, id_col, business_col, [file columns]) per sheet.
+    """
+    parts = []
+    for kind, df, id_col, biz_col, file_cols in sources:
+        if df.empty:
+            continue
+        cols = [c for c in file_cols if c in df.columns]
+        long = df[[id_col, biz_col] + cols].melt(id_vars=[id_col, biz_col], value_name='File').dropna(subset=['File'])
+        long = long[~long['File'].astype(str).isin(["None", "nan", "", "Manual_Entry"])]
+        parts.append(pd.DataFrame({
+            'Business': long[biz_col].astype(str), 'File': long['File'].astype(str),
+            'Record': kind + " " + long[id_col].astype(str),
+        }))
+    if not parts:
+        return pd.DataFrame(columns=['Business', 'File', 'Records'])
+    recs = pd.concat(parts, ignore_index=True).drop_duplicates()
+    return recs.groupby(['Business', 'File'])['Record'].agg(', '.join).rename('Records').reset_index()
+
+
+def link_hits(hits, records):
+    """Attach the Records column (e.g. 'Quote QT-2501-1, Invoice INV-9') to search hits."""
+    out = hits.merge(records, on=['Business', 'File'], how='left')
+    out['Records'] = out['Records'].fillna("")
+    return out
@@ -0,0 +1,352 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+import pandas as pd
+from parser_pool import run_parsers
+from vault_index import index_in_background, pool_texts
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - polling covers it
+    FileSystemEventHandler = object
+    Observer = None
+
+# --- VAULT WATCHER ---
+# Picks up PDFs that land in Master_Vault/<business>/... without going through the app
+# (field engineers, bank portal downloads) and turns them into drafts for approval:
+#   detect  : inotify through watchdog, or a size/mtime poll of the tree when that is unavailable
+#   debounce: a file is handled once it has been quiet for DEBOUNCE_SECONDS and its size/mtime
+#             did not move since the last event (half-written downloads wait)
+#   route   : folder first (<quote>/Agreements, Invoices, Payments/<invoice>), else the PDF text, read
+#             in parser_pool workers like the parse jobs (never in the watcher thread)
+#   parse   : the matching ingest.py parser, through parser_pool (isolated processes, timeouts)
+#   queue   : one draft per ledger record in Vault_Inbox.sqlite until approved or dismissed
+# Files the app stores itself are claim()ed first and never become drafts; files another app process
+# (app.py) stores are record_stored() in the inbox and skipped the same way. On the very first
+# start the existing vault is only recorded; later starts catch up on files dropped while down.
+
+INBOX_FILE = 'Vault_Inbox.sqlite'
+DEBOUNCE_SECONDS = 3.0
+POLL_SECONDS = 5.0
+PARSE_WORKERS = 2
+WATCH_TYPES = ('.pdf',)
+
+KIND_PARSER = {'quote': 'parse_multi_sow_agreement', 'invoice': 'parse_invoice_v2', 'payment': 'parse_payment'}
+FOLDER_KINDS = {'agreements': 'quote', 'invoices': 'invoice', 'payments': 'payment'}
+SKIP_FOLDERS = {'statements'}  # bank statements go through reconciliation
+CONTENT_HINTS = [
+    ('quote', r"scope\s+of\s+work|\bSOW\b|agreement"),
+    ('payment', r"remittance|payment\s+advice|receipt|transfer\s+confirmation|credited"),
+    ('invoice', r"invoice|bill\s+to"),
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS drafts (
+    id INTEGER PRIMARY KEY, path TEXT NOT NULL, business TEXT, kind TEXT, folder_ref TEXT,
+    ref TEXT, date TEXT, amount REAL, description TEXT, error TEXT,
+    status TEXT NOT NULL DEFAULT 'pending', detected_at TEXT
+);
+CREATE INDEX IF NOT EXISTS drafts_status ON drafts (status, business);
+"""
+DRAFT_COLS = ['id', 'path', 'business', 'kind', 'folder_ref', 'ref', 'date', 'amount', 'description', 'error',
+              'detected_at']
+
+
+@contextmanager
+def open_inbox(path=INBOX_FILE):
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _route_by_folder(path, vault):
+    # route() from the folder layout alone; kind "" = the folders don't tell, the text has to
+    parts = os.path.relpath(path, vault).replace('\\', '/').split('/')
+    if len(parts) < 2 or not path.lower().endswith(WATCH_TYPES):
+        return None
+    biz, folders = parts[0], [p.lower() for p in parts[1:-1]]
+    if SKIP_FOLDERS & set(folders):
+        return biz, None, ""
+    for k, folder in enumerate(folders):
+        kind = FOLDER_KINDS.get(folder)
+        if kind == 'payment':
+            # <biz>/Payments/<invoice_no>/slip.pdf
+            return biz, kind, parts[k + 2] if k + 2 < len(parts) - 1 else ""
+        if kind:
+            # <biz>/<quote_id>/Agreements/x.pdf, <biz>/<quote_id>/Invoices/x.pdf or <biz>/Invoices/x.pdf
+            return biz, kind, parts[k] if k >= 1 else ""
+    return biz, "", ""
+
+
+def route(path, vault, text=None):
+    """
+    (business, kind, folder_ref) of a vault file. kind is None when it is not a ledger document.
+    folder_ref is the Quote_ID folder of agreements / invoices, or the invoice folder of payments.
+    The PDF text is only read (or `text` used) when the folders don't tell.
+    """
+    r = _route_by_folder(path, vault)
+    if r is None or r[1] != "":
+        return r
+    text = text if text is not None else pool_texts([path], PARSE_WORKERS)[path]
+    for kind, pattern in CONTENT_HINTS:
+        if re.search(pattern, text or "", re.IGNORECASE):
+            return r[0], kind, ""
+    return r[0], None, ""
+
+
+def _iso(value):
+    if isinstance(value, (datetime, date, pd.Timestamp)):
+        return value.strftime('%Y-%m-%d')
+    return str(value) if value else ""
+
+
+def drafts_from_result(kind, folder_ref, result, error=None):
+    """Parser output -> draft dicts (ref, date, amount, description, error). Failures still queue one draft."""
+    if error is not None or result is None:
+        return [{'ref': folder_ref, 'date': "", 'amount': 0.0, 'description': "",
+                 'error': f"parse failed: {error}" if error else "nothing recognised"}]
+    if kind == 'quote':
+        items = result or []
+        if not items:
+            return [{'ref': folder_ref, 'date': "", 'amount': 0.0, 'description': "", 'error': "no SOW found"}]
+        return [{'ref': folder_ref if len(items) == 1 else "", 'date': _iso(it.get('date')),
+                 'amount': float(it.get('amount') or 0.0), 'description': str(it.get('name', "")), 'error': ""}
+                for it in items]
+    if kind == 'invoice':
+        items = result.get('items') or []
+        return [{'ref': str(result.get('no', "")), 'date': _iso(result.get('date')),
+                 'amount': float(result.get('total') or 0.0),
+                 'description': str(items[0].get('desc', "")) if items else "", 'error': ""}]
+    inv_ref, amount, p_date = result
+    return [{'ref': inv_ref or folder_ref, 'date': _iso(p_date), 'amount': float(amount or 0.0),
+             'description': "", 'error': "" if inv_ref or folder_ref else "invoice not recognised"}]
+
+
+def record_stored(path, vault, inbox_path=INBOX_FILE):
+    """
+    A file an app wrote itself (this process or another, e.g. app.py next to app12): mark it seen so no
+    watcher turns it into a draft, and close a pending draft that was dropped at the same path.
+    """
+    try:
+        info = os.stat(path)
+    except OSError:
+        return
+    rel = os.path.relpath(path, vault).replace('\\', '/')
+    with open_inbox(inbox_path) as conn:
+        conn.execute("INSERT OR REPLACE INTO seen (path, size, mtime_ns) VALUES (?, ?, ?)",
+                     (rel, info.st_size, info.st_mtime_ns))
+        conn.execute("UPDATE drafts SET status = 'duplicate' WHERE path = ? AND status = 'pending'", (rel,))
+
+
+def pending_drafts(business=None, inbox_path=INBOX_FILE):
+    sql, args = "SELECT " + ", ".join(DRAFT_COLS) + " FROM drafts WHERE status = 'pending'", ()
+    if business is not None:
+        sql, args = sql + " AND business = ?", (business,)
+    with open_inbox(inbox_path) as conn:
+        rows = conn.execute(sql + " ORDER BY id", args).fetchall()
+    return pd.DataFrame(rows, columns=DRAFT_COLS)
+
+
+def resolve_drafts(ids, status, inbox_path=INBOX_FILE):
+    """Close drafts as 'approved' / 'dismissed' / 'duplicate'."""
+    with open_inbox(inbox_path) as conn:
+        conn.executemany("UPDATE drafts SET status = ? WHERE id = ?", [(status, int(i)) for i in ids])
+
+
+class _Events(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ('created', 'modified', 'moved', 'closed'):
+            return
+        self.watcher.notify(getattr(event, 'dest_path', None) or event.src_path)
+
+
+class VaultWatcher:
+    """Background watcher for one vault folder; start() once per server process."""
+
+    def __init__(self, vault, inbox_path=INBOX_FILE, debounce=DEBOUNCE_SECONDS, poll=POLL_SECONDS,
+                 use_inotify=True):
+        self.vault = vault
+        self.inbox_path = inbox_path
+        self.debounce = debounce
+        self.poll = poll
+        self.use_inotify = use_inotify
+        self.mode = None
+        self._pending = {}  # path -> (last event, size, mtime_ns)
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    def start(self):
+        with open_inbox(self.inbox_path) as conn:
+            first_run = conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0] == 0
+        self._scan(baseline=first_run)
+        if self.use_inotify and Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_Events(self), self.vault, recursive=True)
+                self._observer.start()
+                self.mode = 'inotify'
+            except OSError as e:  # e.g. inotify watch limit reached
+                print(f"Vault watcher: inotify unavailable ({e}), polling")
+                self._observer = None
+        self.mode = self.mode or 'polling'
+        self._thread = threading.Thread(target=self._run, name='vault-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def claim(self, path):
+        """The app is writing `path` itself: don't turn it into a draft."""
+        with self._lock:
+            self._claimed.add(os.path.abspath(path))
+
+    def notify(self, path):
+        path = os.path.abspath(path)
+        try:
+            info = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._pending[path] = (time.monotonic(), info.st_size, info.st_mtime_ns)
+
+    def _scan(self, baseline=False):
+        with open_inbox(self.inbox_path) as conn:
+            known = {p: (s, m) for p, s, m in conn.execute("SELECT path, size, mtime_ns FROM seen")}
+        new = []
+        for root, _, names in os.walk(self.vault):
+            for name in names:
+                full = os.path.abspath(os.path.join(root, name))
+                try:
+                    info = os.stat(full)
+                except OSError:  # deleted / renamed while walking
+                    continue
+                if known.get(self._rel(full)) != (info.st_size, info.st_mtime_ns):
+                    new.append((full, info))
+        if baseline:
+            self._mark_seen([full for full, _ in new])
+            return
+        with self._lock:
+            for full, info in new:
+                if full not in self._pending:
+                    self._pending[full] = (time.monotonic(), info.st_size, info.st_mtime_ns)
+
+    def _rel(self, path):
+        return os.path.relpath(path, self.vault).replace('\\', '/')
+
+    def _mark_seen(self, paths):
+        rows = []
+        for p in paths:
+            try:
+                info = os.stat(p)
+            except OSError:
+                continue
+            rows.append((self._rel(p), info.st_size, info.st_mtime_ns))
+        with open_inbox(self.inbox_path) as conn:
+            conn.executemany("INSERT OR REPLACE INTO seen (path, size, mtime_ns) VALUES (?, ?, ?)", rows)
+
+    def _settled(self):
+        now, ready = time.monotonic(), []
+        with self._lock:
+            for path, (t, size, mtime) in list(self._pending.items()):
+                if now - t < self.debounce:
+                    continue
+                try:
+                    info = os.stat(path)
+                except OSError:  # deleted / renamed away before it settled
+                    del self._pending[path]
+                    continue
+                if (info.st_size, info.st_mtime_ns) != (size, mtime):
+                    self._pending[path] = (now, info.st_size, info.st_mtime_ns)  # still being written
+                    continue
+                del self._pending[path]
+                if path in self._claimed:
+                    self._claimed.discard(path)
+                    self._mark_seen([path])
+                    continue
+                ready.append(path)
+        return ready
+
+    def _unseen(self, paths):
+        # files another app process stored (record_stored) since the event: same size/mtime as seen
+        if not paths:
+            return paths
+        with open_inbox(self.inbox_path) as conn:
+            known = {p: (sz, m) for p, sz, m in conn.execute(
+                f"SELECT path, size, mtime_ns FROM seen WHERE path IN ({','.join('?' * len(paths))})",
+                [self._rel(p) for p in paths])}
+        out = []
+        for p in paths:
+            try:
+                info = os.stat(p)
+            except OSError:
+                continue
+            if known.get(self._rel(p)) != (info.st_size, info.st_mtime_ns):
+                out.append(p)
+        return out
+
+    def _run(self):
+        last_scan = time.monotonic()
+        while not self._stop.wait(0.5):
+            try:
+                if self.mode == 'polling' and time.monotonic() - last_scan >= self.poll:
+                    self._scan()
+                    last_scan = time.monotonic()
+                ready = self._unseen(self._settled())
+                if ready:
+                    self.ingest(ready)
+            except Exception as e:
+                print(f"Vault watcher: {e}")
+
+    def ingest(self, paths):
+        """Route + parse settled files and queue their drafts. Returns the number of drafts queued."""
+        # every file's text is extracted once: for routing when the folders don't tell (then the
+        # index gets it right away), else by the parse job that returns it for the index
+        by_folder = {path: _route_by_folder(path, self.vault) for path in paths}
+        texts = pool_texts([p for p, r in by_folder.items() if r is not None and r[1] == ""], PARSE_WORKERS)
+        routed, jobs = {}, {}
+        for path in paths:
+            r, text = by_folder[path], texts.get(path)
+            if text is not None:
+                r = route(path, self.vault, text)
+            if r and r[1]:
+                routed[path] = r
+                jobs[path] = ((KIND_PARSER[r[1]], path) if text is not None
+                              else ('parse_with_text', path, {'parser': KIND_PARSER[r[1]]}))
+            if path not in jobs or text is not None:
+                index_in_background(path, self.vault, text)  # searchable right away, ledger or not
+
+        detected = datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for path, result, error in run_parsers(jobs, max_workers=PARSE_WORKERS):
+            biz, kind, folder_ref = routed[path]
+            if jobs[path][0] == 'parse_with_text':
+                result, text = result if error is None else (None, None)
+                index_in_background(path, self.vault, text)
+            for d in drafts_from_result(kind, folder_ref, result, error):
+                rows.append((self._rel(path), biz, kind, folder_ref, d['ref'], d['date'], d['amount'],
+                             d['description'], d['error'], detected))
+        with open_inbox(self.inbox_path) as conn:
+            conn.executemany(
+                "INSERT INTO drafts (path, business, kind, folder_ref, ref, date, amount, description, error,"
+                " detected_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._mark_seen(paths)
+        return len(rows)